@@ -0,0 +1,116 @@
+import io
+import os
+import random
+import zipfile
+
+from PIL import Image, ImageDraw
+
+# Landscape pothi folios, scanned at a reduced size to keep the archives manageable
+PAGE_SIZE = (3000, 1000)
+
+PAPER = (225, 210, 180)
+INK = (25, 20, 15)
+RED = (190, 35, 30)
+BACKGROUND = (15, 15, 15)
+
+CHART_COLOURS = [(200, 30, 30), (30, 170, 40), (30, 40, 190), (220, 200, 30), (190, 40, 180), (30, 180, 190)]
+
+
+def make_page(rng, size=PAGE_SIZE):
+    """
+    Draws a synthetic manuscript folio: text lines on paper in front of a dark scan
+    background, with optional frame lines, margin numbers and a round red stamp.
+    """
+    width, height = size
+    page = Image.new("RGB", size, BACKGROUND)
+    draw = ImageDraw.Draw(page)
+    left, top, right, bottom = int(width * 0.03), int(height * 0.05), int(width * 0.97), int(height * 0.95)
+    draw.rectangle([left, top, right, bottom], fill=PAPER)
+
+    text_left, text_right = int(width * 0.12), int(width * 0.88)
+    line_height = max(8, height // 25)
+    for y in range(int(height * 0.2), int(height * 0.8), 2 * line_height):
+        x = text_left
+        while x < text_right:
+            glyph = rng.randint(line_height // 4, line_height)
+            draw.rectangle([x, y, x + glyph // 2, y + glyph], fill=INK)
+            x += glyph + rng.randint(2, line_height // 2)
+
+    frame = rng.choice([None, RED, INK])
+    if frame is not None:
+        line = max(2, width // 500)
+        for x in (text_left - 3 * line, text_right + 3 * line):
+            draw.rectangle([x, int(height * 0.15), x + line, int(height * 0.85)], fill=frame)
+
+    # Vertical page numbers in the margins
+    for x in (int(width * 0.05), int(width * 0.93)):
+        if rng.random() < 0.7:
+            for y in range(int(height * 0.4), int(height * 0.6), line_height):
+                draw.rectangle([x, y, x + line_height // 2, y + line_height // 2], fill=INK)
+
+    if rng.random() < 0.1:
+        radius = height // 12
+        cx, cy = rng.randint(text_left, text_right - radius), rng.randint(top + radius, bottom - radius)
+        draw.ellipse([cx - radius, cy - radius, cx + radius, cy + radius], outline=RED, width=max(3, radius // 5))
+        draw.ellipse([cx - radius // 2, cy - radius // 2, cx + radius // 2, cy + radius // 2], fill=RED)
+
+    return page
+
+
+def make_calibration_chart(size=PAGE_SIZE):
+    """
+    Draws a colour calibration target as scanned after the last folio.
+    """
+    width, height = size
+    chart = Image.new("RGB", size, (120, 120, 120))
+    draw = ImageDraw.Draw(chart)
+    patch_width, patch_height = width // 8, height // 4
+    for i in range(18):
+        x = width // 16 + (i % 6) * (patch_width + width // 40)
+        y = height // 10 + (i // 6) * (patch_height + height // 20)
+        draw.rectangle([x, y, x + patch_width, y + patch_height], fill=CHART_COLOURS[i % len(CHART_COLOURS)])
+    return chart
+
+
+def write_archive(path, pages, seed=0, size=PAGE_SIZE):
+    """
+    Writes a ZIP archive in the layout of the Staatsbibliothek's Tibetica downloads:
+    uncompressed TIFFs 00000001.tif, 00000002.tif, ... and a colour calibration chart
+    as the last page. The archive is named after its PPN.
+
+    Args:
+        path (str): Path of the ZIP archive, e.g. .../3347357484.zip.
+        pages (int): Number of folios, without the calibration chart.
+        seed (int): Seed of the random folios.
+        size (tuple): Width and height of a page.
+
+    Returns:
+        str: The path.
+    """
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zip_ref:
+        for number in range(1, pages + 2):
+            img = make_page(rng, size) if number <= pages else make_calibration_chart(size)
+            buffer = io.BytesIO()
+            img.save(buffer, "TIFF")
+            zip_ref.writestr(f"{number:08d}.tif", buffer.getvalue())
+    return path
+
+
+def generate_archives(out_dir, archives=2, pages=20, seed=0, size=PAGE_SIZE):
+    """
+    Generates synthetic archives, reusing those that already exist.
+
+    Returns:
+        list: Paths of the archives.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for index in range(archives):
+        ppn = str(3300000000 + seed * 1000 + index)
+        path = os.path.join(out_dir, f"{ppn}.zip")
+        if not os.path.exists(path):
+            write_archive(path + ".tmp", pages, seed=seed * 1000 + index, size=size)
+            os.replace(path + ".tmp", path)
+        paths.append(path)
+    return paths
@@ -0,0 +1,466 @@
+import argparse
+import json
+import math
+import random
+import re
+import resource
+import sys
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from aisisax.llm.schema import fields_from_prompt, json_schema
+from aisisax.llm.tokens import estimate_text_tokens
+
+# Image tokens of a page as the providers bill it at detail 'high', without decoding it
+MOCK_IMAGE_TOKENS = 765
+
+MOCK_MODELS = ["gpt-4o", "gpt-4o-mini", "llama3.2-vision"]
+
+
+class MockConfig:
+    """
+    Behaviour of the mock server.
+
+    Args:
+        latency (float): Mean seconds per request.
+        jitter (float): Standard deviation of the latency in seconds.
+        error_rate (float): Share of requests answered with a server error (500), also
+            the share of failed requests of a batch.
+        rate_limit_rate (float): Share of requests answered with a rate limit (429).
+        slots (int): Requests processed at the same time, more wait in a queue as on an
+            Ollama server. 0 = unlimited.
+        seed (int): Seed of the random answers, latencies and errors.
+    """
+
+    def __init__(self, latency=1.0, jitter=0.2, error_rate=0.0, rate_limit_rate=0.0, slots=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.slots = slots
+        self.seed = seed
+
+
+def mock_value(schema, rng, count=1):
+    """
+    Returns a random value matching a JSON schema as built by aisisax.llm.schema.
+
+    Arrays (the "pages" of packed answers) get one entry per image of the request.
+    """
+    types = schema.get("type")
+    if isinstance(types, list):
+        types = next((t for t in types if t != "null"), "null")
+
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if types == "object":
+        return {name: mock_value(value, rng, count) for name, value in schema.get("properties", {}).items()}
+    if types == "array":
+        items = [mock_value(schema.get("items", {}), rng) for _ in range(count)]
+        for index, item in enumerate(items, start=1):
+            if isinstance(item, dict) and "Page index" in item:
+                item["Page index"] = index
+        return items
+    if types == "boolean":
+        return rng.random() < 0.5
+    if types == "integer":
+        return rng.randint(1, 500) if rng.random() < 0.5 else None
+    if types == "null":
+        return None
+    return "none"
+
+
+def mock_answer(text, images, schema, rng):
+    """
+    Builds the answer to a request, from the structured output schema or else from the
+    field lines of the prompt.
+    """
+    if schema is None:
+        fields = fields_from_prompt(text)
+        if not fields:
+            return "This is a mock answer."
+        schema = json_schema(fields, packed=images > 1)
+    return json.dumps(mock_value(schema, rng, images))
+
+
+class MockState:
+    # Shared by the request threads of a server
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(config.slots) if config.slots else None
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.files = {}  # file ID -> file object with its "content", see MockHandler.upload_file
+        self.batches = {}  # batch ID -> batch object
+
+    def draw(self):
+        # One lock for all random draws, so runs with the same seed behave the same
+        with self.lock:
+            self.stats["requests"] += 1
+            roll = self.rng.random()
+            delay = max(0.0, self.rng.gauss(self.config.latency, self.config.jitter))
+            seed = self.rng.getrandbits(32)
+        if roll < self.config.rate_limit_rate:
+            return "rate_limit", 0.0, seed
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            return "error", delay / 2, seed
+        return "ok", delay, seed
+
+    def count(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def add_file(self, content, filename, purpose):
+        file = {"id": f"file-mock-{uuid.uuid4().hex[:12]}", "object": "file", "bytes": len(content),
+                "created_at": int(time.time()), "filename": filename, "purpose": purpose, "status": "processed"}
+        with self.lock:
+            self.files[file["id"]] = dict(file, content=content)
+        return file
+
+    def run_batch(self, batch_id):
+        """
+        Answers the requests of a batch like chat requests, without their latency. Requests
+        drawn as errors or rate limits go to the batch's error file.
+        """
+        batch = self.batches[batch_id]
+        lines = self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+        outputs = []
+        errors = []
+        for line in filter(str.strip, lines):
+            request = json.loads(line)
+            outcome, _, seed = self.draw()
+            if outcome == "ok":
+                body = request["body"]
+                text, images = _read_messages(body.get("messages", []), openai=True)
+                answer = mock_answer(text, images, _response_schema(body, openai=True), random.Random(seed))
+                prompt_tokens = estimate_text_tokens(text) + images * MOCK_IMAGE_TOKENS
+                completion_tokens = estimate_text_tokens(answer)
+                self.count(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+                response = {"status_code": 200, "body": _completion(body.get("model", "mock"), answer, prompt_tokens,
+                                                                    completion_tokens)}
+            else:
+                status = 429 if outcome == "rate_limit" else 500
+                self.count(**{"rate_limited" if status == 429 else "errors": 1})
+                error = {"message": "Rate limit reached for requests" if status == 429 else "The server had an error",
+                         "type": "rate_limit_error" if status == 429 else "server_error", "code": None}
+                response = {"status_code": status, "body": {"error": error}}
+            entry = {"id": f"batch_req_mock_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"],
+                     "response": dict(response, request_id=uuid.uuid4().hex), "error": None}
+            (outputs if outcome == "ok" else errors).append(json.dumps(entry))
+
+        def result_file(entries, name):
+            return self.add_file(("\n".join(entries) + "\n").encode("utf-8"), name, "batch_output")["id"] if entries else None
+
+        output_file_id = result_file(outputs, f"{batch_id}_output.jsonl")
+        error_file_id = result_file(errors, f"{batch_id}_error.jsonl")
+        with self.lock:
+            batch.update(status="completed", completed_at=int(time.time()), output_file_id=output_file_id,
+                         error_file_id=error_file_id,
+                         request_counts={"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)})
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Answers the OpenAI chat completions API and the Ollama chat API with random answers
+    that match the requested schema. OpenAI requests with "logprobs" get random logprobs.
+    The OpenAI files and batches endpoints run batches of chat requests, see
+    MockState.run_batch.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, content_type, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            data = chunk.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        file_match = re.fullmatch(r".*/files/([^/]+)/content", self.path)
+        batch_match = re.fullmatch(r".*/batches/([^/]+)", self.path)
+        if file_match:
+            self.send_file(file_match.group(1))
+        elif batch_match:
+            with self.state.lock:
+                batch = self.state.batches.get(batch_match.group(1))
+                batch = dict(batch) if batch is not None else None
+            if batch is None:
+                self.send_json(404, {"error": {"message": f"No batch {batch_match.group(1)}", "type": "invalid_request_error"}})
+            else:
+                self.send_json(200, batch)
+        elif self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": model, "object": "model", "created": 0, "owned_by": "mock"} for model in MOCK_MODELS]})
+        elif self.path == "/api/tags":
+            self.send_json(200, {"models": [{"name": model, "model": model} for model in MOCK_MODELS]})
+        elif self.path == "/mock/stats":
+            with self.state.lock:
+                stats = dict(self.state.stats)
+            # Peak RSS of the process serving, reported apart from the pipeline's
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            stats["peak_rss_mb"] = round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path.rstrip("/").endswith("/files"):
+            self.upload_file()
+            return
+        body = self.read_json()
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self.chat(body, openai=True)
+        elif self.path.rstrip("/").endswith("/batches"):
+            self.create_batch(body)
+        elif self.path == "/api/chat":
+            self.chat(body, openai=False)
+        elif self.path == "/api/generate":
+            # Warm-up requests only load the model
+            self.send_json(200, {"model": body.get("model"), "created_at": _now(), "response": "", "done": True})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def upload_file(self):
+        # Batch input files are uploaded as multipart/form-data with "file" and "purpose"
+        length = int(self.headers.get("Content-Length") or 0)
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+        message = BytesParser(policy=default_policy).parsebytes(header + self.rfile.read(length))
+        parts = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        if "file" not in parts:
+            self.send_json(400, {"error": {"message": "No file uploaded", "type": "invalid_request_error"}})
+            return
+        purpose = parts["purpose"].get_content().strip() if "purpose" in parts else "batch"
+        self.send_json(200, self.state.add_file(parts["file"].get_payload(decode=True), parts["file"].get_filename(), purpose))
+
+    def send_file(self, file_id):
+        with self.state.lock:
+            file = self.state.files.get(file_id)
+        if file is None:
+            self.send_json(404, {"error": {"message": f"No file {file_id}", "type": "invalid_request_error"}})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(file["content"])))
+        self.end_headers()
+        self.wfile.write(file["content"])
+
+    def create_batch(self, body):
+        with self.state.lock:
+            known = body.get("input_file_id") in self.state.files
+        if not known:
+            self.send_json(400, {"error": {"message": f"No file {body.get('input_file_id')}", "type": "invalid_request_error"}})
+            return
+        now = int(time.time())
+        batch = {"id": f"batch_mock_{uuid.uuid4().hex[:12]}", "object": "batch", "endpoint": body.get("endpoint"),
+                 "errors": None, "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window"),
+                 "status": "in_progress", "output_file_id": None, "error_file_id": None, "created_at": now,
+                 "in_progress_at": now, "expires_at": now + 24 * 3600, "completed_at": None,
+                 "request_counts": {"total": 0, "completed": 0, "failed": 0}, "metadata": body.get("metadata")}
+        with self.state.lock:
+            self.state.batches[batch["id"]] = batch
+        threading.Thread(target=self.state.run_batch, args=(batch["id"],), daemon=True).start()
+        self.send_json(200, batch)
+
+    def chat(self, body, openai):
+        outcome, delay, seed = self.state.draw()
+        if outcome == "rate_limit":
+            self.state.count(rate_limited=1)
+            self.send_error_body(429, "Rate limit reached for requests", openai, {"Retry-After": "1"})
+            return
+
+        text, images = _read_messages(body.get("messages", []), openai)
+        schema = _response_schema(body, openai)
+
+        if self.state.slots is not None:
+            self.state.slots.acquire()
+        try:
+            time.sleep(delay)
+        finally:
+            if self.state.slots is not None:
+                self.state.slots.release()
+
+        if outcome == "error":
+            self.state.count(errors=1)
+            self.send_error_body(500, "The server had an error while processing your request", openai)
+            return
+
+        answer = mock_answer(text, images, schema, random.Random(seed))
+        prompt_tokens = estimate_text_tokens(text) + images * MOCK_IMAGE_TOKENS
+        completion_tokens = estimate_text_tokens(answer)
+        self.state.count(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+        model = body.get("model", "mock")
+        stream = body.get("stream", not openai)  # Ollama streams unless told otherwise
+        if openai:
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            logprobs = _logprobs(_pieces(answer), random.Random(seed + 1)) if body.get("logprobs") else None
+            self.openai_answer(model, answer, prompt_tokens, completion_tokens, stream, include_usage, logprobs)
+        else:
+            self.ollama_answer(model, answer, prompt_tokens, completion_tokens, delay, stream)
+
+    def openai_answer(self, model, answer, prompt_tokens, completion_tokens, stream, include_usage=False, logprobs=None):
+        if not stream:
+            self.send_json(200, _completion(model, answer, prompt_tokens, completion_tokens, logprobs))
+            return
+
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+        def chunk(delta, finish_reason=None, token_logprobs=None):
+            body = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason,
+                                 "logprobs": {"content": token_logprobs} if token_logprobs is not None else None}]}
+            return f"data: {json.dumps(body)}\n\n"
+
+        chunks = [chunk({"role": "assistant", "content": ""})]
+        chunks += [chunk({"content": piece}, token_logprobs=[logprobs[index]] if logprobs is not None else None)
+                   for index, piece in enumerate(_pieces(answer))]
+        chunks.append(chunk({}, "stop"))
+        if include_usage:
+            chunks.append(f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model, 'choices': [], 'usage': usage})}\n\n")
+        chunks.append("data: [DONE]\n\n")
+        self.send_stream("text/event-stream", chunks)
+
+    def ollama_answer(self, model, answer, prompt_tokens, completion_tokens, delay, stream):
+        done = {"model": model, "created_at": _now(), "done": True, "done_reason": "stop",
+                "total_duration": int(delay * 1e9), "prompt_eval_count": prompt_tokens, "eval_count": completion_tokens}
+        if not stream:
+            self.send_json(200, dict(done, message={"role": "assistant", "content": answer}))
+            return
+
+        chunks = [json.dumps({"model": model, "created_at": _now(), "message": {"role": "assistant", "content": piece}, "done": False}) + "\n"
+                  for piece in _pieces(answer)]
+        chunks.append(json.dumps(dict(done, message={"role": "assistant", "content": ""})) + "\n")
+        self.send_stream("application/x-ndjson", chunks)
+
+    def send_error_body(self, status, message, openai, headers=None):
+        if openai:
+            error_type = "rate_limit_error" if status == 429 else "server_error"
+            self.send_json(status, {"error": {"message": message, "type": error_type, "code": None}}, headers)
+        else:
+            self.send_json(status, {"error": message}, headers)
+
+
+def _response_schema(body, openai):
+    # The structured output schema of a chat request, None if it has none
+    if openai:
+        response_format = body.get("response_format") or {}
+        return response_format.get("json_schema", {}).get("schema")
+    return body.get("format") if isinstance(body.get("format"), dict) else None
+
+
+def _completion(model, answer, prompt_tokens, completion_tokens, logprobs=None):
+    # An OpenAI chat completion that is not streamed
+    return {
+        "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}", "object": "chat.completion", "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                     "logprobs": {"content": logprobs} if logprobs is not None else None, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def _pieces(text, size=16):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _logprobs(pieces, rng):
+    # One "token" per piece, mostly confident as with a real model, and sometimes not
+    return [{"token": piece, "logprob": math.log(rng.uniform(0.5, 1.0) if rng.random() < 0.02 else rng.uniform(0.97, 1.0)),
+             "bytes": list(piece.encode("utf-8")), "top_logprobs": []} for piece in pieces]
+
+
+def _read_messages(messages, openai):
+    # Returns the text of the request and its number of images
+    texts = []
+    images = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    texts.append(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    images += 1
+        elif content:
+            texts.append(content)
+        if not openai:
+            images += len(message.get("images") or [])
+    return "\n".join(texts), images
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """
+    Starts the mock server in a background thread.
+
+    Returns:
+        ThreadingHTTPServer: The server, its URL is http://host:server.server_port.
+            Stop it with shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(config or MockConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Ollama server for benchmarks, answers with random values.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--latency", type=float, default=1.0, help="Mean seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Standard deviation of the latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests failing with 429")
+    parser.add_argument("--slots", type=int, default=0, help="Requests processed at the same time, 0 = unlimited")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(args.latency, args.jitter, args.error_rate, args.rate_limit_rate, args.slots, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(config)
+    print(f"Mock server listening on http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
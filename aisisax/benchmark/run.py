@@ -0,0 +1,297 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from aisisax.benchmark.archives import PAGE_SIZE, generate_archives
+from aisisax.io.ingest import plan_zip_pages
+from aisisax.io.results import write_parquet
+from aisisax.metrics import RunMetrics
+from aisisax.pipeline import DEFAULT_SETTINGS, run_analysis
+
+logger = logging.getLogger("tibet_processor")
+
+BENCHMARK_MODELS = {"openai": "gpt-4o-mini", "ollama": "llama3.2-vision"}
+
+# The directory aisisax is imported from, also used by the server process
+package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(latency, jitter, error_rate, rate_limit_rate, slots, seed):
+    """
+    Starts the mock server (aisisax.benchmark.mock_server) in its own process, so it
+    does not compete with the pipeline for the interpreter.
+
+    Returns:
+        tuple: (process, url)
+    """
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")])))
+    process = subprocess.Popen([
+        sys.executable, "-m", "aisisax.benchmark.mock_server", "--port", str(port),
+        "--latency", str(latency), "--jitter", str(jitter), "--error-rate", str(error_rate),
+        "--rate-limit-rate", str(rate_limit_rate), "--slots", str(slots), "--seed", str(seed),
+    ], stdout=subprocess.DEVNULL, env=env)
+    url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            with urllib.request.urlopen(f"{url}/api/tags", timeout=1):
+                return process, url
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("The mock server did not start")
+            time.sleep(0.1)
+
+
+def server_stats(url):
+    with urllib.request.urlopen(f"{url}/mock/stats", timeout=5) as response:
+        return json.loads(response.read())
+
+
+def directory_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # removed while walking
+    return size
+
+
+class DiskSampler:
+    """
+    Records the peak size of a directory while the pipeline runs.
+    """
+
+    def __init__(self, path, interval=0.5):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, directory_size(self.path))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, directory_size(self.path))
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+            "mean": round(float(np.mean(values)), 3), "max": round(float(np.max(values)), 3)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=package_root, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_benchmark(work_dir, backend="openai", archives=2, pages=20, page_size=PAGE_SIZE, latency=1.0, jitter=0.2,
+                  error_rate=0.0, rate_limit_rate=0.0, slots=0, seed=0, settings=None):
+    """
+    Runs the analysis pipeline on synthetic archives against the mock server.
+
+    Args:
+        work_dir (str): Directory for the archives, converted pages and results.
+        backend (str): "openai" or "ollama", the API the mock server is called through.
+        archives (int): Number of synthetic archives.
+        pages (int): Folios per archive, each archive also holds a calibration chart.
+        page_size (tuple): Width and height of the pages.
+        latency (float): Mean seconds per request of the mock server.
+        jitter (float): Standard deviation of the latency.
+        error_rate (float): Share of requests failing with a server error.
+        rate_limit_rate (float): Share of requests failing with a rate limit.
+        slots (int): Requests the mock server processes at the same time, 0 = unlimited.
+        seed (int): Seed of the archives and of the mock server.
+        settings (dict): Settings overriding DEFAULT_SETTINGS, e.g. max_in_flight.
+
+    Returns:
+        dict: The benchmark report, see README.
+    """
+    archive_dir = os.path.join(work_dir, "archives", f"{pages}x{page_size[0]}x{page_size[1]}_seed{seed}")
+    images_dir = os.path.join(work_dir, "images")
+    shutil.rmtree(images_dir, ignore_errors=True)  # converted pages of the last run
+    archive_paths = generate_archives(archive_dir, archives=archives, pages=pages, seed=seed, size=page_size)
+
+    page_list = []
+    for path in archive_paths:
+        page_list.extend(plan_zip_pages(path, os.path.join(images_dir, os.path.splitext(os.path.basename(path))[0])))
+
+    process, url = start_mock_server(latency, jitter, error_rate, rate_limit_rate, slots, seed)
+    try:
+        run_settings = dict(DEFAULT_SETTINGS)
+        run_settings.update({
+            "backend": backend,
+            "base_url": f"{url}/v1" if backend == "openai" else url,
+            "api_key": "mock",
+            "model": BENCHMARK_MODELS[backend],
+            "use_cache": False,
+            "reuse_fields": False,
+            "store_results": False,
+        })
+        run_settings.update(settings or {})
+
+        failed = 0
+        skipped = 0
+
+        def on_page(done, file_path, result, error):
+            nonlocal failed, skipped
+            failed += error is not None
+            skipped += error is None and result is None
+
+        metrics = RunMetrics(name="benchmark")
+        start_time = time.monotonic()
+        with DiskSampler(images_dir) as disk:
+            results, upload_stats = run_analysis(page_list, run_settings, on_page=on_page, metrics=metrics)
+            elapsed = time.monotonic() - start_time
+            # The conversion workers have exited with the run. The mock server and git are
+            # child processes as well, so this is read before they end
+            workers_rss = peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+            export_start = time.monotonic()
+            write_parquet(results.to_dataframe(), os.path.join(work_dir, "results.parquet"))
+            export_seconds = time.monotonic() - export_start
+
+        server = server_stats(url)
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = [row["Seconds"] for row in upload_stats]
+    summary = metrics.summary()
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": {
+            "backend": backend,
+            "archives": archives,
+            "pages_per_archive": pages,
+            "page_size": list(page_size),
+            "latency": latency,
+            "jitter": jitter,
+            "error_rate": error_rate,
+            "rate_limit_rate": rate_limit_rate,
+            "slots": slots,
+            "seed": seed,
+            "settings": {name: value for name, value in run_settings.items() if name not in ("ai_prompt", "api_key")},
+        },
+        "pages": len(page_list),
+        "analysed": len(results),
+        "failed": failed,
+        "skipped": skipped,  # calibration charts
+        "elapsed_s": round(elapsed, 3),
+        "pages_per_min": round(len(page_list) / elapsed * 60, 1) if elapsed else None,
+        "page_latency_s": percentiles(latencies),
+        "export_s": round(export_seconds, 3),
+        "stages": summary["stages"],
+        "models": summary["models"],
+        # Peak RSS of the pipeline process, and of its largest conversion worker. The mock
+        # server's is part of "server"
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "peak_rss_workers_mb": workers_rss,
+        "disk_mb": {
+            "archives": round(directory_size(archive_dir) / 1024 / 1024, 1),
+            "pages_peak": round(disk.peak / 1024 / 1024, 1),
+            "pages_final": round(directory_size(images_dir) / 1024 / 1024, 1),
+        },
+        "server": server,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the analysis pipeline offline, with synthetic archives and a mock LLM server."
+    )
+    parser.add_argument("-o", "--output", help="JSON report (default: print only)")
+    parser.add_argument("--work-dir", default=os.path.join(".cache", "benchmark"),
+                        help="Directory for the archives and converted pages, archives are reused between runs")
+    parser.add_argument("--backend", choices=list(BENCHMARK_MODELS), default="openai")
+    parser.add_argument("--archives", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=20, help="Folios per archive")
+    parser.add_argument("--page-size", type=int, nargs=2, default=list(PAGE_SIZE), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--latency", type=float, default=1.0, help="Mean seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Standard deviation of the latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests failing with 429")
+    parser.add_argument("--slots", type=int, default=0, help="Requests the server processes at the same time, 0 = unlimited")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_SETTINGS["max_in_flight"])
+    parser.add_argument("--pack-size", type=int, default=DEFAULT_SETTINGS["pack_size"])
+    parser.add_argument("--no-prefilter", action="store_true")
+    parser.add_argument("--model", help="Model of the requests (default: gpt-4o-mini, llama3.2-vision for Ollama)")
+    parser.add_argument("--cascade-model", help="Cheap model of a model cascade, e.g. gpt-4o-mini with --model gpt-4o")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    report = run_benchmark(
+        args.work_dir,
+        backend=args.backend,
+        archives=args.archives,
+        pages=args.pages,
+        page_size=tuple(args.page_size),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        slots=args.slots,
+        seed=args.seed,
+        settings={
+            "max_in_flight": args.concurrency,
+            "pack_size": args.pack_size,
+            "prefilter": not args.no_prefilter,
+            "cascade_model": args.cascade_model,
+            **({"model": args.model} if args.model else {}),
+        },
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
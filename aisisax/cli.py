@@ -0,0 +1,196 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+from aisisax.io.ingest import TIFF_EXTENSIONS, plan_directory_pages, plan_zip_pages
+from aisisax.io.journal import Journal
+from aisisax.io.results import ResultBuffer, to_excel_bytes, write_csv, write_parquet
+from aisisax.llm.backend import BACKENDS
+from aisisax.metrics import RunMetrics
+from aisisax.pipeline import DEFAULT_SETTINGS, run_analysis, run_batch_analysis
+
+logger = logging.getLogger("tibet_processor")
+
+
+def plan_pages(inputs, images_dir):
+    """
+    Lists the pages of all inputs (directories, ZIP archives or single images).
+    """
+    pages = []
+    for path in inputs:
+        if os.path.isdir(path):
+            pages.extend(plan_directory_pages(path, images_dir))
+        elif path.lower().endswith('.zip'):
+            pages.extend(plan_zip_pages(path, os.path.join(images_dir, os.path.splitext(os.path.basename(path))[0])))
+        elif path.lower().endswith(TIFF_EXTENSIONS):
+            pages.append((None, path, os.path.join(images_dir, os.path.splitext(os.path.basename(path))[0] + '.jpg')))
+        elif os.path.isfile(path):
+            pages.append((None, path, path))
+        else:
+            logger.error(f"Input not found: {path}")
+    return pages
+
+
+def write_results(df, output):
+    """
+    Writes the results table, the format is chosen by the file extension.
+    """
+    extension = os.path.splitext(output)[1].lower()
+    if extension == '.parquet':
+        write_parquet(df, output)
+    elif extension == '.csv':
+        write_csv(df, output)
+    elif extension in ('.xlsx', '.xls'):
+        with open(output, "wb") as f:
+            f.write(to_excel_bytes(df))
+    else:
+        raise ValueError(f"Unsupported output format: {extension} (use .parquet, .csv or .xlsx)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m aisisax.cli",
+        description="Analyse manuscript pages without the Streamlit UI. Interrupted runs resume from the journal."
+    )
+    parser.add_argument("inputs", nargs="+", help="Directories, ZIP archives or page images")
+    parser.add_argument("-o", "--output", required=True, help="Results file (.parquet, .csv or .xlsx)")
+    parser.add_argument("--journal", help="Checkpoint journal (default: <output>.journal.jsonl)")
+    parser.add_argument("--images-dir", default="static/images", help="Directory for converted pages")
+    parser.add_argument("--prompt-file", help="Text file with the analysis prompt (default: built-in prompt)")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_SETTINGS["backend"])
+    parser.add_argument("--base-url", help="Server URL of the backend, e.g. a local OpenAI-compatible server")
+    parser.add_argument("--model", default=DEFAULT_SETTINGS["model"])
+    parser.add_argument("--temperature", type=float, default=DEFAULT_SETTINGS["temperature"])
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_SETTINGS["max_in_flight"],
+                        help="Maximum concurrent requests (Ollama uses at most the server's OLLAMA_NUM_PARALLEL slots)")
+    parser.add_argument("--pack-size", type=int, default=DEFAULT_SETTINGS["pack_size"],
+                        help="Pages per request, limited by the model's context and image limits (1 = off)")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_SETTINGS["requests_per_minute"], help="Requests per minute, 0 = unlimited")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_SETTINGS["tokens_per_minute"], help="Tokens per minute, 0 = unlimited")
+    parser.add_argument("--jpg-quality", type=int, default=DEFAULT_SETTINGS["jpg_quality"])
+    parser.add_argument("--detail", choices=["high", "low"], default=DEFAULT_SETTINGS["detail"])
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the analysis cache")
+    parser.add_argument("--no-reuse-fields", action="store_true",
+                        help="Ask for all fields, also those answered in earlier runs with the same question")
+    parser.add_argument("--no-store-results", action="store_true",
+                        help="Do not add the results to the result archive (AISISAX_RESULT_STORE)")
+    parser.add_argument("--no-structured-output", action="store_true",
+                        help="Do not constrain answers to the JSON schema of the prompt's fields")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_SETTINGS["max_retries"],
+                        help="Follow-up requests for missing or invalid fields per page")
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="Send every page to the model, without skipping calibration charts or answering frame lines and stamps locally")
+    parser.add_argument("--roi-crop", action="store_true",
+                        help="Send a reduced page view and a high-resolution image of the margins (one page per request)")
+    parser.add_argument("--roi-margin", type=float, default=DEFAULT_SETTINGS["roi_margin"],
+                        help="Share of the page width cut on either side as margin")
+    parser.add_argument("--cascade-model",
+                        help="Cheap model asked first, --model only gets the fields it is unsure about, e.g. gpt-4o-mini")
+    parser.add_argument("--cascade-threshold", type=float, default=DEFAULT_SETTINGS["cascade_threshold"],
+                        help="Confidence below which a field is escalated to --model")
+    parser.add_argument("--cascade-samples", type=int, default=DEFAULT_SETTINGS["cascade_samples"],
+                        help="Answers of the cheap model compared for the confidence if the backend has no logprobs")
+    parser.add_argument("--batch-api", action="store_true",
+                        help="Submit all pages through the OpenAI Batch API (cheaper, results within 24h)")
+    parser.add_argument("--poll-interval", type=float, default=30.0, help="Seconds between Batch API status checks")
+    parser.add_argument("--metrics", help="Write stage timings, tokens and cost of the run as JSON, with one record per page")
+    parser.add_argument("--prometheus", help="Write the run metrics in the Prometheus text format, e.g. for node_exporter's textfile collector")
+    return parser.parse_args(argv)
+
+
+def write_metrics(metrics, args):
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(metrics.to_json(pages=True))
+    if args.prometheus:
+        # Written next to the target and renamed, so a collector never reads half a file
+        with open(args.prometheus + ".tmp", "w", encoding="utf-8") as f:
+            f.write(metrics.to_prometheus())
+        os.replace(args.prometheus + ".tmp", args.prometheus)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update({
+        "backend": args.backend,
+        "base_url": args.base_url,
+        "temperature": args.temperature,
+        "model": args.model,
+        "use_cache": not args.no_cache,
+        "reuse_fields": not args.no_reuse_fields,
+        "store_results": not args.no_store_results,
+        "jpg_quality": args.jpg_quality,
+        "detail": args.detail,
+        "max_in_flight": args.concurrency,
+        "pack_size": args.pack_size,
+        "requests_per_minute": args.rpm,
+        "tokens_per_minute": args.tpm,
+        "structured_output": not args.no_structured_output,
+        "max_retries": args.max_retries,
+        "prefilter": not args.no_prefilter,
+        "roi_crop": args.roi_crop,
+        "roi_margin": args.roi_margin,
+        "cascade_model": args.cascade_model,
+        "cascade_threshold": args.cascade_threshold,
+        "cascade_samples": args.cascade_samples,
+    })
+    if args.prompt_file:
+        with open(args.prompt_file, encoding="utf-8") as f:
+            settings["ai_prompt"] = f.read()
+
+    pages = plan_pages(args.inputs, args.images_dir)
+
+    # Pages are identified by their output path, which is stable across runs
+    page_ids = {out_path: os.path.abspath(out_path) for _, _, out_path in pages}
+
+    metrics = RunMetrics(name=os.path.basename(args.output))
+    with Journal(args.journal or args.output + ".journal.jsonl") as journal:
+        todo = [page for page in pages if page_ids[page[2]] not in journal]
+        logger.info(f"Found {len(pages)} pages, {len(pages) - len(todo)} already done, {len(todo)} to analyse")
+
+        # Skipped calibration charts are journaled with an empty result, so they count as done
+        def record_page(done, file_path, result, error):
+            if error is None:
+                journal.append(page_ids[file_path], result)
+            logger.info(f"Progress: {done}/{len(todo)} pages")
+
+        try:
+            if args.batch_api:
+                batch_dir = os.path.join(os.path.dirname(os.path.abspath(args.output)), "batches")
+                run_batch_analysis(todo, settings, batch_dir, poll_interval=args.poll_interval,
+                                   on_page=lambda file_path, result: journal.append(page_ids[file_path], result),
+                                   metrics=metrics)
+            else:
+                run_analysis(todo, settings, on_page=record_page, metrics=metrics)
+        except KeyboardInterrupt:
+            logger.warning(f"Interrupted, {len(journal)} pages are saved in the journal. Run the same command again to resume")
+            metrics.finish()
+            write_metrics(metrics, args)
+            return 130
+
+        # Merge journal and new results in page order
+        results = ResultBuffer()
+        for index, (_, _, out_path) in enumerate(pages):
+            if journal.results.get(page_ids[out_path]) is not None:
+                results.add(journal.results[page_ids[out_path]], index)
+        complete = all(page_ids[out_path] in journal for _, _, out_path in pages)
+
+    start = time.perf_counter()
+    df = results.to_dataframe()
+    metrics.add("dataframe", time.perf_counter() - start)
+    start = time.perf_counter()
+    write_results(df, args.output)
+    metrics.add("export", time.perf_counter() - start)
+    logger.info(f"Wrote {len(df)} of {len(pages)} pages to {args.output}")
+
+    write_metrics(metrics, args)
+    return 0 if complete else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
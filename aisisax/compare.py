@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+# Columns that identify a page or are not answers
+KEY_COLUMNS = ["PPN", "Page number"]
+IGNORED_COLUMNS = {"Image"}
+
+
+def read_results(path):
+    """
+    Reads a results file as written by the CLI or the app (.parquet, .csv or .xlsx).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return pd.read_parquet(path)
+    if extension == ".xlsx":
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+
+def normalize(value):
+    # "true", True and 1 compare equal, as do "12" and 12
+    if pd.isna(value):
+        return None
+    text = str(value).strip().lower()
+    if text in ("true", "false"):
+        return text == "true"
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def compare_results(baseline, candidate, truth=None):
+    """
+    Compares the answers of two runs over the same pages, e.g. full pages and margin crops.
+
+    Args:
+        baseline (pd.DataFrame): Results of the reference run.
+        candidate (pd.DataFrame): Results of the run to compare.
+        truth (pd.DataFrame): Optional hand-checked answers for some or all pages.
+
+    Returns:
+        pd.DataFrame: One row per field with the number of compared pages, the share of
+            pages both runs agree on and, with truth, the accuracy of either run.
+    """
+    keys = [key for key in KEY_COLUMNS if key in baseline.columns and key in candidate.columns]
+    if not keys:
+        raise ValueError(f"The results have none of the key columns {', '.join(KEY_COLUMNS)}")
+    if truth is not None:
+        truth = truth.astype({key: baseline[key].dtype for key in keys if key in truth.columns})
+
+    fields = [column for column in baseline.columns
+              if column in candidate.columns and column not in keys and column not in IGNORED_COLUMNS]
+    merged = baseline.merge(candidate, on=keys, suffixes=(" (baseline)", " (candidate)"))
+
+    rows = []
+    for field in fields:
+        base = merged[f"{field} (baseline)"].map(normalize)
+        cand = merged[f"{field} (candidate)"].map(normalize)
+        row = {"Field": field, "Pages": len(merged), "Agreement": (base == cand).mean() if len(merged) else None}
+
+        if truth is not None and field in truth.columns:
+            checked = merged.merge(truth[keys + [field]], on=keys)
+            expected = checked[field].map(normalize)
+            row["Checked pages"] = len(checked)
+            row["Baseline accuracy"] = (checked[f"{field} (baseline)"].map(normalize) == expected).mean() if len(checked) else None
+            row["Candidate accuracy"] = (checked[f"{field} (candidate)"].map(normalize) == expected).mean() if len(checked) else None
+        rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the answers of two analysis runs, e.g. with and without margin crops."
+    )
+    parser.add_argument("baseline", help="Results of the reference run")
+    parser.add_argument("candidate", help="Results of the run to compare")
+    parser.add_argument("--truth", help="Hand-checked answers with PPN, page number and the fields to score")
+    args = parser.parse_args(argv)
+
+    truth = read_results(args.truth) if args.truth else None
+    report = compare_results(read_results(args.baseline), read_results(args.candidate), truth)
+    print(report.to_string(index=False, float_format=lambda value: f"{value:.1%}"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("tibet_processor")
+
+# Page images of all sessions, see ImageStore. Limits can be configured in the .env file
+image_store_dir = os.getenv("AISISAX_IMAGE_STORE", os.path.join(".cache", "images"))
+image_store_max_mb = float(os.getenv("AISISAX_IMAGE_STORE_MAX_MB", "2048"))
+image_store_ttl_hours = float(os.getenv("AISISAX_IMAGE_STORE_TTL_HOURS", "24"))
+
+# Sessions used within this time are never evicted to meet the quota
+ACTIVE_SECONDS = 15 * 60
+
+# Seconds between two runs of the background garbage collection
+GC_INTERVAL = 300
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def add_to_store(path, root=None):
+    """
+    Moves a page image into the content-addressed store and leaves a hard link in its place.
+
+    Identical pages of all sessions share one file in <root>/objects, named after the
+    SHA-256 of its content. The number of hard links of an object is its reference count:
+    every session that holds the page adds one. Falls back to keeping the file as it is
+    on file systems without hard links. Safe to call from worker processes.
+
+    Args:
+        path (str): A page image inside a session directory of the store.
+        root (str): Root of the store (default: AISISAX_IMAGE_STORE).
+
+    Returns:
+        str: The path, now a link to the stored object.
+    """
+    root = root or image_store_dir
+    digest = file_sha256(path)
+    object_path = os.path.join(root, "objects", digest[:2], digest + os.path.splitext(path)[1].lower())
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+
+    for _ in range(3):
+        try:
+            os.link(path, object_path)
+            return path  # first copy of this page, the file itself becomes the object
+        except FileExistsError:
+            pass
+        except OSError as e:
+            logger.debug(f"Cannot link {path} into the image store: {e}")
+            return path
+
+        # Replace the file with a link to the existing object, atomically
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(object_path, tmp_path)
+        except FileNotFoundError:
+            continue  # removed by the garbage collection in between, try again
+        except OSError as e:
+            logger.debug(f"Cannot link {path} into the image store: {e}")
+            return path
+        os.replace(tmp_path, path)
+        return path
+    return path
+
+
+class ImageStore:
+    """
+    Content-addressed page images with a namespace per session.
+
+    Every session writes its pages below <root>/sessions/<session id>, under their original
+    names, so concurrent sessions never overwrite each other's pages. Converted pages are
+    hard links into <root>/objects (see add_to_store), so a page uploaded by several
+    sessions is stored only once.
+
+    Thumbnails of the pages are kept in <root>/thumbnails, named after the SHA-256 of their
+    page like its object (see aisisax.ui.thumbnails).
+
+    Sessions expire ttl_hours after their last use. The garbage collection removes expired
+    sessions, objects no session refers to any more and thumbnails of pages that are not in
+    the store and were not shown for ttl_hours. While the store is larger than max_mb, it
+    also removes the idle thumbnails of such pages and evicts the least recently used idle
+    sessions.
+    """
+
+    def __init__(self, root=None, max_mb=None, ttl_hours=None):
+        self.root = root or image_store_dir
+        self.max_mb = image_store_max_mb if max_mb is None else max_mb
+        self.ttl_hours = image_store_ttl_hours if ttl_hours is None else ttl_hours
+        self._lock = threading.Lock()
+        self._collector = None
+
+    @property
+    def sessions_dir(self):
+        return os.path.join(self.root, "sessions")
+
+    @property
+    def objects_dir(self):
+        return os.path.join(self.root, "objects")
+
+    @property
+    def thumbnails_dir(self):
+        return os.path.join(self.root, "thumbnails")
+
+    def session_dir(self, session_id):
+        """
+        Returns the directory of a session and marks the session as used.
+        """
+        path = os.path.join(self.sessions_dir, _safe_name(session_id))
+        os.makedirs(path, exist_ok=True)
+        os.utime(path)
+        return path
+
+    def add(self, path):
+        return add_to_store(path, self.root)
+
+    def release(self, session_id):
+        """
+        Removes the pages of a session. Objects still used by other sessions are kept.
+        """
+        shutil.rmtree(os.path.join(self.sessions_dir, _safe_name(session_id)), ignore_errors=True)
+
+    def usage(self):
+        """
+        Returns:
+            dict: "size_mb" (hard links counted once), "objects" and "sessions".
+        """
+        size, inodes = _unique_size(self.root)
+        objects = sum(len(files) for _, _, files in os.walk(self.objects_dir))
+        sessions = len(_list_dirs(self.sessions_dir))
+        return {"size_mb": size / 1024 / 1024, "objects": objects, "sessions": sessions, "files": inodes}
+
+    def collect_garbage(self, keep=()):
+        """
+        Removes expired sessions, unreferenced objects and expired thumbnails, then removes
+        idle thumbnails and evicts idle sessions, least recently used first, until the
+        store fits its quota.
+
+        Args:
+            keep (iterable): Session IDs that must not be evicted, e.g. the caller's own.
+
+        Returns:
+            dict: Removed "sessions", "objects" and "thumbnails" and the "size_mb" afterwards.
+        """
+        with self._lock:
+            now = time.time()
+            keep = {_safe_name(session_id) for session_id in keep}
+            sessions = sorted(_list_dirs(self.sessions_dir), key=lambda entry: entry[1])
+            removed_sessions = 0
+
+            for name, last_used in sessions:
+                if name not in keep and now - last_used > self.ttl_hours * 3600:
+                    shutil.rmtree(os.path.join(self.sessions_dir, name), ignore_errors=True)
+                    removed_sessions += 1
+            removed_objects = self._remove_unreferenced()
+            removed_thumbnails, _ = self._remove_thumbnails(now - self.ttl_hours * 3600)
+
+            # The store is measured once, everything removed subtracts the bytes it frees
+            size, _ = _unique_size(self.root)
+            if size > self.max_mb * 1024 * 1024:
+                count, freed = self._remove_thumbnails(now - ACTIVE_SECONDS)
+                removed_thumbnails += count
+                size -= freed
+                for name, last_used in sessions:
+                    if size <= self.max_mb * 1024 * 1024:
+                        break
+                    session_path = os.path.join(self.sessions_dir, name)
+                    if name in keep or now - last_used < ACTIVE_SECONDS or not os.path.isdir(session_path):
+                        continue
+                    size -= _freed_size(session_path)
+                    shutil.rmtree(session_path, ignore_errors=True)
+                    removed_sessions += 1
+                removed_objects += self._remove_unreferenced()
+                count, freed = self._remove_thumbnails(now - ACTIVE_SECONDS)
+                removed_thumbnails += count
+                size -= freed
+                if size > self.max_mb * 1024 * 1024:
+                    logger.warning(f"Image store uses {size / 1024 / 1024:.0f} MB of {self.max_mb:.0f} MB, "
+                                   f"all remaining sessions are in use")
+
+            if removed_sessions or removed_objects or removed_thumbnails:
+                logger.info(f"Image store: removed {removed_sessions} sessions, {removed_objects} pages and "
+                            f"{removed_thumbnails} thumbnails, {size / 1024 / 1024:.0f} MB in use")
+            return {"sessions": removed_sessions, "objects": removed_objects, "thumbnails": removed_thumbnails,
+                    "size_mb": size / 1024 / 1024}
+
+    def _remove_unreferenced(self):
+        # An object with a single link is not used by any session
+        removed = 0
+        for root, _, files in os.walk(self.objects_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_nlink == 1:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def _remove_thumbnails(self, unused_since):
+        # Thumbnails of pages that are not in the store and were last shown before
+        # unused_since. Returns their number and size
+        digests = set()
+        for _, _, files in os.walk(self.objects_dir):
+            digests.update(os.path.splitext(name)[0] for name in files)
+        removed = 0
+        freed = 0
+        try:
+            with os.scandir(self.thumbnails_dir) as it:
+                entries = list(it)
+        except FileNotFoundError:
+            return 0, 0
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                if entry.name.split("_")[0] not in digests and stat.st_mtime < unused_since:
+                    os.remove(entry.path)
+                    removed += 1
+                    freed += stat.st_size
+            except FileNotFoundError:
+                pass
+        return removed, freed
+
+    def start_collector(self, interval=GC_INTERVAL):
+        """
+        Runs the garbage collection in a background thread, once per process.
+        """
+        with self._lock:
+            if self._collector is not None:
+                return
+
+            def collect():
+                while True:
+                    try:
+                        self.collect_garbage()
+                    except Exception as e:
+                        logger.error(f"Image store garbage collection failed: {str(e)}")
+                    time.sleep(interval)
+
+            self._collector = threading.Thread(target=collect, name="image-store-gc", daemon=True)
+            self._collector.start()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store():
+    """
+    Returns the process-wide image store, shared by all Streamlit sessions.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ImageStore()
+        return _default_store
+
+
+def _safe_name(session_id):
+    return "".join(c for c in str(session_id) if c.isalnum() or c in "-_") or "default"
+
+
+def _list_dirs(path):
+    # (name, last use) of the directories in path
+    entries = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        entries.append((entry.name, entry.stat().st_mtime))
+                except FileNotFoundError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _freed_size(session_path):
+    # Bytes freed by removing a session: its files without links outside of it, and those
+    # whose only other link is their object, which is then unreferenced
+    links = {}
+    for root, _, files in os.walk(session_path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            inode = (stat.st_dev, stat.st_ino)
+            count, _, _ = links.get(inode, (0, 0, 0))
+            links[inode] = (count + 1, stat.st_nlink, stat.st_size)
+    return sum(size for count, nlink, size in links.values() if nlink - count <= 1)
+
+
+def _unique_size(path):
+    # Size of a directory tree with every hard-linked file counted once
+    seen = set()
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                size += stat.st_size
+    return size, len(seen)
+
+
+def write_atomic(path, write):
+    """
+    Writes a file through a temporary file and renames it into place.
+
+    Pages in the store may be hard links shared with other sessions, so they must be
+    replaced, never overwritten in place.
+
+    Args:
+        path (str): The target path.
+        write (callable): Called with the open binary file object.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1] + ".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
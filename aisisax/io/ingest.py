@@ -0,0 +1,272 @@
+import io
+import logging
+import ntpath
+import os
+import shutil
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from aisisax.io.image_store import add_to_store, file_sha256, write_atomic
+from aisisax.io.prefilter import prefilter_page
+
+logger = logging.getLogger("tibet_processor")
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def save_upload(uploaded_file, path):
+    """
+    Copies an uploaded file to disk in chunks instead of reading it into memory at once.
+    """
+    uploaded_file.seek(0)
+    return write_atomic(path, lambda f: shutil.copyfileobj(uploaded_file, f, length=1024 * 1024))
+
+
+def member_path(out_dir, name):
+    """
+    Returns the path a ZIP member is written to below out_dir.
+
+    The name is normalised the way ZipFile.extract does it: drive letters, leading
+    slashes and "." and ".." components are dropped, so a member can never be written
+    outside out_dir.
+
+    Args:
+        out_dir (str): Directory the pages are written to.
+        name (str): Member name in the archive.
+
+    Returns:
+        str: The output path, or None if nothing is left of the name.
+    """
+    name = name.replace('\\', '/')
+    name = ntpath.splitdrive(name)[1]
+    parts = [part for part in name.split('/') if part not in ('', '.', '..')]
+    if not parts:
+        return None
+    out_path = os.path.join(out_dir, *parts)
+    root = os.path.realpath(out_dir)
+    if os.path.commonpath([root, os.path.realpath(out_path)]) != root:
+        return None
+    return out_path
+
+
+def plan_zip_pages(zip_path, out_dir):
+    """
+    Lists the pages of a ZIP archive without extracting anything.
+
+    TIFF pages are converted to JPG later, other images are extracted as they are. The
+    colour calibration target is recognised by the pre-filter (aisisax.io.prefilter).
+    Members whose name would leave out_dir (absolute paths, "..") are written below it,
+    see member_path.
+
+    Args:
+        zip_path (str): Path of the ZIP archive.
+        out_dir (str): Directory the pages are written to.
+
+    Returns:
+        list: (zip_path, member name, output path) tuples in archive order.
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        names = [name for name in zip_ref.namelist() if not name.endswith('/')]
+
+    pages = []
+    for name in names:
+        if not name.lower().endswith(TIFF_EXTENSIONS + IMAGE_EXTENSIONS):
+            continue
+        out_path = member_path(out_dir, name)
+        if out_path is None:
+            logger.warning(f"Skipping archive member with an invalid name: {name}")
+            continue
+        if name.lower().endswith(TIFF_EXTENSIONS):
+            out_path = os.path.splitext(out_path)[0] + '.jpg'
+        pages.append((zip_path, name, out_path))
+    return pages
+
+
+def plan_directory_pages(directory, out_dir):
+    """
+    Lists the pages of a directory tree, including the pages of ZIP archives in it.
+
+    JPG and PNG files are used in place, TIFFs are converted to JPG into out_dir.
+
+    Args:
+        directory (str): The directory to scan.
+        out_dir (str): Directory converted pages are written to.
+
+    Returns:
+        list: (zip_path, name, output path) tuples, see plan_zip_pages. zip_path is None
+            for files on disk.
+    """
+    out_dir = os.path.join(out_dir, os.path.basename(os.path.normpath(directory)))
+    pages = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        files = sorted(files)
+        rel_dir = os.path.relpath(root, directory)
+
+        for name in files:
+            path = os.path.join(root, name)
+            if name.lower().endswith('.zip'):
+                pages.extend(plan_zip_pages(path, os.path.join(out_dir, rel_dir, os.path.splitext(name)[0])))
+            elif name.lower().endswith(TIFF_EXTENSIONS):
+                pages.append((None, path, os.path.normpath(os.path.join(out_dir, rel_dir, os.path.splitext(name)[0] + '.jpg'))))
+            elif name.lower().endswith(IMAGE_EXTENSIONS):
+                pages.append((None, path, path))
+    return pages
+
+
+def extract_page(zip_path, name, out_path, quality=70, store_dir=None):
+    """
+    Reads a single page from a ZIP archive (or from disk if zip_path is None) and writes
+    it as a page image.
+
+    TIFFs are decoded and encoded as JPG at quality, best the upload quality, so that
+    prepare_image can send pages that fit the model as they are. This runs in a worker process, so only the
+    member name travels between processes and at most one page per worker is held in memory.
+    Pages are written to a temporary file and renamed, and with a store_dir they are
+    deduplicated into the image store (aisisax.io.image_store) afterwards.
+
+    Returns:
+        tuple: (out_path, timings) with the seconds spent reading the archive ("unzip")
+            and decoding and re-encoding the page ("convert").
+    """
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    start = time.perf_counter()
+    if zip_path is None:
+        with Image.open(name) as img:
+            write_atomic(out_path, lambda f: img.convert('RGB').save(f, 'JPEG', quality=quality))
+        timings = {"convert": time.perf_counter() - start}
+    else:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            if not name.lower().endswith(TIFF_EXTENSIONS):
+                with zip_ref.open(name) as src:
+                    write_atomic(out_path, lambda f: shutil.copyfileobj(src, f, length=1024 * 1024))
+                timings = {"unzip": time.perf_counter() - start}
+                data = None
+            else:
+                data = zip_ref.read(name)
+        if data is not None:
+            unzipped = time.perf_counter()
+            with Image.open(io.BytesIO(data)) as img:
+                write_atomic(out_path, lambda f: img.convert('RGB').save(f, 'JPEG', quality=quality))
+            timings = {"unzip": unzipped - start, "convert": time.perf_counter() - unzipped}
+
+    if store_dir is not None:
+        add_to_store(out_path, store_dir)
+    return out_path, timings
+
+
+def inspect_page(path, prefilter=False, sha256=False):
+    """
+    Reads what the analysis needs to know about a page before it is sent, in a worker
+    process of iter_pages.
+
+    Args:
+        path (str): Path of the page image.
+        prefilter (bool): Run the pre-filter, see aisisax.io.prefilter.
+        sha256 (bool): Hash the page, e.g. for the field cache.
+
+    Returns:
+        tuple: (info, timings) with the page's "size", the "prefilter" result and the
+            "sha256" (None if not asked for), or an "error" if the page cannot be read,
+            and the seconds spent on the "prefilter" and the "hash".
+    """
+    info = {"size": None, "prefilter": None, "sha256": None, "error": None}
+    timings = {}
+    try:
+        with Image.open(path) as img:
+            info["size"] = img.size
+        if prefilter:
+            start = time.perf_counter()
+            info["prefilter"] = prefilter_page(path)
+            timings["prefilter"] = time.perf_counter() - start
+        if sha256:
+            start = time.perf_counter()
+            info["sha256"] = file_sha256(path)
+            timings["hash"] = time.perf_counter() - start
+    except OSError as e:
+        info["error"] = str(e)
+    return info, timings
+
+
+def prepare_page_file(zip_path, name, out_path, quality=70, store_dir=None, inspect=None):
+    """
+    Converts a page unless it is used as it is (see iter_pages), and inspects it with the
+    inspect_page options in inspect, if given.
+
+    Returns:
+        tuple: (out_path, timings, info) as returned by extract_page and inspect_page,
+            info is None without inspect.
+    """
+    if zip_path is None and name == out_path:
+        timings = {}
+    else:
+        out_path, timings = extract_page(zip_path, name, out_path, quality, store_dir)
+    if inspect is None:
+        return out_path, timings, None
+    info, inspect_timings = inspect_page(out_path, **inspect)
+    return out_path, dict(timings, **inspect_timings), info
+
+
+def iter_pages(pages, max_workers=None, max_pending=8, quality=70, on_timing=None, store_dir=None, inspect=None):
+    """
+    Converts ZIP pages in a process pool and yields them in order as soon as they are ready.
+
+    At most max_pending pages are converted ahead of the consumer, which bounds memory and
+    disk usage independently of the archive size. Pages that fail to convert are logged
+    and skipped. With inspect, the workers also read what the analysis needs to know
+    about every page (see inspect_page), so the consumer does not have to.
+
+    Args:
+        pages (list): (zip_path, member name, output path) tuples as returned by
+            plan_zip_pages. Pages with a zip_path of None are read from disk, and are
+            used as they are if name and output path are the same.
+        max_workers (int): Number of conversion processes (default: number of CPUs).
+        max_pending (int): Maximum number of pages converted ahead of the consumer.
+        quality (int): JPG quality for converted TIFF pages, best settings["jpg_quality"],
+            see extract_page.
+        on_timing (callable): Called as on_timing(path, timings) for every converted
+            page, see extract_page.
+        store_dir (str): Root of the image store converted pages are deduplicated into,
+            see aisisax.io.image_store. None keeps them as plain files.
+        inspect (dict): Options of inspect_page, e.g. {"prefilter": True}. None to not
+            inspect the pages.
+
+    Yields:
+        str: Path of each page image, or (path, info) tuples with inspect.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        pages = iter(pages)
+
+        while True:
+            while len(pending) < max_pending:
+                page = next(pages, None)
+                if page is None:
+                    break
+                zip_path, name, out_path = page
+                if zip_path is None and name == out_path and inspect is None:
+                    pending.append((out_path, None))
+                else:
+                    pending.append((name, executor.submit(prepare_page_file, zip_path, name, out_path, quality, store_dir,
+                                                          inspect)))
+
+            if not pending:
+                break
+
+            name, future = pending.popleft()
+            if future is None:
+                yield name
+                continue
+            try:
+                out_path, timings, info = future.result()
+            except Exception as e:
+                logger.error(f"Error converting {name}: {str(e)}")
+                continue
+            if on_timing is not None:
+                on_timing(out_path, timings)
+            yield (out_path, info) if inspect is not None else out_path
@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger("tibet_processor")
+
+
+class Journal:
+    """
+    Append-only JSONL checkpoint of finished pages, used to resume interrupted runs.
+
+    Every line holds the ID and the result row of one page. Lines are flushed to disk
+    immediately, so at most the page in progress is lost on a crash. A truncated last
+    line from an interrupted write is ignored when the journal is loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line_number, line in enumerate(f, start=1):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping unreadable line {line_number} of journal {path}")
+                        continue
+                    self.results[entry["page_id"]] = entry["result"]
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+        # Terminate a line that was cut off by a crash before appending to it
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def __contains__(self, page_id):
+        return page_id in self.results
+
+    def __len__(self):
+        return len(self.results)
+
+    def append(self, page_id, result):
+        """
+        Records the result of a finished page.
+        """
+        self.results[page_id] = result
+        self._file.write(json.dumps({"page_id": page_id, "result": result}, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
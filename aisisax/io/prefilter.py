@@ -0,0 +1,211 @@
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+# Pages are analysed at this size, enough for frame lines and stamps
+ANALYSIS_SIZE = 1024
+
+# Blank pages: share of ink pixels, i.e. clearly darker or more saturated than the paper
+INK_DELTA = 60
+MAX_BLANK_INK = 0.002
+
+# Calibration charts: flat, saturated patches of at least this many different hues
+PATCH_SIZE = 16
+MAX_PATCH_STD = 10
+MIN_PATCH_SATURATION = 90
+MIN_CHART_HUES = 5
+MIN_PATCHES_PER_HUE = 2
+
+# Frame lines: vertical runs of ink covering this share of the page height. Pages with
+# weaker lines, or none, are left to the model.
+FRAME_PRESENT = 0.55
+# Columns this far to the side must not be covered as well, so that dark scan
+# backgrounds and the edge of the folio are not taken for lines
+FRAME_LINE_ISOLATION = 0.01
+FRAME_EDGE_MARGIN = 0.03
+
+# Round stamps: red blobs on a coarse grid with a square bounding box
+STAMP_CELL = 8
+MIN_STAMP_SIZE = 0.04  # of the page height
+MAX_STAMP_SIZE = 0.3
+STAMP_ASPECT = (0.75, 1.33)
+STAMP_FILL = (0.3, 0.9)
+
+
+def load_page(image_path, size=ANALYSIS_SIZE):
+    """
+    Loads a downscaled RGB copy of a page as a NumPy array.
+    """
+    with Image.open(image_path) as img:
+        img.draft("RGB", (size, size))  # let the JPEG decoder downscale while reading
+        img = img.convert("RGB")
+        img.thumbnail((size, size))
+        return np.asarray(img)
+
+
+def red_mask(rgb):
+    """
+    Returns the pixels of red ink (frame lines, rubrics, stamps).
+    """
+    r, g, b = (rgb[..., i].astype(np.int16) for i in range(3))
+    return (r > 110) & (r - g > 50) & (r - b > 40)
+
+
+def ink_masks(rgb):
+    """
+    Returns the masks of dark and of red ink, relative to the paper tone of the page.
+    """
+    gray = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    paper = np.median(gray)
+    red = red_mask(rgb)
+    dark = (gray < paper - INK_DELTA) & ~red
+    return dark, red
+
+
+def is_blank(dark, red):
+    """
+    True if the page holds (almost) no ink.
+    """
+    return (np.count_nonzero(dark) + np.count_nonzero(red)) / dark.size < MAX_BLANK_INK
+
+
+def is_calibration_chart(rgb, patch_size=PATCH_SIZE):
+    """
+    True if the page shows a colour calibration chart.
+
+    Charts consist of flat patches of many different hues, while painted illustrations
+    are textured and manuscripts only hold a few ink colours.
+    """
+    height, width = rgb.shape[0] // patch_size * patch_size, rgb.shape[1] // patch_size * patch_size
+    if not height or not width:
+        return False
+
+    hsv = np.asarray(Image.fromarray(rgb[:height, :width]).convert("HSV"), dtype=np.float32)
+    patches = hsv.reshape(height // patch_size, patch_size, width // patch_size, patch_size, 3).swapaxes(1, 2)
+    patches = patches.reshape(patches.shape[0], patches.shape[1], -1, 3)
+
+    rgb_patches = rgb[:height, :width].astype(np.float32)
+    rgb_patches = rgb_patches.reshape(height // patch_size, patch_size, width // patch_size, patch_size, 3).swapaxes(1, 2)
+    flat = rgb_patches.reshape(rgb_patches.shape[0], rgb_patches.shape[1], -1, 3).std(axis=2).max(axis=-1) < MAX_PATCH_STD
+
+    saturated = np.median(patches[..., 1], axis=2) > MIN_PATCH_SATURATION
+    hues = (np.median(patches[..., 0], axis=2) / 256 * 12).astype(int)  # 12 hue bins
+    counts = np.bincount(hues[flat & saturated], minlength=12)
+    return np.count_nonzero(counts >= MIN_PATCHES_PER_HUE) >= MIN_CHART_HUES
+
+
+def vertical_coverage(mask):
+    """
+    Returns the longest vertical run of each column as a share of the page height.
+
+    Gaps of a pixel and slightly slanted lines are tolerated.
+    """
+    mask = mask.copy()
+    mask[1:-1] |= mask[:-2] & mask[2:]  # close one-pixel gaps
+    mask[:, 1:] |= mask[:, :-1]  # tolerate slant
+    mask[:, :-1] |= mask[:, 1:]
+
+    run = np.zeros(mask.shape[1], dtype=np.int32)
+    longest = np.zeros(mask.shape[1], dtype=np.int32)
+    for row in mask:
+        run = (run + 1) * row
+        np.maximum(longest, run, out=longest)
+    return longest / mask.shape[0]
+
+
+def frame_line_strength(mask):
+    """
+    Returns the coverage of the strongest isolated vertical line of the mask.
+    """
+    coverage = vertical_coverage(mask)
+    width = len(coverage)
+    offset = max(2, int(width * FRAME_LINE_ISOLATION))
+    margin = max(offset, int(width * FRAME_EDGE_MARGIN))
+    if width <= 2 * margin:
+        return 0.0
+
+    # A line stands out from the columns next to it, a dark background does not
+    neighbours = np.maximum(coverage[margin - offset:width - margin - offset], coverage[margin + offset:width - margin + offset])
+    strength = coverage[margin:width - margin] - neighbours
+    return float(strength.max())
+
+
+def detect_frame(dark, red):
+    """
+    Detects vertical red or black lines framing the text.
+
+    Returns:
+        str: "Red" or "Black", or None if no line is strong enough to be sure. Missing
+            frames are not reported, a faint or broken line would be taken for none.
+    """
+    red_strength = frame_line_strength(red)
+    black_strength = frame_line_strength(dark)
+    if max(red_strength, black_strength) >= FRAME_PRESENT:
+        return "Red" if red_strength >= black_strength else "Black"
+    return None
+
+
+def detect_red_stamp(red, cell=STAMP_CELL):
+    """
+    True if the page holds a round red stamp, a roughly square red blob that is neither
+    a line nor a row of red letters.
+    """
+    height, width = red.shape[0] // cell, red.shape[1] // cell
+    if not height or not width:
+        return False
+    grid = red[:height * cell, :width * cell].reshape(height, cell, width, cell).mean(axis=(1, 3)) > 0.1
+
+    min_size = max(2, int(MIN_STAMP_SIZE * red.shape[0] / cell))
+    max_size = int(MAX_STAMP_SIZE * red.shape[0] / cell)
+    seen = np.zeros_like(grid)
+    for start in zip(*np.nonzero(grid)):
+        if seen[start]:
+            continue
+
+        # Flood fill the blob on the coarse grid
+        seen[start] = True
+        queue = deque([start])
+        cells = 0
+        top, left, bottom, right = start[0], start[1], start[0], start[1]
+        while queue:
+            y, x = queue.popleft()
+            cells += 1
+            top, bottom, left, right = min(top, y), max(bottom, y), min(left, x), max(right, x)
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < height and 0 <= nx < width and grid[ny, nx] and not seen[ny, nx]:
+                    seen[ny, nx] = True
+                    queue.append((ny, nx))
+
+        blob_height, blob_width = bottom - top + 1, right - left + 1
+        if not (min_size <= blob_height <= max_size and min_size <= blob_width <= max_size):
+            continue
+        if not STAMP_ASPECT[0] <= blob_width / blob_height <= STAMP_ASPECT[1]:
+            continue
+        if STAMP_FILL[0] <= cells / (blob_height * blob_width) <= STAMP_FILL[1]:
+            return True
+    return False
+
+
+def prefilter_page(image_path):
+    """
+    Answers the cheap questions about a page locally.
+
+    Only what is clearly there is reported: a calibration chart, a frame line or a stamp.
+    Blank pages are only flagged, frames and stamps are not searched on them.
+
+    Args:
+        image_path (str): Path of the page image.
+
+    Returns:
+        dict: "blank" and "calibration" (bool), "frame" ("Red", "Black" or None if no
+            frame line was found for sure) and "red_stamp" (bool).
+    """
+    rgb = load_page(image_path)
+    dark, red = ink_masks(rgb)
+
+    if is_calibration_chart(rgb):
+        return {"blank": False, "calibration": True, "frame": None, "red_stamp": False}
+    if is_blank(dark, red):
+        return {"blank": True, "calibration": False, "frame": None, "red_stamp": False}
+    return {"blank": False, "calibration": False, "frame": detect_frame(dark, red), "red_stamp": detect_red_stamp(red)}
@@ -0,0 +1,126 @@
+import functools
+import io
+import math
+import os
+
+from PIL import Image
+
+from aisisax.llm.tokens import estimate_image_tokens
+
+# OpenAI vision models scale images to fit into 2048x2048, then the shortest side to
+# 768px, and bill per 512px tile. With detail 'low' a single 512x512 image is used.
+MAX_SIDE = 2048
+MAX_SHORT_SIDE = 768
+TILE_SIZE = 512
+
+# How much resolution we are willing to give up to save a row or column of tiles
+MAX_TILE_SHRINK = 0.15
+
+
+def fit_to_tiles(width, height, detail="high", tile_size=TILE_SIZE, max_shrink=MAX_TILE_SHRINK):
+    """
+    Computes the size a page should be uploaded at for the model's tiling grid.
+
+    The image is scaled the same way the provider would scale it. If the result
+    only slightly exceeds a tile boundary, it is shrunk a little further so that
+    a whole row or column of tiles is saved. The aspect ratio is always kept.
+
+    Args:
+        width (int): Original width in pixels.
+        height (int): Original height in pixels.
+        detail (str): The "detail" parameter of the request ('low' or 'high').
+        tile_size (int): Tile size of the vision model.
+        max_shrink (float): Maximum additional downscaling to save tiles.
+
+    Returns:
+        tuple: (width, height) to upload at. Never larger than the original.
+    """
+    if detail == "low":
+        scale = min(1.0, tile_size / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    scale = min(1.0, MAX_SIDE / max(width, height), MAX_SHORT_SIDE / min(width, height))
+
+    def tiles(s):
+        return math.ceil(width * s / tile_size) * math.ceil(height * s / tile_size)
+
+    # Try snapping either side down to the next tile boundary
+    best = scale
+    for side in (width, height):
+        boundary = math.floor(side * scale / tile_size) * tile_size
+        if boundary == 0:
+            continue
+        snapped = boundary / side
+        if snapped >= scale * (1 - max_shrink) and tiles(snapped) < tiles(best):
+            best = snapped
+
+    return max(1, math.floor(width * best)), max(1, math.floor(height * best))
+
+
+@functools.lru_cache(maxsize=None)
+def _quantization(quality):
+    # The quantization tables Pillow encodes a JPG with at this quality
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buffer, 'JPEG', quality=quality)
+    with Image.open(buffer) as img:
+        return img.quantization
+
+
+def is_encoded_at(img, quality):
+    """
+    True if a JPG is compressed at least as strongly as re-encoding it at quality would,
+    e.g. a page converted at the upload quality (see aisisax.io.ingest).
+    """
+    tables = getattr(img, "quantization", None) or {}
+    reference = _quantization(quality)
+    return all(table in tables and all(a >= b for a, b in zip(tables[table], reference[table]))
+               for table in reference)
+
+
+def prepare_image(image_path, quality=70, detail="high"):
+    """
+    Downscales a page to the model's tiling grid and re-encodes it as JPG in memory.
+
+    JPGs that already fit the grid and are compressed at least as strongly as quality
+    are sent as they are, a second lossy pass would only cost quality and time.
+
+    Args:
+        image_path (str): Path of the page image.
+        quality (int): JPG quality used for the upload.
+        detail (str): The "detail" parameter of the request ('low' or 'high').
+
+    Returns:
+        tuple: (JPG bytes, stats) where stats holds the original and uploaded size in
+            bytes and pixels and the estimated image tokens before and after.
+    """
+    original_bytes = os.path.getsize(image_path)
+
+    with Image.open(image_path) as img:
+        original_size = img.size
+        size = fit_to_tiles(*original_size, detail=detail)
+        original_format = img.format
+        if size == original_size and original_format == 'JPEG' and is_encoded_at(img, quality):
+            image_data = None
+        else:
+            img = img.convert('RGB')
+            if size != original_size:
+                img = img.resize(size, Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            img.save(buffer, 'JPEG', quality=quality, optimize=True)
+            image_data = buffer.getvalue()
+
+    # Small JPGs may grow when re-encoded, send those unchanged
+    if image_data is None or (size == original_size and original_format == 'JPEG' and len(image_data) >= original_bytes):
+        with open(image_path, "rb") as img_file:
+            image_data = img_file.read()
+
+    stats = {
+        "original_bytes": original_bytes,
+        "bytes": len(image_data),
+        "original_size": original_size,
+        "size": size,
+        "original_tokens": estimate_image_tokens(*original_size, detail=detail),
+        "tokens": estimate_image_tokens(*size, detail=detail),
+    }
+    return image_data, stats
@@ -0,0 +1,244 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from aisisax.io.image_store import file_sha256
+from aisisax.io.results import RESULT_SCHEMA, ResultBuffer
+
+load_dotenv()
+
+# The results of all runs, see ResultStore
+result_store_path = os.getenv("AISISAX_RESULT_STORE", os.path.join(".cache", "results.sqlite"))
+
+# Columns of every entry, the analysis fields follow as columns of their own
+KEY_COLUMNS = ["PPN", "Page number", "Image hash"]
+META_COLUMNS = ["Image", "Run", "Model", "Analysed at"]
+
+# SQLite column types of the pandas dtypes of RESULT_SCHEMA, and back
+SQL_TYPES = {"boolean": "BOOLEAN", "Int64": "INTEGER", "string": "TEXT"}
+DTYPES = {sql_type: dtype for dtype, sql_type in SQL_TYPES.items()}
+
+
+class ResultStore:
+    """
+    Persistent SQLite store of the page results of all runs.
+
+    Every page is stored once per PPN, page number and image hash, a later analysis of
+    the same page replaces the earlier one. Every analysis field is a column with an
+    index of its own, fields that are new (e.g. after editing the prompt) are added as
+    columns when they first occur. Queries filter and page in SQLite, so only the rows
+    shown are loaded into pandas.
+
+    The store is safe to share between threads and between processes using the same file.
+    """
+
+    def __init__(self, path=result_store_path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                "PPN" TEXT,
+                "Page number" INTEGER,
+                "Image hash" TEXT NOT NULL,
+                "Image" TEXT,
+                "Run" TEXT,
+                "Model" TEXT,
+                "Analysed at" REAL NOT NULL,
+                "Extra" TEXT
+            )
+        """)
+        # Unknown PPNs and page numbers are NULL, which a plain unique key would not match
+        self._conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS pages_key
+            ON pages (IFNULL("PPN", ''), IFNULL("Page number", -1), "Image hash")
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS pages_order ON pages ("PPN", "Page number")')
+        self._conn.commit()
+        self._columns = self._read_columns()
+
+    def _read_columns(self):
+        rows = self._conn.execute("PRAGMA table_info(pages)").fetchall()
+        return {name: column_type for _, name, column_type, *_ in rows}
+
+    @property
+    def fields(self):
+        """
+        Returns the analysis fields and their pandas dtypes.
+        """
+        with self._lock:
+            self._columns = self._read_columns()
+            return {name: DTYPES.get(column_type, "object") for name, column_type in self._columns.items()
+                    if name not in KEY_COLUMNS + META_COLUMNS + ["Extra"]}
+
+    def _add_field(self, name, value):
+        # Called with the lock held
+        dtype = RESULT_SCHEMA.get(name)
+        if dtype is None:
+            dtype = "boolean" if isinstance(value, bool) else "Int64" if isinstance(value, int) else "string"
+        try:
+            self._conn.execute(f'ALTER TABLE pages ADD COLUMN {_quote(name)} {SQL_TYPES[dtype]}')
+        except sqlite3.OperationalError:
+            if name not in self._read_columns():
+                raise  # not just added by another process
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS {_quote("pages_field_" + name)} ON pages ({_quote(name)})')
+        self._columns[name] = SQL_TYPES[dtype]
+
+    def add(self, result, image_hash=None, run=None, model=None):
+        """
+        Stores the result row of a page.
+
+        Args:
+            result (dict): The result row with "PPN", "Page number" and "Image", see
+                aisisax.pipeline.add_page_metadata.
+            image_hash (str): The SHA-256 of the page image, computed from the image if not given.
+            run (str): Name of the run.
+            model (str): The model that answered.
+        """
+        if image_hash is None:
+            image_hash = file_sha256(result["Image"])
+        page_number = result.get("Page number")
+        row = {
+            "PPN": result.get("PPN"),
+            "Page number": page_number if isinstance(page_number, int) else None,
+            "Image hash": image_hash,
+            "Image": result.get("Image"),
+            "Run": run,
+            "Model": model,
+            "Analysed at": time.time(),
+        }
+        values = {name: value for name, value in result.items() if name not in row}
+        # Answers that are not plain values (e.g. lists from a free-form prompt) go to "Extra"
+        extra = {name: value for name, value in values.items() if not isinstance(value, (bool, int, float, str, type(None)))}
+
+        with self._lock:
+            self._columns = self._read_columns()  # other processes may have added fields
+            for name, value in values.items():
+                if name not in extra and name not in self._columns:
+                    self._add_field(name, value)
+            row.update({name: value for name, value in values.items() if name not in extra})
+            row["Extra"] = json.dumps(extra, ensure_ascii=False, default=str) if extra else None
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO pages ({', '.join(_quote(name) for name in row)}) "
+                f"VALUES ({', '.join('?' * len(row))})",
+                list(row.values())
+            )
+            self._conn.commit()
+
+    def _where(self, filters):
+        clauses = []
+        params = []
+        for column, values in (filters or {}).items():
+            if not values:
+                continue
+            if column not in self._columns:
+                raise ValueError(f"Unknown column '{column}'")
+            clauses.append(f"{_quote(column)} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def count(self, filters=None):
+        """
+        Returns the number of stored pages matching all filters, see query.
+        """
+        with self._lock:
+            self._columns = self._read_columns()
+            where, params = self._where(filters)
+            return self._conn.execute(f"SELECT COUNT(*) FROM pages{where}", params).fetchone()[0]
+
+    def query(self, filters=None, limit=100, offset=0):
+        """
+        Returns the stored pages matching all filters, in PPN and page order.
+
+        Args:
+            filters (dict): column -> list of accepted values, e.g.
+                {"Frame present": ["Red"], "Illustration present": [True]}. Empty lists
+                match everything.
+            limit (int): Maximum number of rows, None for all.
+            offset (int): Number of matching rows to skip.
+
+        Returns:
+            tuple: (df, total) with the typed rows and the number of all matching pages.
+
+        Raises:
+            ValueError: If a filter column does not exist.
+        """
+        with self._lock:
+            self._columns = self._read_columns()
+            where, params = self._where(filters)
+            total = self._conn.execute(f"SELECT COUNT(*) FROM pages{where}", params).fetchone()[0]
+            cursor = self._conn.execute(
+                f'SELECT * FROM pages{where} ORDER BY "PPN", "Page number" LIMIT ? OFFSET ?',
+                params + [-1 if limit is None else limit, offset]
+            )
+            names = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+            schema = {name: DTYPES.get(self._columns[name], "object") for name in names if name != "Extra"}
+            schema["Image hash"] = schema["Run"] = schema["Model"] = "string"
+
+        results = ResultBuffer(schema)
+        for row in rows:
+            values = dict(zip(names, row))
+            extra = values.pop("Extra")
+            values.update(json.loads(extra) if extra else {})
+            results.add(values)
+        df = results.to_dataframe()
+        if "Analysed at" in df:
+            df["Analysed at"] = pd.to_datetime(df["Analysed at"], unit="s")
+        return df, total
+
+    def options(self, column, max_options=None):
+        """
+        Returns the distinct values of a column, or None if there are more than max_options.
+        """
+        with self._lock:
+            self._columns = self._read_columns()
+            if column not in self._columns:
+                raise ValueError(f"Unknown column '{column}'")
+            limit = -1 if max_options is None else max_options + 1
+            values = [row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT {_quote(column)} FROM pages WHERE {_quote(column)} IS NOT NULL "
+                f"ORDER BY 1 LIMIT ?", (limit,)
+            )]
+            dtype = DTYPES.get(self._columns[column])
+        if max_options is not None and len(values) > max_options:
+            return None
+        return [bool(value) for value in values] if dtype == "boolean" else values
+
+    def stats(self):
+        """
+        Returns the number of stored pages and PPNs and the size of the database.
+        """
+        with self._lock:
+            pages, ppns = self._conn.execute('SELECT COUNT(*), COUNT(DISTINCT "PPN") FROM pages').fetchone()
+        size = sum(os.path.getsize(path) for path in (self.path, self.path + "-wal") if os.path.exists(path))
+        return {"pages": pages, "ppns": ppns, "size_mb": size / 1024 / 1024}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+_default_result_store = None
+_default_result_store_lock = threading.Lock()
+
+
+def get_default_result_store():
+    """
+    Returns the process-wide result store.
+    """
+    global _default_result_store
+    with _default_result_store_lock:
+        if _default_result_store is None:
+            _default_result_store = ResultStore()
+        return _default_result_store
@@ -0,0 +1,137 @@
+import io
+
+import pandas as pd
+
+# Columns of the results table and their pandas dtypes. Fields the model returns in
+# addition (e.g. after editing the prompt) are kept as 'object' columns.
+RESULT_SCHEMA = {
+    "PPN": "string",
+    "Page number": "Int64",
+    "Chinese character present": "boolean",
+    "Chinese page number": "boolean",
+    "Arabic numeral present": "boolean",
+    "Arabic numeral int": "Int64",
+    "Illustration present": "boolean",
+    "Illustration position": "string",
+    "Illustration caption": "boolean",
+    "Tibetian page number": "boolean",
+    "Frame present": "string",
+    "Image": "string",
+}
+
+# Number of rows per chunk when streaming CSV and Parquet exports
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _coerce(values, dtype):
+    """
+    Converts a column of raw model answers to the given dtype, invalid values become NA.
+    """
+    series = pd.Series(values, dtype="object")
+    if dtype == "boolean":
+        mapping = {"true": True, "yes": True, "1": True, "false": False, "no": False, "0": False}
+        series = series.map(lambda v: v if v is None or isinstance(v, bool) else mapping.get(str(v).strip().lower()))
+        return series.astype("boolean")
+    if dtype == "Int64":
+        return pd.to_numeric(series, errors="coerce").round().astype("Int64")
+    if dtype == "string":
+        return series.map(lambda v: None if v is None else str(v)).astype("string")
+    return series
+
+
+class ResultBuffer:
+    """
+    Collects result rows in page order and builds a typed DataFrame once at the end.
+
+    Rows can be added in any order (e.g. as concurrent requests complete) together with
+    their page index. Appending is O(1), the DataFrame is only built in to_dataframe.
+    """
+
+    def __init__(self, schema=None):
+        self.schema = dict(RESULT_SCHEMA if schema is None else schema)
+        self._rows = {}
+        self._columns = {}  # columns seen so far, in order of appearance
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return (self._rows[index] for index in sorted(self._rows))
+
+    def add(self, row, index=None):
+        """
+        Adds a result row at the given page index (default: after the last row).
+        """
+        if index is None:
+            index = max(self._rows, default=-1) + 1
+        self._rows[index] = row
+        for column in row:
+            self._columns.setdefault(column, None)
+
+    def to_dataframe(self):
+        """
+        Returns the rows as a DataFrame with one typed column per answered field.
+
+        Schema columns come first in schema order, columns that are not part of the
+        schema follow in the order they first appeared.
+        """
+        rows = [self._rows[index] for index in sorted(self._rows)]
+        columns = [column for column in self.schema if column in self._columns]
+        columns += [column for column in self._columns if column not in self.schema]
+        return pd.DataFrame({
+            column: _coerce([row.get(column) for row in rows], self.schema.get(column, "object"))
+            for column in columns
+        })
+
+
+def to_excel_bytes(df):
+    """
+    Serialises the results as an Excel workbook.
+    """
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def write_csv(df, path_or_buffer, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Writes the results as CSV in chunks of rows.
+    """
+    df.to_csv(path_or_buffer, index=False, chunksize=chunk_size)
+
+
+def write_parquet(df, path_or_buffer, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Writes the results as Parquet, one row group per chunk of rows.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Extra columns may hold mixed answers (e.g. 3 and 'none'), store those as strings
+    df = df.astype({column: "string" for column in df.columns if df[column].dtype == object})
+
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(path_or_buffer, schema) as writer:
+        for start in range(0, len(df), chunk_size):
+            chunk = df.iloc[start:start + chunk_size]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def build_exports(df):
+    """
+    Serialises the results once in all download formats.
+
+    Returns:
+        dict: Format name -> (bytes, file name, MIME type).
+    """
+    csv_buffer = io.StringIO()
+    write_csv(df, csv_buffer)
+
+    parquet_buffer = io.BytesIO()
+    write_parquet(df, parquet_buffer)
+
+    return {
+        "Excel": (to_excel_bytes(df), "tibet_analysis.xlsx", "application/vnd.ms-excel"),
+        "CSV": (csv_buffer.getvalue().encode("utf-8"), "tibet_analysis.csv", "text/csv"),
+        "Parquet": (parquet_buffer.getvalue(), "tibet_analysis.parquet", "application/vnd.apache.parquet"),
+    }
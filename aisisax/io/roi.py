@@ -0,0 +1,122 @@
+import io
+import math
+import os
+
+from PIL import Image
+
+from aisisax.io.preprocess import MAX_SHORT_SIDE, MAX_SIDE, TILE_SIZE, fit_to_tiles, prepare_image
+from aisisax.llm.tokens import estimate_image_tokens
+
+# Share of the page width cut as left and right margin
+ROI_MARGIN = 0.08
+
+# Tile budgets of the reduced page view and of the margin image
+ROI_PAGE_TILES = 4
+ROI_MARGIN_TILES = 4
+
+# White gap between the left and the right margin strip
+ROI_GAP = 16
+
+# Fields answered from the margin image, with the margin they concern
+MARGIN_FIELDS = {
+    "Chinese page number": "right",
+    "Tibetian page number": "left",
+}
+
+ROI_INSTRUCTIONS = """
+You will receive two images of the same page. The first image shows the whole page at reduced resolution.
+The second image shows the left and the right margin of the page at higher resolution, the left margin on the left and the right margin on the right, separated by a white gap.
+Answer the questions about {fields} from the margins in the second image, and all other questions from the first image."""
+
+
+def roi_prompt(query, fields):
+    """
+    Extends the analysis prompt with the instructions for a page view and a margin image.
+
+    Args:
+        query (str): The analysis prompt.
+        fields (list): The answer fields of the prompt, see aisisax.llm.schema.
+    """
+    names = [field["name"] for field in fields if field["name"] in MARGIN_FIELDS]
+    if not names:
+        return query
+    return query + ROI_INSTRUCTIONS.format(fields=" and ".join(f'"{name}"' for name in names))
+
+
+def scale_to_tiles(width, height, max_tiles, tile_size=TILE_SIZE):
+    """
+    Returns the largest scale (at most 1) at which an image fits into max_tiles tiles.
+
+    The provider's own downscaling (2048px longest, 768px shortest side) is applied first,
+    an image is never sent larger than the provider would use it.
+    """
+    provider_scale = min(1.0, MAX_SIDE / max(width, height), MAX_SHORT_SIDE / min(width, height))
+    best = 0.0
+    for columns in range(1, max_tiles + 1):
+        rows = max_tiles // columns
+        best = max(best, min(columns * tile_size / width, rows * tile_size / height))
+    return min(best, provider_scale)
+
+
+def _encode(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def prepare_roi_images(image_path, quality=70, margin=ROI_MARGIN, page_tiles=ROI_PAGE_TILES, margin_tiles=ROI_MARGIN_TILES):
+    """
+    Prepares a reduced view of the whole page and a high-resolution image of its margins.
+
+    The margin strips are cut from the original scan and placed side by side, so small
+    page numbers in the margins get more pixels than in the full-page view, while both
+    images together usually need fewer image tokens than the page at full detail.
+
+    Args:
+        image_path (str): Path of the page image.
+        quality (int): JPG quality used for the upload.
+        margin (float): Share of the page width cut on either side.
+        page_tiles (int): Tile budget of the page view.
+        margin_tiles (int): Tile budget of the margin image.
+
+    Returns:
+        tuple: ([page JPG, margins JPG], stats) with stats as in prepare_image. The
+            original tokens are those of the whole page at detail 'high', the baseline
+            the crop is measured against. If the crop would need more tokens than the
+            baseline (e.g. for portrait pages), only the full page is returned as by
+            prepare_image, as [page JPG].
+    """
+    original_bytes = os.path.getsize(image_path)
+
+    with Image.open(image_path) as img:
+        original_size = width, height = img.size
+        img = img.convert('RGB')
+
+        scale = scale_to_tiles(width, height, page_tiles)
+        page_size = max(1, math.floor(width * scale)), max(1, math.floor(height * scale))
+        page = _encode(img.resize(page_size, Image.LANCZOS), quality)
+
+        strip_width = max(1, round(width * margin))
+        margins = Image.new('RGB', (2 * strip_width + ROI_GAP, height), 'white')
+        margins.paste(img.crop((0, 0, strip_width, height)), (0, 0))
+        margins.paste(img.crop((width - strip_width, 0, width, height)), (strip_width + ROI_GAP, 0))
+
+    scale = scale_to_tiles(*margins.size, margin_tiles)
+    margins_size = max(1, math.floor(margins.width * scale)), max(1, math.floor(margins.height * scale))
+    margins = _encode(margins.resize(margins_size, Image.LANCZOS), quality)
+
+    # The baseline is the whole page at full detail, as sent by prepare_image
+    stats = {
+        "original_bytes": original_bytes,
+        "bytes": len(page) + len(margins),
+        "original_size": original_size,
+        "size": page_size,
+        "margins_size": margins_size,
+        "original_tokens": estimate_image_tokens(*fit_to_tiles(*original_size)),
+        "tokens": estimate_image_tokens(*page_size) + estimate_image_tokens(*margins_size),
+    }
+    if stats["tokens"] > stats["original_tokens"]:
+        image_data, stats = prepare_image(image_path, quality=quality)
+        stats["original_tokens"] = stats["tokens"]  # nothing saved against the baseline
+        return [image_data], stats
+    return [page, margins], stats
@@ -0,0 +1,852 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from dotenv import load_dotenv
+
+from aisisax.io.results import ResultBuffer
+from aisisax.llm.concurrency import BudgetShare, FairBudget, RateLimiter
+from aisisax.metrics import RunMetrics
+from aisisax.pipeline import DEFAULT_SETTINGS, run_analysis
+
+load_dotenv()
+
+logger = logging.getLogger("tibet_processor")
+
+# The job table shared by the app and the worker, see JobQueue
+jobs_path = os.getenv("AISISAX_JOBS_PATH", os.path.join(".cache", "jobs.sqlite"))
+worker_log_path = os.getenv("AISISAX_WORKER_LOG", os.path.join(".cache", "worker.log"))
+
+# Budget of the worker for all jobs together, can be configured in the .env file
+worker_jobs = int(os.getenv("AISISAX_WORKER_JOBS", "2"))
+worker_max_in_flight = int(os.getenv("AISISAX_WORKER_MAX_IN_FLIGHT", "8"))
+worker_requests_per_minute = int(os.getenv("AISISAX_WORKER_RPM", "0"))
+worker_tokens_per_minute = int(os.getenv("AISISAX_WORKER_TPM", "0"))
+
+# Seconds between two rounds of the worker, it writes a heartbeat every round
+POLL_INTERVAL = 1.0
+
+# A worker without a heartbeat for this long is considered dead
+WORKER_TIMEOUT = 30
+
+# Log lines kept per job
+LOG_LINES = 200
+
+# The log is pruned to LOG_LINES every this many records
+LOG_PRUNE_INTERVAL = 50
+
+# Characters of the streamed answer kept as a job's preview, and the seconds between two
+# updates of it, see JobPreview
+PREVIEW_CHARS = 600
+PREVIEW_INTERVAL = 1.0
+
+# Seconds the app waits for a worker that is just starting to take an API key, see send_api_key
+WORKER_START_TIMEOUT = 15
+
+# Seconds a key handed to the worker is kept before the job using it is submitted
+KEY_SUBMIT_TIMEOUT = 300
+
+# The API key ID of jobs whose key was stored by an earlier version, they need a new key
+LOST_KEY = "lost"
+
+# Jobs that have not ended yet
+ACTIVE_STATES = ("queued", "running", "cancelling")
+
+# The directory aisisax is imported from, also used by the worker process
+package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class JobQueue:
+    """
+    Persistent SQLite table of analysis jobs, their pages and log.
+
+    The app submits jobs and reads their state, the worker (run_worker) runs them. Every
+    finished page is stored with its result, so a cancelled, failed or interrupted job
+    resumes with the pages that are not done yet.
+
+    The queue is safe to share between threads and between processes using the same file.
+    API keys are never stored in it, the worker keeps them in memory (see KeyStore).
+    """
+
+    def __init__(self, path=jobs_path):
+        self.path = path
+        # The worker's manager, which takes the API keys of new jobs, see send_api_key
+        self.worker_address = os.path.splitext(os.path.abspath(path))[0] + ".worker.sock"
+        self.worker_authkey_path = os.path.splitext(os.path.abspath(path))[0] + ".worker.key"
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner TEXT NOT NULL,
+                name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                work_dir TEXT,
+                report TEXT,
+                error TEXT,
+                preview TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+            CREATE TABLE IF NOT EXISTS job_pages (
+                job INTEGER NOT NULL,
+                idx INTEGER NOT NULL,
+                zip_path TEXT,
+                member TEXT NOT NULL,
+                out_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                finished_at REAL,
+                PRIMARY KEY (job, idx)
+            );
+            CREATE INDEX IF NOT EXISTS job_pages_path ON job_pages (job, out_path);
+            CREATE TABLE IF NOT EXISTS job_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                level TEXT NOT NULL,
+                message TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS job_log_job ON job_log (job, id);
+            CREATE TABLE IF NOT EXISTS worker (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                pid INTEGER NOT NULL,
+                heartbeat REAL NOT NULL
+            );
+        """)
+        # Columns added after the first release
+        self._add_column("jobs", "preview", "TEXT")
+        self._add_column("job_pages", "finished_at", "REAL")
+        self._add_column("jobs", "api_key_id", "TEXT")
+        self._forget_api_keys()
+        self._conn.commit()
+        self._log_records = {}  # job ID -> records logged by this process
+
+    def _add_column(self, table, column, sql_type):
+        columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            try:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}")
+            except sqlite3.OperationalError:
+                # Added by another process in the meantime
+                if column not in [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]:
+                    raise
+
+    def _forget_api_keys(self):
+        # Earlier versions stored the API key in the settings, those jobs need a new key
+        rows = self._conn.execute("SELECT id, settings FROM jobs WHERE settings LIKE '%\"api_key\"%'").fetchall()
+        for job_id, settings in rows:
+            settings = json.loads(settings)
+            if settings.pop("api_key", None) is not None:
+                self._conn.execute("UPDATE jobs SET settings = ?, api_key_id = ? WHERE id = ?",
+                                   (json.dumps(settings), LOST_KEY, job_id))
+
+    def submit(self, owner, pages, settings, name, work_dir=None, api_key_id=None):
+        """
+        Adds a job to the queue.
+
+        Args:
+            owner (str): The user the job belongs to, jobs are scheduled fairly between users.
+            pages (list): Pages as planned by aisisax.io.ingest (plan_zip_pages etc.).
+            settings (dict): Analysis settings, see DEFAULT_SETTINGS. An "api_key" is not
+                stored, use api_key_id.
+            name (str): Name shown in the app.
+            work_dir (str): Directory of the job's files, kept from expiring while the job
+                is queued or running (see aisisax.io.image_store).
+            api_key_id (str): ID of the API key handed to the worker (send_api_key), None
+                for the default key.
+
+        Returns:
+            int: The job ID.
+        """
+        settings = {key: value for key, value in settings.items() if key != "api_key"}
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (owner, name, status, settings, work_dir, api_key_id, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (owner, name, json.dumps(settings), work_dir, api_key_id, time.time())
+            )
+            job_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO job_pages (job, idx, zip_path, member, out_path, status) VALUES (?, ?, ?, ?, ?, 'todo')",
+                [(job_id, index, zip_path, member, out_path) for index, (zip_path, member, out_path) in enumerate(pages)]
+            )
+            self._conn.commit()
+        return job_id
+
+    def _jobs(self, where, params, limit=None):
+        # Called with the lock held. Pages are only counted for the jobs returned
+        rows = self._conn.execute(f"""
+            SELECT j.id, j.owner, j.name, j.status, j.settings, j.work_dir, j.report, j.error,
+                   j.created_at, j.started_at, j.finished_at, j.preview, j.api_key_id,
+                   COUNT(p.idx), COUNT(p.result), SUM(p.status = 'failed'), SUM(p.status != 'todo')
+            FROM (SELECT * FROM jobs {where} ORDER BY created_at DESC, id DESC LIMIT ?) j
+            LEFT JOIN job_pages p ON p.job = j.id
+            GROUP BY j.id ORDER BY j.created_at DESC, j.id DESC
+        """, [*params, -1 if limit is None else limit]).fetchall()
+        return [{
+            "id": row[0], "owner": row[1], "name": row[2], "status": row[3], "settings": json.loads(row[4]),
+            "work_dir": row[5], "report": json.loads(row[6]) if row[6] else None, "error": row[7],
+            "created_at": row[8], "started_at": row[9], "finished_at": row[10], "preview": row[11],
+            "api_key_id": row[12], "pages": row[13], "results": row[14], "failed": row[15] or 0, "done": row[16] or 0,
+        } for row in rows]
+
+    def get(self, job_id):
+        """
+        Returns a job as a dict with its state, page counts ("pages", "done", "failed",
+        "results") and the preview of the answer in progress, or None if it does not exist.
+        """
+        with self._lock:
+            jobs = self._jobs("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def jobs(self, owner=None, statuses=None, limit=50):
+        """
+        Returns the latest jobs, optionally of one owner or with one of the given states.
+        """
+        clauses = []
+        params = []
+        if owner is not None:
+            clauses.append("owner = ?")
+            params.append(owner)
+        if statuses:
+            clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        where = "WHERE " + " AND ".join(clauses) if clauses else ""
+        with self._lock:
+            return self._jobs(where, params, limit)
+
+    def position(self, job_id):
+        """
+        Returns the number of queued jobs that were submitted before a queued job.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND id < ?", (job_id,)
+            ).fetchone()[0]
+
+    def next_job(self):
+        """
+        Marks the next job as running and returns its ID, None if no job is queued.
+
+        The next job is the oldest one of the owner with the fewest running jobs, so a user
+        with many jobs cannot hold up the others.
+        """
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT id FROM jobs j WHERE status = 'queued'
+                ORDER BY (SELECT COUNT(*) FROM jobs r WHERE r.owner = j.owner AND r.status IN ('running', 'cancelling')),
+                         created_at, id
+                LIMIT 1
+            """).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = 'running', started_at = ?, error = NULL WHERE id = ?",
+                               (time.time(), row[0]))
+            self._conn.commit()
+        return row[0]
+
+    def pending_pages(self, job_id):
+        """
+        Returns the pages of a job that are not done, in page order.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT zip_path, member, out_path FROM job_pages WHERE job = ? AND status = 'todo' ORDER BY idx",
+                (job_id,)
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def record_page(self, job_id, file_path, result, error=None):
+        """
+        Stores the result of a page, result is None for skipped calibration charts.
+        """
+        status = "failed" if error is not None else "done" if result is not None else "skipped"
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_pages SET status = ?, result = ?, error = ?, finished_at = ? WHERE job = ? AND out_path = ?",
+                (status, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                 str(error) if error is not None else None, time.time(), job_id, file_path)
+            )
+            self._conn.commit()
+
+    def fail_pending(self, job_id, error):
+        """
+        Marks the pages of a job that were never reported as failed, e.g. pages that
+        could not be converted.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE job_pages SET status = 'failed', error = ? WHERE job = ? AND status = 'todo'",
+                               (error, job_id))
+            self._conn.commit()
+
+    def results(self, job_id, latest=None):
+        """
+        Returns the results of the finished pages of a job, in page order.
+
+        Args:
+            job_id (int): The job.
+            latest (int): Only the results of the pages finished last, e.g. to follow a
+                running job. None for all results.
+        """
+        results = ResultBuffer()
+        with self._lock:
+            if latest is None:
+                rows = self._conn.execute(
+                    "SELECT idx, result FROM job_pages WHERE job = ? AND result IS NOT NULL ORDER BY idx", (job_id,)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT idx, result FROM job_pages WHERE job = ? AND result IS NOT NULL "
+                    "ORDER BY finished_at DESC, idx DESC LIMIT ?", (job_id, latest)
+                ).fetchall()
+        for index, result in rows:
+            results.add(json.loads(result), index)
+        return results
+
+    def set_preview(self, job_id, text):
+        """
+        Stores the tail of the answer in progress of a running job, None to clear it.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET preview = ? WHERE id = ?", (text, job_id))
+            self._conn.commit()
+
+    def finish(self, job_id, status, error=None, report=None):
+        """
+        Ends a run of a job. The job's API key ID is removed unless it goes back to the queue.
+
+        Args:
+            job_id (int): The job.
+            status (str): "done", "failed", "cancelled" or "queued" (interrupted by the worker).
+            error (str): Why the job failed.
+            report (dict): The run's "metrics" (JSON), "prometheus" text and "upload_stats".
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, preview = NULL, report = COALESCE(?, report), "
+                "api_key_id = CASE WHEN ? = 'queued' THEN api_key_id END WHERE id = ?",
+                (status, error, time.time(), json.dumps(report) if report is not None else None, status, job_id)
+            )
+            self._prune_log(job_id)
+            self._conn.commit()
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. A queued job is cancelled at once, a running one finishes its
+        requests in flight first.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                               (time.time(), job_id))
+            self._conn.execute("UPDATE jobs SET status = 'cancelling' WHERE id = ? AND status = 'running'", (job_id,))
+            self._conn.commit()
+
+    def resume(self, job_id, api_key_id=None):
+        """
+        Queues an ended job again for its pages that are not done, failed pages are retried.
+
+        Args:
+            job_id (int): The job.
+            api_key_id (str): ID of the API key of the user resuming it (send_api_key), None
+                for the default key.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM jobs WHERE id = ? AND status NOT IN ('queued', 'running', 'cancelling')",
+                                     (job_id,)).fetchone()
+            if row is None:
+                return
+            self._conn.execute("UPDATE job_pages SET status = 'todo', error = NULL WHERE job = ? AND status = 'failed'",
+                               (job_id,))
+            self._conn.execute("UPDATE jobs SET status = 'queued', api_key_id = ?, error = NULL, finished_at = NULL WHERE id = ?",
+                               (api_key_id, job_id))
+            self._conn.commit()
+
+    def remove(self, job_id):
+        """
+        Removes an ended job with its pages and log. The job's files are not touched.
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM jobs WHERE id = ? AND status IN ('queued', 'running', 'cancelling')",
+                                  (job_id,)).fetchone():
+                raise ValueError(f"Job {job_id} has not ended yet, cancel it first")
+            self._conn.execute("DELETE FROM job_pages WHERE job = ?", (job_id,))
+            self._conn.execute("DELETE FROM job_log WHERE job = ?", (job_id,))
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._conn.commit()
+
+    def _prune_log(self, job_id):
+        # Called with the lock held. Keeps the latest LOG_LINES records of a job
+        self._conn.execute(
+            "DELETE FROM job_log WHERE job = ? AND id <= (SELECT MAX(id) FROM job_log WHERE job = ?) - ?",
+            (job_id, job_id, LOG_LINES)
+        )
+
+    def log(self, job_id, level, message):
+        """
+        Adds a log record to a job. The log is pruned every LOG_PRUNE_INTERVAL records, so
+        it stays at about LOG_LINES records while a long job runs.
+        """
+        with self._lock:
+            self._conn.execute("INSERT INTO job_log (job, created_at, level, message) VALUES (?, ?, ?, ?)",
+                               (job_id, time.time(), level, message))
+            self._log_records[job_id] = self._log_records.get(job_id, 0) + 1
+            if self._log_records[job_id] % LOG_PRUNE_INTERVAL == 0:
+                self._prune_log(job_id)
+            self._conn.commit()
+
+    def log_lines(self, job_id, limit=20):
+        """
+        Returns the latest log records of a job as (created_at, level, message), oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT created_at, level, message FROM job_log WHERE job = ? ORDER BY id DESC LIMIT ?", (job_id, limit)
+            ).fetchall()
+        return rows[::-1]
+
+    def claim_worker(self, pid):
+        """
+        Registers pid as the worker, unless another worker is alive. Returns True on success.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute("SELECT pid, heartbeat FROM worker WHERE id = 1").fetchone()
+            if row is not None and row[0] != pid and time.time() - row[1] < WORKER_TIMEOUT:
+                self._conn.rollback()
+                return False
+            self._conn.execute("INSERT OR REPLACE INTO worker (id, pid, heartbeat) VALUES (1, ?, ?)", (pid, time.time()))
+            self._conn.commit()
+        return True
+
+    def heartbeat(self, pid):
+        with self._lock:
+            self._conn.execute("UPDATE worker SET heartbeat = ? WHERE id = 1 AND pid = ?", (time.time(), pid))
+            self._conn.commit()
+
+    def release_worker(self, pid):
+        with self._lock:
+            self._conn.execute("DELETE FROM worker WHERE id = 1 AND pid = ?", (pid,))
+            self._conn.commit()
+
+    def worker_alive(self):
+        with self._lock:
+            row = self._conn.execute("SELECT heartbeat FROM worker WHERE id = 1").fetchone()
+        return row is not None and time.time() - row[0] < WORKER_TIMEOUT
+
+    def recover(self):
+        """
+        Puts the jobs of a dead worker back into the queue, jobs being cancelled are cancelled.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE status = 'cancelling'",
+                               (time.time(),))
+            recovered = self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+            self._conn.commit()
+        return recovered
+
+
+_default_job_queue = None
+_default_job_queue_lock = threading.Lock()
+
+
+def get_default_job_queue():
+    """
+    Returns the process-wide job queue.
+    """
+    global _default_job_queue
+    with _default_job_queue_lock:
+        if _default_job_queue is None:
+            _default_job_queue = JobQueue()
+        return _default_job_queue
+
+
+class JobLogHandler(logging.Handler):
+    """
+    Stores the log records of a job in the job queue, for the app to show.
+    """
+
+    def __init__(self, queue, job_id, level=logging.INFO):
+        super().__init__(level)
+        self.queue = queue
+        self.job_id = job_id
+
+    def emit(self, record):
+        try:
+            self.queue.log(self.job_id, record.levelname, self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class JobPreview:
+    """
+    Stores the streamed answer of the request in progress as the job's preview.
+
+    Chunks arrive from the worker threads of run_analysis. Only the tail of every running
+    answer is kept, and the latest one is written to the job queue at most every
+    min_interval seconds, where the app polls it.
+    """
+
+    def __init__(self, queue, job_id, max_chars=PREVIEW_CHARS, min_interval=PREVIEW_INTERVAL):
+        self.queue = queue
+        self.job_id = job_id
+        self.max_chars = max_chars
+        self.min_interval = min_interval
+        self._answers = {}
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    def on_token(self, file_paths, text):
+        """
+        Adds a chunk of the answer for the pages in file_paths, see run_analysis. None
+        starts the answer over.
+        """
+        key = tuple(file_paths)
+        with self._lock:
+            answer = "" if text is None else self._answers.get(key, "") + text
+            answer = self._answers[key] = answer[-self.max_chars:]
+            if time.monotonic() - self._last_write < self.min_interval:
+                return
+            self._last_write = time.monotonic()
+            names = ", ".join(os.path.basename(file_path) for file_path in key)
+        self.queue.set_preview(self.job_id, f"{names}\n{answer}")
+
+    def finish(self, file_path):
+        """
+        Drops the answer of a finished page.
+        """
+        with self._lock:
+            for key in [key for key in self._answers if file_path in key]:
+                del self._answers[key]
+
+
+class KeyStore:
+    """
+    The API keys of the queued and running jobs, kept in the worker's memory only.
+
+    The app hands a key over with send_api_key and submits the job with the key's ID. If
+    the worker stops, the keys are gone and the jobs that need one fail, so they are
+    resumed with the key again.
+    """
+
+    def __init__(self):
+        self._keys = {}  # key ID -> (API key, time it was handed over)
+        self._lock = threading.Lock()
+
+    def put(self, key_id, api_key):
+        with self._lock:
+            self._keys[key_id] = (api_key, time.monotonic())
+
+    def get(self, key_id):
+        with self._lock:
+            return self._keys.get(key_id, (None, None))[0]
+
+    def prune(self, key_ids, min_age=KEY_SUBMIT_TIMEOUT):
+        """
+        Drops the keys not in key_ids, the keys of the jobs that ended. Keys handed over
+        less than min_age seconds ago are kept for the job that is being submitted.
+        """
+        keep = set(key_ids)
+        with self._lock:
+            for key_id, (_, put_at) in list(self._keys.items()):
+                if key_id not in keep and time.monotonic() - put_at >= min_age:
+                    del self._keys[key_id]
+
+
+_key_store = KeyStore()
+
+
+def _get_key_store():
+    # Every client of the manager gets the same store
+    return _key_store
+
+
+class BudgetManager(BaseManager):
+    """
+    Serves the worker's global budget to the job processes, and its KeyStore to the app.
+    """
+
+
+BudgetManager.register("FairBudget", FairBudget)
+BudgetManager.register("RateLimiter", RateLimiter, exposed=("acquire", "pause"))
+BudgetManager.register("KeyStore", _get_key_store, exposed=("put", "get", "prune"))
+
+
+def serve_worker_manager(queue, context=None):
+    """
+    Starts the worker's BudgetManager on the Unix socket of a job queue.
+
+    Only processes that can read the queue's authkey file, which is private to the user
+    running the worker, can connect to it.
+
+    Returns:
+        BudgetManager: The started manager, see stop_worker_manager.
+    """
+    for file_path in (queue.worker_address, queue.worker_authkey_path):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    authkey = secrets.token_bytes(32)
+    with os.fdopen(os.open(queue.worker_authkey_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+        f.write(authkey)
+    manager = BudgetManager(address=queue.worker_address, authkey=authkey, ctx=context)
+    manager.start()
+    return manager
+
+
+def stop_worker_manager(queue, manager):
+    manager.shutdown()
+    for file_path in (queue.worker_address, queue.worker_authkey_path):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def send_api_key(queue, api_key, timeout=WORKER_START_TIMEOUT):
+    """
+    Hands an API key over to the worker of a job queue, which keeps it in memory only.
+
+    Args:
+        queue (JobQueue): The job queue.
+        api_key (str): The key.
+        timeout (float): Seconds to wait for a worker that is just starting.
+
+    Returns:
+        str: The key's ID to submit or resume a job with.
+
+    Raises:
+        OSError: If no worker could be reached.
+    """
+    key_id = secrets.token_hex(16)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with open(queue.worker_authkey_path, "rb") as f:
+                authkey = f.read()
+            manager = BudgetManager(address=queue.worker_address, authkey=authkey)
+            manager.connect()
+            manager.KeyStore().put(key_id, api_key)
+            return key_id
+        except (OSError, multiprocessing.AuthenticationError) as e:
+            # The worker is not up yet, or was restarted in the meantime
+            if time.monotonic() >= deadline:
+                raise OSError(f"The job worker could not be reached: {e}") from e
+            time.sleep(0.2)
+
+
+def run_job(job_id, path, budget, rate_limiter, cancel, api_key=None):
+    """
+    Runs the pending pages of a job, in a process of its own started by run_worker.
+
+    Args:
+        job_id (int): The job.
+        path (str): The job queue file.
+        budget: Proxy of the worker's FairBudget.
+        rate_limiter: Proxy of the worker's RateLimiter.
+        cancel (multiprocessing.Event): Set by the worker to stop the job.
+        api_key (str): The job's API key from the worker's KeyStore, None for the default key.
+    """
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - job {job_id} - %(levelname)s - %(message)s')
+    queue = JobQueue(path)
+    handler = JobLogHandler(queue, job_id)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+
+    job = queue.get(job_id)
+    pages = queue.pending_pages(job_id)
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(job["settings"])
+    settings["api_key"] = api_key
+    logger.info(f"Starting job {job['name']}: {len(pages)} of {job['pages']} pages to analyse")
+
+    preview = JobPreview(queue, job_id)
+
+    def on_page(done, file_path, result, error):
+        preview.finish(file_path)
+        queue.record_page(job_id, file_path, result, error)
+
+    metrics = RunMetrics(name=job["name"])
+    try:
+        _, upload_stats = run_analysis(
+            pages, settings,
+            on_page=on_page,
+            on_token=preview.on_token,
+            metrics=metrics,
+            rate_limiter=rate_limiter,
+            budget=BudgetShare(budget, job["owner"], job_id),
+            cancel=cancel
+        )
+    except Exception as e:
+        logger.error(f"Job {job['name']} failed: {str(e)}")
+        queue.finish(job_id, "failed", error=str(e))
+        return
+
+    report = {"metrics": metrics.to_json(pages=True), "prometheus": metrics.to_prometheus(), "upload_stats": upload_stats}
+    if cancel.is_set():
+        # The worker also stops its jobs when it shuts down, those go back to the queue
+        status = "cancelled" if queue.get(job_id)["status"] == "cancelling" else "queued"
+    else:
+        queue.fail_pending(job_id, "The page could not be converted")
+        status = "done"
+    queue.finish(job_id, status, report=report)
+    logger.info(f"Job {job['name']} {'finished' if status == 'done' else status}")
+
+
+def run_worker(path=jobs_path, max_jobs=worker_jobs, max_in_flight=worker_max_in_flight,
+               requests_per_minute=worker_requests_per_minute, tokens_per_minute=worker_tokens_per_minute,
+               poll_interval=POLL_INTERVAL):
+    """
+    Runs the queued jobs until the process is stopped.
+
+    Every job runs in a process of its own, up to max_jobs at the same time. All jobs share
+    one budget of requests in flight, which is granted fairly between the users, and one
+    requests and tokens per minute budget. Jobs of a worker that died are resumed. Only
+    one worker runs per job queue. The API keys of the jobs are kept in its KeyStore.
+
+    Returns:
+        int: Exit code, 1 if another worker is already running.
+    """
+    queue = JobQueue(path)
+    pid = os.getpid()
+    if not queue.claim_worker(pid):
+        logger.info("Another job worker is running")
+        return 1
+    recovered = queue.recover()
+    if recovered:
+        logger.info(f"Resuming {recovered} jobs of the last worker")
+
+    # Stop like on Ctrl+C, so the running jobs go back to the queue
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    context = multiprocessing.get_context("spawn")
+    manager = serve_worker_manager(queue, context)
+    budget = manager.FairBudget(max_in_flight)
+    rate_limiter = manager.RateLimiter(requests_per_minute, tokens_per_minute)
+    keys = manager.KeyStore()
+    logger.info(f"Job worker {pid} started: {max_jobs} jobs, {max_in_flight} requests in flight")
+
+    running = {}  # job ID -> (process, cancel event)
+    try:
+        while True:
+            queue.heartbeat(pid)
+
+            for job_id, (process, cancel) in list(running.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del running[job_id]
+                slots = budget.release_all(job_id)
+                if slots:
+                    logger.warning(f"Job {job_id} ended with {slots} requests in flight")
+                job = queue.get(job_id)
+                if job is not None and job["status"] in ("running", "cancelling"):
+                    queue.finish(job_id, "failed", error=f"The job process exited with code {process.exitcode}")
+
+            active = queue.jobs(statuses=ACTIVE_STATES, limit=None)
+            keys.prune([job["api_key_id"] for job in active if job["api_key_id"]])
+            for job in active:
+                if job["status"] == "cancelling":
+                    if job["id"] in running:
+                        running[job["id"]][1].set()
+                    else:
+                        queue.finish(job["id"], "cancelled")  # e.g. cancelled between two rounds
+                # Keep the job's files from expiring in the image store
+                if job["work_dir"] and os.path.isdir(job["work_dir"]):
+                    os.utime(job["work_dir"])
+
+            while len(running) < max_jobs:
+                job_id = queue.next_job()
+                if job_id is None:
+                    break
+                api_key_id = queue.get(job_id)["api_key_id"]
+                api_key = keys.get(api_key_id) if api_key_id else None
+                if api_key_id and api_key is None:
+                    queue.finish(job_id, "failed", error="The API key of the job was lost when the job worker stopped, "
+                                                         "resume the job to enter it again")
+                    continue
+                cancel = context.Event()
+                process = context.Process(target=run_job, args=(job_id, path, budget, rate_limiter, cancel, api_key),
+                                          name=f"job-{job_id}")
+                process.start()
+                running[job_id] = (process, cancel)
+                logger.info(f"Started job {job_id}")
+
+            time.sleep(poll_interval)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info(f"Stopping job worker, {len(running)} running jobs go back to the queue")
+    finally:
+        for process, cancel in running.values():
+            cancel.set()
+        for process, _ in running.values():
+            process.join()
+        stop_worker_manager(queue, manager)
+        queue.release_worker(pid)
+    return 0
+
+
+_worker_started = 0.0
+
+
+def start_worker(queue=None):
+    """
+    Starts a worker process in the background unless one is alive, e.g. from the app.
+
+    The worker outlives the app's sessions and writes its log to AISISAX_WORKER_LOG.
+
+    Returns:
+        bool: True if a worker was started.
+    """
+    global _worker_started
+    queue = queue or get_default_job_queue()
+    # A new worker needs a moment for its first heartbeat
+    if queue.worker_alive() or time.time() - _worker_started < WORKER_TIMEOUT:
+        return False
+    _worker_started = time.time()
+
+    if os.path.dirname(worker_log_path):
+        os.makedirs(os.path.dirname(worker_log_path), exist_ok=True)
+    env = dict(os.environ, AISISAX_JOBS_PATH=queue.path,
+               PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")])))
+    with open(worker_log_path, "ab") as log:
+        subprocess.Popen([sys.executable, "-m", "aisisax.jobs"], stdout=log, stderr=subprocess.STDOUT,
+                         stdin=subprocess.DEVNULL, env=env, start_new_session=True)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m aisisax.jobs",
+        description="Run the analysis jobs submitted in the app. The app starts a worker itself if none is running."
+    )
+    parser.add_argument("--jobs", type=int, default=worker_jobs, help="Jobs running at the same time")
+    parser.add_argument("--concurrency", type=int, default=worker_max_in_flight,
+                        help="Requests in flight of all jobs together")
+    parser.add_argument("--rpm", type=int, default=worker_requests_per_minute,
+                        help="Requests per minute of all jobs together, 0 = unlimited")
+    parser.add_argument("--tpm", type=int, default=worker_tokens_per_minute,
+                        help="Tokens per minute of all jobs together, 0 = unlimited")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - worker - %(levelname)s - %(message)s')
+
+    return run_worker(max_jobs=args.jobs, max_in_flight=args.concurrency,
+                      requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
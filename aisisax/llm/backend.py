@@ -0,0 +1,148 @@
+import importlib
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+
+from aisisax.llm.concurrency import request_with_backoff
+
+load_dotenv()
+
+# Every backend module implements the same interface:
+#   list_models(base_url=None) -> list of model names
+#   warm_up(model, base_url=None) -> loads the model before the first request
+#   parallel_slots() -> requests the server runs at once (a client setting), or None if unlimited
+#   generate_answer(query, messages=None, model=..., ...) -> str
+#   generate_multimodal_answer(query, image_path, messages=None, temperature=..., api_key=None,
+#                              model=..., base_url=None, use_cache=True, image_data=None, detail=None,
+#                              response_format=None, on_token=None, on_usage=None, on_logprobs=None) -> str
+#   generate_multipage_answer(query, images, messages=None, temperature=..., api_key=None,
+#                             model=..., base_url=None, use_cache=True, detail=None, response_format=None,
+#                             on_token=None, on_usage=None) -> str
+# response_format is an OpenAI-style structured output format (see aisisax.llm.schema).
+# on_token(text) is called with every streamed chunk of the answer, e.g. for a live preview.
+# on_token(None) means the answer starts over, because the request is retried.
+# on_usage(usage) is called with the token usage the API reports for a request
+# ({"input_tokens", "output_tokens", "total_tokens"}), not for answers from the cache.
+# on_logprobs(tokens) is called with the logprobs of the answer's tokens ([{"token", "logprob"}, ...])
+# by backends that support them. Such requests bypass the cache.
+BACKENDS = {
+    "openai": "aisisax.llm.openai_connector",
+    "ollama": "aisisax.llm.ollama_connector",
+}
+
+# HTTP connection pool limits shared by all clients
+http_max_connections = int(os.getenv("AISISAX_HTTP_MAX_CONNECTIONS", "32"))
+http_max_keepalive = int(os.getenv("AISISAX_HTTP_MAX_KEEPALIVE", "32"))
+http_keepalive_expiry = float(os.getenv("AISISAX_HTTP_KEEPALIVE_EXPIRY", "60"))
+
+_pool = {}
+_pool_lock = threading.RLock()  # factories may fetch pooled objects themselves
+
+
+def get_backend(name):
+    """
+    Returns the connector module of a backend.
+
+    Args:
+        name (str): The backend name, one of BACKENDS.
+
+    Returns:
+        module: The connector implementing generate_answer and generate_multimodal_answer.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}', choose one of {', '.join(BACKENDS)}")
+    return importlib.import_module(BACKENDS[name])
+
+
+def get_pooled(key, factory):
+    """
+    Returns the pooled object for the key, creating it with factory() on first use.
+
+    Chat clients are pooled per backend, API key, base URL, model and temperature, so
+    that their HTTP connections are kept alive across pages instead of doing a new
+    TLS handshake for every request.
+    """
+    with _pool_lock:
+        client = _pool.get(key)
+        if client is None:
+            client = _pool[key] = factory()
+        return client
+
+
+def http_limits():
+    """
+    Returns the connection pool limits configured in the .env file.
+    """
+    return httpx.Limits(
+        max_connections=http_max_connections,
+        max_keepalive_connections=http_max_keepalive,
+        keepalive_expiry=http_keepalive_expiry
+    )
+
+
+def get_http_client():
+    """
+    Returns the process-wide HTTP client with keep-alive used by the OpenAI clients.
+    """
+    return get_pooled(("httpx",), lambda: httpx.Client(limits=http_limits(), timeout=httpx.Timeout(600.0, connect=10.0)))
+
+
+def invoke_chat(chat, messages, on_token=None, on_usage=None, on_logprobs=None):
+    """
+    Calls a LangChain chat model and returns the answer text.
+
+    Rate limits and transient server errors are retried per request, see
+    request_with_backoff.
+
+    Args:
+        chat: The chat model.
+        messages (list): The LangChain messages.
+        on_token (callable): Optional, streams the answer and calls on_token(text) with
+            every chunk as it arrives. A retried request calls on_token(None) before it
+            streams the answer again.
+        on_usage (callable): Optional, called with the token usage reported by the API.
+        on_logprobs (callable): Optional, called with the token logprobs of the answer if
+            the chat model was asked for them.
+
+    Returns:
+        str: The complete answer.
+    """
+    if on_token is None:
+        response = request_with_backoff(lambda: chat.invoke(messages))
+        if on_usage is not None and getattr(response, "usage_metadata", None):
+            on_usage(dict(response.usage_metadata))
+        logprobs = (response.response_metadata.get("logprobs") or {}).get("content")
+        if on_logprobs is not None and logprobs:
+            on_logprobs(logprobs)
+        return response.content
+
+    started = False
+
+    def stream():
+        # A retried request starts over, also in the preview
+        nonlocal started
+        if started:
+            on_token(None)
+        started = True
+        chunks = []
+        usage = {}
+        logprobs = []
+        for chunk in chat.stream(messages):
+            if chunk.content:
+                chunks.append(chunk.content)
+                on_token(chunk.content)
+            # Usage usually arrives with the last chunk
+            for name, value in (getattr(chunk, "usage_metadata", None) or {}).items():
+                if isinstance(value, int):
+                    usage[name] = usage.get(name, 0) + value
+            logprobs.extend((chunk.response_metadata.get("logprobs") or {}).get("content") or [])
+        return chunks, usage, logprobs
+
+    chunks, usage, logprobs = request_with_backoff(stream)
+    if on_usage is not None and usage:
+        on_usage(usage)
+    if on_logprobs is not None and logprobs:
+        on_logprobs(logprobs)
+    return "".join(chunks)
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cache location and eviction limits can be configured in the .env file
+cache_path = os.getenv("AISISAX_CACHE_PATH", os.path.join(".cache", "analysis_cache.sqlite"))
+cache_max_mb = float(os.getenv("AISISAX_CACHE_MAX_MB", "512"))
+cache_max_age_days = float(os.getenv("AISISAX_CACHE_MAX_AGE_DAYS", "30"))
+
+# Run the eviction every N writes
+EVICT_INTERVAL = 100
+
+
+def cache_key(image_bytes, query, model, temperature, backend):
+    """
+    Builds the content-addressed cache key of a multimodal request.
+
+    Args:
+        image_bytes (bytes): The raw image as sent to the model.
+        query (str): The prompt text.
+        model (str): The model name.
+        temperature (float): The sampling temperature.
+        backend (str): The backend name, e.g. 'openai' or 'ollama'.
+
+    Returns:
+        str: The hex SHA-256 digest.
+    """
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    request = json.dumps([backend, model, float(temperature), query, image_hash])
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+def multimodal_cache_key(image_data, query, model, temperature, detail=None, response_format=None, backend="openai"):
+    """
+    Returns the cache key of a multimodal request with one or more images, including its
+    structured output format and image detail.
+    """
+    if isinstance(image_data, list):
+        image_data = b"".join(hashlib.sha256(image).digest() for image in image_data)
+    if response_format is not None:
+        query = query + json.dumps(response_format, sort_keys=True)
+    return cache_key(image_data, query, model, temperature, backend if detail is None else f"{backend}:{detail}")
+
+
+class AnalysisCache:
+    """
+    Persistent SQLite cache for LLM answers with size- and age-based eviction.
+
+    The cache is safe to share between threads and between processes using the same file.
+    """
+
+    def __init__(self, path=cache_path, max_mb=cache_max_mb, max_age_days=cache_max_age_days):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        self.max_age = max_age_days * 24 * 3600 if max_age_days else None
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_accessed_at ON answers (accessed_at)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """
+        Returns the cached answer for the key, or None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT answer, created_at FROM answers WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or (self.max_age and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, answer):
+        """
+        Stores an answer under the key.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, answer, len(answer.encode("utf-8")), now, now)
+            )
+            self._conn.commit()
+            self._writes += 1
+            evict = self._writes % EVICT_INTERVAL == 0
+
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries and the least recently used ones beyond the size limit.
+        """
+        with self._lock:
+            if self.max_age:
+                self._conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.max_age,))
+
+            if self.max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+                if total > self.max_bytes:
+                    to_free = total - self.max_bytes
+                    cursor = self._conn.execute("SELECT key, size FROM answers ORDER BY accessed_at")
+                    keys = []
+                    for key, size in cursor:
+                        keys.append((key,))
+                        to_free -= size
+                        if to_free <= 0:
+                            break
+                    self._conn.executemany("DELETE FROM answers WHERE key = ?", keys)
+
+            self._conn.commit()
+
+    def clear(self):
+        """
+        Removes all entries and resets the counters.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and the current number and size of entries.
+        """
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "size_mb": size / 1024 / 1024}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    Returns the process-wide cache shared by the connectors.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = AnalysisCache()
+        return _default_cache
@@ -0,0 +1,151 @@
+import json
+import math
+import re
+from collections import Counter
+
+from aisisax.llm.tokens import model_cost
+
+# Fields answered by the cheap model with a lower confidence are asked again to the strong model
+CASCADE_THRESHOLD = 0.9
+
+# Temperature of the additional samples, identical samples would always agree
+SAMPLE_TEMPERATURE = 0.7
+
+
+def field_confidences(answer, logprobs, fields):
+    """
+    Estimates the confidence of every field of a JSON answer from the token logprobs.
+
+    The confidence of a field is the joint probability of the tokens of its value, e.g.
+    of `true` or `"left"`. Tokens spanning the value and the surrounding punctuation
+    count as part of the value.
+
+    Args:
+        answer (str): The model's answer.
+        logprobs (list): The logprobs of the answer's tokens, [{"token", "logprob"}, ...].
+        fields (list): The answer fields, see aisisax.llm.schema.
+
+    Returns:
+        dict: Field name -> confidence between 0 and 1, for the fields found in the answer.
+            Empty if the tokens do not add up to the answer.
+    """
+    if "".join(token["token"] for token in logprobs) != answer:
+        return {}
+
+    spans = []
+    position = 0
+    for token in logprobs:
+        spans.append((position, position + len(token["token"]), token["logprob"]))
+        position += len(token["token"])
+
+    decoder = json.JSONDecoder()
+    confidences = {}
+    for field in fields:
+        match = re.search('"' + re.escape(field["name"]) + r'"\s*:\s*', answer)
+        if match is None:
+            continue
+        try:
+            _, end = decoder.raw_decode(answer, match.end())
+        except ValueError:
+            continue
+        logprob = sum(value for start, stop, value in spans if start < end and stop > match.end())
+        confidences[field["name"]] = math.exp(logprob)
+    return confidences
+
+
+def sample_agreement(samples, fields):
+    """
+    Combines several answers of the same model by majority vote.
+
+    Args:
+        samples (list): The valid values of every answer, see aisisax.llm.schema.validate_answer.
+        fields (list): The answer fields.
+
+    Returns:
+        tuple: (values, confidences) with the most frequent value of every field and the
+            share of samples that gave it.
+    """
+    values = {}
+    confidences = {}
+    for field in fields:
+        answers = Counter(json.dumps(sample[field["name"]]) for sample in samples if field["name"] in sample)
+        if not answers:
+            continue
+        value, count = answers.most_common(1)[0]
+        values[field["name"]] = json.loads(value)
+        confidences[field["name"]] = count / len(samples)
+    return values, confidences
+
+
+class CascadeReport:
+    """
+    Escalation rates, cost and latency of a cascade run compared with asking the strong
+    model for every page.
+
+    The baseline is estimated per page: the prompt and image tokens of a single request
+    at the strong model's image rates and the output tokens of the cheap model's answer,
+    at the latency of the strong model's requests in this run.
+    """
+
+    def __init__(self, cheap_model, strong_model):
+        self.cheap_model = cheap_model
+        self.strong_model = strong_model
+        self.pages = 0
+        self.escalated_pages = 0
+        self.escalated = Counter()
+        self.asked = Counter()
+        self.usage = {}
+        self.baseline_tokens = [0, 0]
+        self.seconds = 0.0
+        self.strong_seconds = []
+
+    def add(self, stats):
+        """
+        Records a page, with stats["cascade"] as set by the pipeline.
+        """
+        cascade = stats["cascade"]
+        self.pages += 1
+        self.escalated_pages += bool(cascade["escalated"])
+        self.asked.update(cascade["fields"])
+        self.escalated.update(cascade["escalated"])
+        for model, usage in cascade["usage"].items():
+            entry = self.usage.setdefault(model, {"input_tokens": 0, "output_tokens": 0})
+            entry["input_tokens"] += usage["input_tokens"]
+            entry["output_tokens"] += usage["output_tokens"]
+        self.baseline_tokens[0] += cascade["baseline_tokens"][0]
+        self.baseline_tokens[1] += cascade["baseline_tokens"][1]
+        self.seconds += cascade["seconds"]
+        if cascade["strong_seconds"] is not None:
+            self.strong_seconds.append(cascade["strong_seconds"])
+
+    def summary(self):
+        """
+        Returns:
+            dict: "pages", "escalated_pages", "escalation" (rate per field), "cost" and
+                "baseline_cost" in USD (None without known prices), "mean_page_s" (request
+                seconds per page) and "baseline_page_s" (None without any escalation).
+        """
+        costs = [model_cost(model, usage["input_tokens"], usage["output_tokens"]) for model, usage in self.usage.items()]
+        return {
+            "pages": self.pages,
+            "escalated_pages": self.escalated_pages,
+            "escalation": {name: self.escalated[name] / count for name, count in self.asked.items()},
+            "cost": None if None in costs else sum(costs),
+            "baseline_cost": model_cost(self.strong_model, *self.baseline_tokens),
+            "mean_page_s": self.seconds / self.pages if self.pages else None,
+            "baseline_page_s": sum(self.strong_seconds) / len(self.strong_seconds) if self.strong_seconds else None,
+        }
+
+    def log(self, logger):
+        summary = self.summary()
+        if not summary["pages"]:
+            return
+        logger.info(f"Cascade: {summary['escalated_pages']} of {summary['pages']} pages escalated from "
+                    f"{self.cheap_model} to {self.strong_model} ({summary['escalated_pages'] / summary['pages']:.1%})")
+        logger.info("Escalation per field: " + ", ".join(f"{name} {rate:.1%}" for name, rate in summary["escalation"].items()))
+        if summary["cost"] is not None and summary["baseline_cost"]:
+            logger.info(f"Cascade cost ${summary['cost']:.4f}, {self.strong_model} on every page ~${summary['baseline_cost']:.4f} "
+                        f"({summary['cost'] / summary['baseline_cost'] - 1:+.1%})")
+        if summary["baseline_page_s"] is not None:
+            logger.info(f"Cascade requests {summary['mean_page_s']:.2f}s per page, {self.strong_model} requests "
+                        f"~{summary['baseline_page_s']:.2f}s ({summary['mean_page_s'] / summary['baseline_page_s'] - 1:+.1%})")
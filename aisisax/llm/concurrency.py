@@ -0,0 +1,415 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+import httpx
+
+logger = logging.getLogger("tibet_processor")
+
+# HTTP status codes that are worth retrying (rate limit and transient server errors)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def get_status_code(error):
+    """
+    Returns the HTTP status code attached to an exception raised by an API client, if any.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+
+def is_connection_error(error):
+    """
+    Returns True if the request failed because the connection was lost or timed out,
+    also if an API client wrapped the HTTP error (e.g. openai.APIConnectionError).
+    """
+    return any(isinstance(e, (httpx.TransportError, ConnectionError, TimeoutError)) for e in (error, error.__cause__))
+
+
+def get_retry_after(error):
+    """
+    Returns the delay in seconds requested by the server via the Retry-After header, if any.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Sliding-window limiter for requests-per-minute and tokens-per-minute budgets.
+
+    A budget of None (or 0) means unlimited. The limiter is thread-safe and shared by all
+    workers of a run. With a parent limiter, e.g. the global budget of the job worker
+    (or a proxy of it in another process), every request has to fit into both.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, period=60.0, parent=None):
+        self.requests_per_minute = requests_per_minute or None
+        self.tokens_per_minute = tokens_per_minute or None
+        self.period = period
+        self.parent = parent
+        self._events = deque()  # (timestamp, tokens)
+        self._tokens_in_window = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """
+        Blocks all further requests for the given number of seconds (e.g. after a 429).
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if self.parent is not None:
+            self.parent.pause(seconds)
+
+    def acquire(self, tokens=0):
+        """
+        Blocks until a request using the given number of tokens fits into both budgets.
+        """
+        if self.tokens_per_minute:
+            # A single request larger than the budget would otherwise block forever
+            tokens = min(tokens, self.tokens_per_minute)
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= self.period:
+                    _, expired_tokens = self._events.popleft()
+                    self._tokens_in_window -= expired_tokens
+
+                wait_time = self._paused_until - now
+                if wait_time <= 0:
+                    fits_requests = not self.requests_per_minute or len(self._events) < self.requests_per_minute
+                    fits_tokens = not self.tokens_per_minute or self._tokens_in_window + tokens <= self.tokens_per_minute
+                    if fits_requests and fits_tokens:
+                        self._events.append((now, tokens))
+                        self._tokens_in_window += tokens
+                        break
+                    wait_time = self._events[0][0] + self.period - now
+
+            time.sleep(max(wait_time, 0.01))
+
+        if self.parent is not None:
+            self.parent.acquire(tokens)
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of requests in flight and adapts the limit to the backend.
+
+    The limit is halved whenever the backend throttles us and grows again by one after
+    a full window of successful requests, up to max_in_flight (AIMD).
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.limit = self.max_in_flight
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_in_flight:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+
+
+class FairBudget:
+    """
+    Requests in flight shared by several runs, e.g. the jobs of all users of a server.
+
+    A free slot goes to the waiting owner with the fewest requests in flight, so a user
+    with a large job cannot crowd out the others. Slots are counted per holder (e.g. a
+    job), so the slots of a holder that died can be given back with release_all. Runs
+    use the budget through a BudgetShare.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._in_flight = Counter()  # owner -> slots
+        self._holders = Counter()  # (owner, holder) -> slots
+        self._waiting = Counter()  # owner -> requests waiting for a slot
+        self._condition = threading.Condition()
+
+    def acquire(self, owner, holder=None):
+        with self._condition:
+            self._waiting[owner] += 1
+            try:
+                while (sum(self._in_flight.values()) >= self.max_in_flight
+                       or self._in_flight[owner] > min(self._in_flight[other] for other in self._waiting)):
+                    self._condition.wait()
+            finally:
+                self._waiting[owner] -= 1
+                if not self._waiting[owner]:
+                    del self._waiting[owner]
+            self._in_flight[owner] += 1
+            self._holders[owner, holder] += 1
+
+    def release(self, owner, holder=None):
+        with self._condition:
+            self._release(owner, holder, 1)
+
+    def release_all(self, holder):
+        """
+        Gives back all slots of a holder. Returns their number.
+        """
+        with self._condition:
+            slots = 0
+            for owner, other in list(self._holders):
+                if other == holder:
+                    slots += self._holders[owner, other]
+                    self._release(owner, holder, self._holders[owner, other])
+            return slots
+
+    def _release(self, owner, holder, slots):
+        # Called with the condition held
+        self._in_flight[owner] -= slots
+        if self._in_flight[owner] <= 0:
+            del self._in_flight[owner]
+        self._holders[owner, holder] -= slots
+        if self._holders[owner, holder] <= 0:
+            del self._holders[owner, holder]
+        self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {"max_in_flight": self.max_in_flight, "in_flight": dict(self._in_flight), "waiting": dict(self._waiting)}
+
+
+class BudgetShare:
+    """
+    The part of a FairBudget (or of a proxy of it in another process) used by one run,
+    entered around every request.
+    """
+
+    def __init__(self, budget, owner, holder=None):
+        self.budget = budget
+        self.owner = owner
+        self.holder = holder
+
+    def __enter__(self):
+        self.budget.acquire(self.owner, self.holder)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.budget.release(self.owner, self.holder)
+
+
+class Backoff:
+    """
+    Retry settings of the item a worker thread is processing, see call_with_backoff.
+
+    Chat requests made while processing the item are retried one by one with these
+    settings (request_with_backoff), so a rate-limited follow-up request does not repeat
+    the requests of the item that already succeeded.
+    """
+
+    def __init__(self, concurrency=None, rate_limiter=None, tokens=0, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self.tokens = tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.per_request = False  # set once a request was sent through request_with_backoff
+        self.prepaid = False  # the rate limiter was already taken from for the next request
+
+    def wait(self, error, status_code, attempt):
+        """
+        Sleeps before the next attempt. A 429 also lowers the in-flight limit and pauses
+        the rate limiter for everyone.
+        """
+        # Honour Retry-After if given, otherwise exponential backoff with full jitter
+        delay = get_retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+        if status_code == 429:
+            if self.concurrency is not None:
+                self.concurrency.on_throttle()
+            if self.rate_limiter is not None:
+                self.rate_limiter.pause(delay)
+
+        reason = f"HTTP {status_code}" if status_code is not None else type(error).__name__
+        limit = f", in-flight limit {self.concurrency.limit}" if self.concurrency is not None else ""
+        logger.warning(f"{reason}, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries}{limit})")
+        time.sleep(delay)
+
+
+_local = threading.local()
+
+
+def request_with_backoff(request):
+    """
+    Calls request() for a single HTTP request, retrying it with exponential backoff on
+    HTTP 429 and 5xx errors and lost connections. Any other exception is raised
+    immediately.
+
+    Within imap_concurrent the retries use the run's settings and budgets, see Backoff.
+    Every request and retry, e.g. the follow-up requests of a page, is counted by the
+    run's rate limiter. The first one uses what call_with_backoff took for the item.
+    Elsewhere the defaults of call_with_backoff apply. The API clients are created
+    without retries of their own, so they do not multiply with these.
+    """
+    backoff = getattr(_local, "backoff", None) or Backoff()
+    backoff.per_request = True
+    for attempt in range(backoff.max_retries + 1):
+        if backoff.prepaid:
+            backoff.prepaid = False
+        elif backoff.rate_limiter is not None:
+            backoff.rate_limiter.acquire(backoff.tokens)
+        try:
+            return request()
+        except Exception as e:
+            status_code = get_status_code(e)
+            retry = status_code in RETRY_STATUS_CODES or (status_code is None and is_connection_error(e))
+            if not retry or attempt == backoff.max_retries:
+                raise
+            backoff.wait(e, status_code, attempt)
+
+
+def call_with_backoff(func, item, concurrency, rate_limiter=None, tokens=0,
+                      max_retries=5, base_delay=1.0, max_delay=60.0, budget=None):
+    """
+    Calls func(item) within the concurrency limit and budgets.
+
+    Chat requests made by func are retried one by one, see request_with_backoff. If func
+    sends its requests otherwise (e.g. object detection), the whole call is retried with
+    exponential backoff on HTTP 429 and 5xx errors. Any other exception is raised
+    immediately.
+
+    The rate limiter is taken from before every call, the first chat request of func
+    counts against that, so it is not counted twice.
+    """
+    backoff = Backoff(concurrency, rate_limiter, tokens, max_retries, base_delay, max_delay)
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire(tokens)
+
+        with concurrency, budget or nullcontext():
+            _local.backoff = backoff
+            backoff.prepaid = rate_limiter is not None
+            try:
+                result = func(item)
+            except Exception as e:
+                status_code = get_status_code(e)
+                if status_code not in RETRY_STATUS_CODES or attempt == max_retries or backoff.per_request:
+                    raise
+                error = e
+            else:
+                concurrency.on_success()
+                return result
+            finally:
+                _local.backoff = None
+
+        backoff.wait(error, status_code, attempt)
+
+
+def imap_concurrent(func, items, max_in_flight=4, rate_limiter=None, estimate_tokens=None,
+                    max_retries=5, base_delay=1.0, max_delay=60.0, initializer=None, budget=None):
+    """
+    Calls func(item) for every item concurrently and yields the results as they complete.
+
+    Items are pulled lazily, so at most about twice max_in_flight of them are pending at
+    any time. This also works for generators that produce items while the analysis runs.
+
+    Args:
+        func (callable): Called with a single item, e.g. a page to analyse.
+        items (iterable): The items to process.
+        max_in_flight (int): Maximum number of concurrent calls.
+        rate_limiter (RateLimiter): Optional shared requests/tokens per minute budget.
+        estimate_tokens (callable): Returns the estimated token usage of an item.
+        max_retries (int): Number of retries per request on HTTP 429/5xx.
+        base_delay (float): Initial backoff delay in seconds.
+        max_delay (float): Upper bound for the backoff delay in seconds.
+        initializer (callable): Called once in every worker thread.
+        budget (BudgetShare): Optional share of a requests in flight budget of several runs,
+            applies in addition to max_in_flight.
+
+    Yields:
+        tuple: (index, result, error) in completion order. Either result or error is None.
+    """
+    concurrency = AdaptiveConcurrency(max_in_flight)
+
+    def call(item):
+        tokens = estimate_tokens(item) if estimate_tokens else 0
+        return call_with_backoff(func, item, concurrency, rate_limiter, tokens,
+                                 max_retries, base_delay, max_delay, budget)
+
+    with ThreadPoolExecutor(max_workers=concurrency.max_in_flight, initializer=initializer) as executor:
+        pending = {}
+        items = iter(enumerate(items))
+        exhausted = False
+
+        while pending or not exhausted:
+            while not exhausted and len(pending) < 2 * concurrency.max_in_flight:
+                try:
+                    index, item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(call, item)] = index
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    yield index, future.result(), None
+                except Exception as e:
+                    yield index, None, e
+
+
+def run_concurrent(func, items, on_complete=None, **kwargs):
+    """
+    Calls func(item) for every item concurrently and returns the results in input order.
+
+    Args:
+        func (callable): Called with a single item.
+        items (iterable): The items to process.
+        on_complete (callable): Called as on_complete(index, result, error) in the calling
+            thread whenever an item is done, e.g. to update a progress bar.
+        **kwargs: Passed on to imap_concurrent.
+
+    Returns:
+        list: One entry per item. Failed items hold the raised exception.
+    """
+    results = {}
+    for index, result, error in imap_concurrent(func, items, **kwargs):
+        results[index] = error if error is not None else result
+        if on_complete is not None:
+            on_complete(index, result, error)
+    return [results[index] for index in range(len(results))]
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from aisisax.llm.cache import EVICT_INTERVAL, multimodal_cache_key
+
+load_dotenv()
+
+# Answers per page and field, see FieldCache. Eviction limits can be configured in the .env file
+field_cache_path = os.getenv("AISISAX_FIELD_CACHE_PATH", os.path.join(".cache", "field_answers.sqlite"))
+field_cache_max_mb = float(os.getenv("AISISAX_FIELD_CACHE_MAX_MB", "128"))
+field_cache_max_age_days = float(os.getenv("AISISAX_FIELD_CACHE_MAX_AGE_DAYS", "30"))
+
+
+def question_hash(field):
+    """
+    Returns the hash of a field's question, from its whole prompt line (name, type and question).
+    """
+    return hashlib.sha256(field["line"].encode("utf-8")).hexdigest()
+
+
+def settings_key(model, temperature, detail=None, backend="openai", options=None):
+    """
+    Returns the key of the request settings answers are stored under.
+
+    The key is built like the keys of the analysis cache (see multimodal_cache_key), with
+    the other settings that change an answer (e.g. the image quality or margin crops) in
+    place of the image, which is identified by its hash in the field cache.
+
+    Args:
+        model (str): The model name.
+        temperature (float): The sampling temperature.
+        detail (str): The image detail.
+        backend (str): The backend name, e.g. 'openai' or 'ollama'.
+        options (dict): Other settings that change an answer.
+
+    Returns:
+        str: The hex SHA-256 digest.
+    """
+    options = json.dumps(options or {}, sort_keys=True).encode("utf-8")
+    return multimodal_cache_key(options, "", model, temperature, detail, backend=backend)
+
+
+class FieldCache:
+    """
+    Persistent SQLite store of the answers per page and per field.
+
+    Every answer is stored with the hash of the question that produced it, so after the
+    prompt was edited only the fields whose question changed, or that were added, have
+    to be asked again. Pages are identified by the SHA-256 of the image file, answers
+    are kept per model and request settings (see settings_key). Other parts of the
+    prompt, like the introduction, are not part of the key. Answers are evicted by size
+    and age like those of the AnalysisCache.
+
+    The store is safe to share between threads and between processes using the same file.
+    """
+
+    def __init__(self, path=field_cache_path, max_mb=field_cache_max_mb, max_age_days=field_cache_max_age_days):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        self.max_age = max_age_days * 24 * 3600 if max_age_days else None
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Answers of earlier versions were only kept per model, they cannot be reused
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(field_answers)")]
+        if columns and "settings" not in columns:
+            self._conn.execute("DROP TABLE field_answers")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS field_answers (
+                page TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                field TEXT NOT NULL,
+                question TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (page, settings, field, question)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS field_answers_accessed_at ON field_answers (accessed_at)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, page, fields, settings):
+        """
+        Returns the stored answers of a page for the fields whose question is unchanged.
+
+        Args:
+            page (str): The SHA-256 of the page image.
+            fields (list): The answer fields of the prompt, see aisisax.llm.schema.
+            settings (str): The key of the request settings, see settings_key.
+
+        Returns:
+            dict: Field name -> answer, for the fields with a stored answer.
+        """
+        if not fields:
+            return {}
+        questions = {question_hash(field): field["name"] for field in fields}
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT field, question, value, created_at FROM field_answers WHERE page = ? AND settings = ? "
+                f"AND question IN ({','.join('?' * len(questions))})",
+                (page, settings, *questions)
+            ).fetchall()
+            rows = [(name, question, value) for name, question, value, created_at in rows
+                    if questions.get(question) == name and not (self.max_age and now - created_at > self.max_age)]
+            if rows:
+                self._conn.executemany(
+                    "UPDATE field_answers SET accessed_at = ? WHERE page = ? AND settings = ? AND field = ? AND question = ?",
+                    [(now, page, settings, name, question) for name, question, _ in rows]
+                )
+                self._conn.commit()
+            answers = {name: json.loads(value) for name, _, value in rows}
+            self.hits += len(answers)
+            self.misses += len(fields) - len(answers)
+        return answers
+
+    def put(self, page, values, fields, settings):
+        """
+        Stores the answers of a page for the given fields.
+
+        Args:
+            page (str): The SHA-256 of the page image.
+            values (dict): Field name -> answer, other keys are ignored.
+            fields (list): The fields to store, see aisisax.llm.schema.
+            settings (str): The key of the request settings, see settings_key.
+        """
+        now = time.time()
+        rows = []
+        for field in fields:
+            if field["name"] in values:
+                row = (page, settings, field["name"], question_hash(field), json.dumps(values[field["name"]]))
+                rows.append((*row, sum(len(column.encode("utf-8")) for column in row), now, now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO field_answers (page, settings, field, question, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._writes += 1
+            evict = self._writes % EVICT_INTERVAL == 0
+
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes expired answers and the least recently used ones beyond the size limit.
+        """
+        with self._lock:
+            if self.max_age:
+                self._conn.execute("DELETE FROM field_answers WHERE created_at < ?", (time.time() - self.max_age,))
+
+            if self.max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM field_answers").fetchone()[0]
+                if total > self.max_bytes:
+                    to_free = total - self.max_bytes
+                    cursor = self._conn.execute("SELECT rowid, size FROM field_answers ORDER BY accessed_at")
+                    rowids = []
+                    for rowid, size in cursor:
+                        rowids.append((rowid,))
+                        to_free -= size
+                        if to_free <= 0:
+                            break
+                    self._conn.executemany("DELETE FROM field_answers WHERE rowid = ?", rowids)
+
+            self._conn.commit()
+
+    def clear(self):
+        """
+        Removes all answers and resets the counters.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM field_answers")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the hit/miss counters (in fields), the number of stored answers and pages and
+        their size.
+        """
+        with self._lock:
+            answers, pages, size = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT page), COALESCE(SUM(size), 0) FROM field_answers"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "answers": answers, "pages": pages, "size_mb": size / 1024 / 1024}
+
+
+_default_field_cache = None
+_default_field_cache_lock = threading.Lock()
+
+
+def get_default_field_cache():
+    """
+    Returns the process-wide field cache.
+    """
+    global _default_field_cache
+    with _default_field_cache_lock:
+        if _default_field_cache is None:
+            _default_field_cache = FieldCache()
+        return _default_field_cache
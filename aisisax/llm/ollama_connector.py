@@ -1,24 +1,114 @@
 import base64
+import json
+import logging
 import os
+import threading
 
-from langchain.chat_models import ChatOllama
+from langchain_ollama import ChatOllama
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 from dotenv import load_dotenv
 
+from aisisax.llm.backend import get_http_client, get_pooled, http_limits, invoke_chat
+from aisisax.llm.cache import get_default_cache, multimodal_cache_key
+
 # Load the .env file
 load_dotenv()
 
+logger = logging.getLogger("tibet_processor")
+
 # Host und Port aus der .env-Datei laden
-ollama_host = os.getenv("OLLAMA_HOST")  # Standardwert: localhost
+ollama_host = os.getenv("OLLAMA_HOST", "http://localhost")  # Standardwert: localhost
 ollama_port = os.getenv("OLLAMA_PORT", "11434")  # Standardwert: 11434
 
-def generate_answer(query, messages=None, model="llama3.2"):
+# Wie lange das Modell nach der letzten Anfrage im Speicher bleibt (Ollama-Dauer, z.B. "30m" oder "-1")
+ollama_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Anzahl paralleler Slots des Servers. Ollama meldet sie nicht über die API, der Wert muss
+# daher von Hand OLLAMA_NUM_PARALLEL des Servers entsprechen
+ollama_num_parallel = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+
+_warm_models = set()
+_warm_lock = threading.Lock()
+
+
+def server_url(base_url=None):
+    """
+    Returns the server URL, either base_url or OLLAMA_HOST and OLLAMA_PORT.
+    """
+    return (base_url or f"{ollama_host}:{ollama_port}").rstrip("/")
+
+
+def list_models(base_url=None):
+    """
+    Returns the names of the models installed on the Ollama server.
+    """
+    response = get_http_client().get(f"{server_url(base_url)}/api/tags", timeout=10)
+    response.raise_for_status()
+    return sorted(model["name"] for model in response.json().get("models", []))
+
+
+def warm_up(model, base_url=None):
+    """
+    Loads the model into memory before the first page, so that the first requests do
+    not wait for it. An empty request only loads the model, it generates nothing.
+    Every model is warmed up once per process.
+    """
+    url = server_url(base_url)
+    with _warm_lock:
+        if (url, model) in _warm_models:
+            return
+        logger.info(f"Loading Ollama model {model} on {url} (keep_alive {ollama_keep_alive})")
+        response = get_http_client().post(f"{url}/api/generate", json={"model": model, "keep_alive": ollama_keep_alive})
+        response.raise_for_status()
+        _warm_models.add((url, model))
+
+
+def parallel_slots():
+    """
+    Returns how many requests the server processes at the same time. More requests in
+    flight would only wait in the server's queue.
+
+    Ollama does not report its slots over the API, so this is a client setting: the
+    OLLAMA_NUM_PARALLEL of this process's environment, which has to match the server's.
+    """
+    return ollama_num_parallel
+
+
+def get_chat(model, temperature, base_url=None, format=None):
+    """
+    Returns a pooled ChatOllama client whose HTTP connections are kept alive.
+
+    Args:
+        model (str): The model name.
+        temperature (float): The sampling temperature.
+        base_url (str): Optional server URL, otherwise OLLAMA_HOST and OLLAMA_PORT.
+        format (dict): Optional JSON schema the answer has to follow.
+
+    Returns:
+        ChatOllama: The chat model.
+    """
+    base_url = server_url(base_url)
+
+    def create():
+        return ChatOllama(
+            base_url=base_url,
+            model=model,
+            temperature=temperature,
+            format=format,
+            keep_alive=ollama_keep_alive,
+            client_kwargs={"limits": http_limits()}
+        )
+
+    return get_pooled(("ollama", base_url, model, temperature, json.dumps(format, sort_keys=True)), create)
+
+def generate_answer(query, messages=None, model="llama3.2", temperature=0.9, api_key=None, base_url=None):
     """
     communicates with Ollama chatbot inference server.
 
     Args:
         query (str): The question to be answered.
         messages (list): A list of previous messages as dictionaries with "role" and "content".
+        api_key (str): Unused, accepted for the common backend interface.
 
     Returns:
         str: The chatbot's answer.
@@ -31,12 +121,8 @@ def generate_answer(query, messages=None, model="llama3.2"):
     Use only the information from the context to answer the question.
     If you can't find relevant information in the context, say so."""
 
-    # ChatOllama mit benutzerdefiniertem Host und Port initialisieren
-    chat = ChatOllama(
-        base_url=f"{ollama_host}:{ollama_port}",
-        model=model,
-        temperature=0.9
-    )
+    # Gepoolten ChatOllama-Client mit benutzerdefiniertem Host und Port holen
+    chat = get_chat(model, temperature, base_url=base_url)
 
     # Convert messages to LangChain's format
     formatted_messages = [SystemMessage(content=system_prompt)]
@@ -50,26 +136,35 @@ def generate_answer(query, messages=None, model="llama3.2"):
     formatted_messages.append(HumanMessage(content=f"Question: {query}"))
 
     # Call the Ollama server and get the response
-    response = chat.invoke(formatted_messages)
-
-    return response.content
+    return invoke_chat(chat, formatted_messages)
 
-def generate_multimodal_answer(query, image_path, model="llama3.2", messages=None):
+def generate_multimodal_answer(query, image_path, messages=None, temperature=0.9, api_key=None, model="llama3.2", base_url=None, use_cache=True, image_data=None, detail=None, response_format=None, on_token=None, on_usage=None, on_logprobs=None):
+    # api_key, detail and on_logprobs are part of the common backend interface, Ollama does not use them
     if messages is None:
         messages = []
 
+    # Use the preprocessed image(s) if given, otherwise read the original file
+    if image_data is None:
+        with open(image_path, "rb") as img_file:
+            image_data = img_file.read()
+
+    # Answers for the same image, prompt, model and temperature are served from the cache
+    cache = get_default_cache() if use_cache and not messages else None
+    if cache is not None:
+        key = multimodal_cache_key(image_data, query, model, temperature, response_format=response_format, backend="ollama")
+        answer = cache.get(key)
+        if answer is not None:
+            return answer
+
     # Define the system prompt
     system_prompt = """You are a multi-modal assistant that answers questions based on the provided context. 
     Use the information from the context and the provided image to answer the question.
     If you can't find relevant information in the context, say so."""
 
-    # ChatOllama mit benutzerdefiniertem Host und Port initialisieren
-    chat = ChatOllama(
-        host=ollama_host,
-        port=int(ollama_port),  # Port muss eine Zahl sein
-        model=model,  # Beispielmodell
-        temperature=0.9
-    )
+    # Gepoolten ChatOllama-Client mit benutzerdefiniertem Host und Port holen.
+    # Structured output uses the JSON schema of an OpenAI response_format.
+    schema = response_format["json_schema"]["schema"] if response_format is not None else None
+    chat = get_chat(model, temperature, base_url=base_url, format=schema)
 
     # Convert messages to LangChain's format
     formatted_messages = [SystemMessage(content=system_prompt)]
@@ -80,24 +175,42 @@ def generate_multimodal_answer(query, image_path, model="llama3.2", messages=Non
             formatted_messages.append(SystemMessage(content=msg["content"]))
 
     ## Add the new query
-    # Encode the image in base64
-    with open(image_path, "rb") as img_file:
-        image_bytes = base64.b64encode(img_file.read()).decode("utf-8")
-
-    prompt = HumanMessage(content=[
-            {"type": "text", "text": query},
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{image_bytes}"
-                },
+    content = [{"type": "text", "text": query}]
+    for image in (image_data if isinstance(image_data, list) else [image_data]):
+        # Encode the image in base64
+        image_bytes = base64.b64encode(image).decode("utf-8")
+
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{image_bytes}"
             },
-        ])
+        })
+
+    prompt = HumanMessage(content=content)
 
 
     formatted_messages.append(prompt)
 
-    # Call the multi-modal model
-    response = chat.invoke(formatted_messages)
+    # Call the multi-modal model, streaming the answer if a preview is shown
+    answer = invoke_chat(chat, formatted_messages, on_token, on_usage)
 
-    return response.content
\ No newline at end of file
+    if cache is not None:
+        cache.put(key, answer)
+
+    return answer
+
+def generate_multipage_answer(query, images, messages=None, temperature=0.9, api_key=None, model="llama3.2", base_url=None, use_cache=True, detail=None, response_format=None, on_token=None, on_usage=None, on_logprobs=None):
+    """
+    Sends several page images in a single request.
+
+    Args:
+        query (str): The prompt, asking for one answer per image.
+        images (list): The JPG images as bytes, in page order.
+
+    Returns:
+        str: The model's answer for all pages.
+    """
+    return generate_multimodal_answer(query, None, messages=messages, temperature=temperature, api_key=api_key, model=model,
+                                      base_url=base_url, use_cache=use_cache, image_data=list(images), detail=detail,
+                                      response_format=response_format, on_token=on_token, on_usage=on_usage)
@@ -0,0 +1,240 @@
+import base64
+import json
+import logging
+import os
+import time
+
+from openai import OpenAI
+
+from aisisax.llm.backend import get_http_client, get_pooled
+from aisisax.llm.openai_connector import MULTIMODAL_SYSTEM_PROMPT
+
+logger = logging.getLogger("tibet_processor")
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# Limits of a single batch input file (50,000 requests, 200 MB), with some headroom
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Batch requests are billed at half the price of interactive ones
+BATCH_DISCOUNT = 0.5
+
+
+def get_client(api_key=None, base_url=None):
+    """
+    Returns a pooled OpenAI SDK client for the files and batches endpoints.
+
+    Args:
+        api_key (str): Optional API key, otherwise OPENAI_API_KEY from the environment.
+        base_url (str): Optional base URL (e.g. a local stand-in server), otherwise
+            OPENAI_BASE_URL or the OpenAI API.
+    """
+    api_key = api_key.strip() if api_key and api_key.strip() else None
+    return get_pooled(
+        ("openai-batch", api_key, base_url),
+        lambda: OpenAI(api_key=api_key, base_url=base_url, http_client=get_http_client())
+    )
+
+
+def build_request(custom_id, query, image_data, model, temperature, detail=None, response_format=None):
+    """
+    Builds one line of a batch input file, equivalent to generate_multimodal_answer.
+
+    Args:
+        custom_id (str): The page ID the answer is matched back to.
+        query (str): The prompt text.
+        image_data (bytes): The JPG image, or a list of JPG images.
+        model (str): The model name.
+        temperature (float): The sampling temperature.
+        detail (str): Optional "detail" parameter of the image.
+        response_format (dict): Optional structured output format, see aisisax.llm.schema.
+
+    Returns:
+        dict: The batch request.
+    """
+    content = [{"type": "text", "text": query}]
+    for image in (image_data if isinstance(image_data, list) else [image_data]):
+        image_url = {"url": f"data:image/jpeg;base64,{base64.b64encode(image).decode('utf-8')}"}
+        if detail is not None:
+            image_url["detail"] = detail
+        content.append({"type": "image_url", "image_url": image_url})
+
+    body = {
+        "model": model,
+        "temperature": temperature,
+        "messages": [
+            {"role": "system", "content": MULTIMODAL_SYSTEM_PROMPT},
+            {"role": "user", "content": content},
+        ],
+    }
+    if response_format is not None:
+        body["response_format"] = response_format
+
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+
+def write_batch_files(requests, path_prefix):
+    """
+    Writes requests as JSONL, starting a new file whenever a batch limit would be exceeded.
+
+    Requests are written one at a time, so they can be produced lazily.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    paths = []
+    f = None
+    count = size = 0
+    for request in requests:
+        line = (json.dumps(request) + "\n").encode("utf-8")
+        if f is None or count >= MAX_BATCH_REQUESTS or size + len(line) > MAX_BATCH_BYTES:
+            if f is not None:
+                f.close()
+            paths.append(f"{path_prefix}.{len(paths):03d}.jsonl")
+            f = open(paths[-1], "wb")
+            count = size = 0
+        f.write(line)
+        count += 1
+        size += len(line)
+
+    if f is not None:
+        f.close()
+    return paths
+
+
+def submit_batch(client, path):
+    """
+    Uploads a batch input file and creates the batch.
+
+    Returns:
+        Batch: The created batch.
+    """
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+    logger.info(f"Submitted batch {batch.id} from {os.path.basename(path)}")
+    return batch
+
+
+def wait_for_batch(client, batch_id, poll_interval=30.0):
+    """
+    Polls a batch until it is completed, failed, expired or cancelled.
+
+    Returns:
+        Batch: The batch in its final state.
+    """
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts is not None:
+            logger.info(f"Batch {batch_id}: {batch.status}, {counts.completed}/{counts.total} completed, {counts.failed} failed")
+        if batch.status in FINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+
+def read_batch_results(client, batch, usage=None):
+    """
+    Downloads the output and error files of a finished batch.
+
+    Args:
+        client (OpenAI): The client, see get_client.
+        batch (Batch): The finished batch.
+        usage (dict): Optional, filled with the token usage of every answer by custom_id
+            ({"input_tokens", "output_tokens"}).
+
+    Returns:
+        tuple: (answers, errors), both dicts keyed by custom_id. Answers hold the message
+            content, errors a description of what went wrong.
+    """
+    answers = {}
+    errors = {}
+
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            custom_id = entry["custom_id"]
+            response = entry.get("response") or {}
+            if entry.get("error") or response.get("status_code") != 200:
+                errors[custom_id] = entry.get("error") or response.get("body")
+                continue
+            try:
+                answers[custom_id] = response["body"]["choices"][0]["message"]["content"]
+            except (KeyError, IndexError, TypeError):
+                errors[custom_id] = f"Unexpected response body: {response.get('body')}"
+                continue
+            if usage is not None and response["body"].get("usage"):
+                body_usage = response["body"]["usage"]
+                usage[custom_id] = {"input_tokens": body_usage.get("prompt_tokens", 0),
+                                    "output_tokens": body_usage.get("completion_tokens", 0)}
+
+    return answers, errors
+
+
+def run_batch(client, requests, work_dir, poll_interval=30.0, max_attempts=3, usage=None):
+    """
+    Submits requests through the Batch API and resubmits only the failed ones.
+
+    Args:
+        client (OpenAI): The client, see get_client.
+        requests (iterable): Batch requests as built by build_request.
+        work_dir (str): Directory for the batch input files.
+        poll_interval (float): Seconds between status checks.
+        max_attempts (int): How often a failed request is submitted at most.
+        usage (dict): Optional, filled with the token usage of every answer, see
+            read_batch_results.
+
+    Returns:
+        tuple: (answers, errors), both dicts keyed by custom_id. Errors only contain the
+            requests that still failed after the last attempt.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    prefix = os.path.join(work_dir, f"batch_{int(time.time())}")
+    paths = write_batch_files(requests, f"{prefix}_attempt1")
+
+    answers = {}
+    errors = {}
+    for attempt in range(1, max_attempts + 1):
+        errors = {}
+        custom_ids = {request["custom_id"] for request in _read_requests(paths)}
+
+        # Submit all files first so the batches run in parallel
+        batches = [submit_batch(client, path) for path in paths]
+        for batch in batches:
+            batch = wait_for_batch(client, batch.id, poll_interval)
+            if batch.status != "completed":
+                logger.warning(f"Batch {batch.id} ended with status {batch.status}")
+
+            batch_answers, batch_errors = read_batch_results(client, batch, usage)
+            answers.update(batch_answers)
+            errors.update(batch_errors)
+
+        # Requests without any output (e.g. expired batches) count as failed as well
+        for custom_id in custom_ids - answers.keys() - errors.keys():
+            errors[custom_id] = "No result returned"
+
+        if not errors or attempt == max_attempts:
+            break
+
+        logger.warning(f"{len(errors)} requests failed, resubmitting them (attempt {attempt + 1}/{max_attempts})")
+        failed = set(errors)
+        paths = write_batch_files(
+            (request for request in _read_requests(paths) if request["custom_id"] in failed),
+            f"{prefix}_attempt{attempt + 1}"
+        )
+
+    return answers, errors
+
+
+def _read_requests(paths):
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
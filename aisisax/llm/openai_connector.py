@@ -2,9 +2,66 @@ import base64
 from langchain_openai import ChatOpenAI
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 from dotenv import load_dotenv
+
+from aisisax.llm.backend import get_http_client, get_pooled, invoke_chat
+from aisisax.llm.cache import get_default_cache, multimodal_cache_key
 load_dotenv()
 
-def generate_answer(query, messages=None):
+# System prompt of multimodal requests, also used by the Batch API mode
+MULTIMODAL_SYSTEM_PROMPT = """You are a multi-modal assistant that answers questions based on the provided context. 
+    Use the information from the context and the provided image to answer the question.
+    If you can't find relevant information in the context, say so."""
+
+# Models offered in the app
+MODELS = ["gpt-4o", "chatgpt-4o-latest", "gpt-4o-mini"]
+
+def list_models(base_url=None):
+    """
+    Returns the models offered for analysis.
+    """
+    return list(MODELS)
+
+def warm_up(model, base_url=None):
+    """
+    Nothing to load for the hosted API, part of the common backend interface.
+    """
+
+def parallel_slots():
+    """
+    The hosted API has no fixed number of slots, concurrency is limited by the rate limits.
+    """
+    return None
+
+def get_chat(model, temperature, api_key=None, base_url=None):
+    """
+    Returns a pooled ChatOpenAI client sharing one keep-alive HTTP connection pool.
+
+    Args:
+        model (str): The model name.
+        temperature (float): The sampling temperature.
+        api_key (str): Optional API key, otherwise OPENAI_API_KEY from the environment.
+        base_url (str): Optional base URL (e.g. a local stub server), otherwise
+            OPENAI_BASE_URL or the OpenAI API.
+
+    Returns:
+        ChatOpenAI: The chat model.
+    """
+    api_key = api_key.strip() if api_key and api_key.strip() else None
+
+    def create():
+        kwargs = {}
+        if api_key:
+            kwargs["api_key"] = api_key
+        if base_url:
+            kwargs["base_url"] = base_url
+        # stream_usage: streamed answers report their token usage as well. Retries are
+        # done per request by invoke_chat, not by the SDK
+        return ChatOpenAI(model=model, temperature=temperature, http_client=get_http_client(), stream_usage=True,
+                          max_retries=0, **kwargs)
+
+    return get_pooled(("openai", api_key, base_url, model, temperature), create)
+
+def generate_answer(query, messages=None, model="gpt-4o", temperature=0.9, api_key=None, base_url=None):
     """
     Translates the OpenAI function to LangChain using OpenAI's GPT models.
 
@@ -23,8 +80,8 @@ def generate_answer(query, messages=None):
     Use only the information from the context to answer the question.
     If you can't find relevant information in the context, say so."""
 
-    # Initialize the LangChain OpenAI chat model
-    chat = ChatOpenAI(model="gpt-4o", temperature=0.9)
+    # Get the pooled LangChain OpenAI chat model
+    chat = get_chat(model, temperature, api_key=api_key, base_url=base_url)
 
     # Convert messages to LangChain's format
     formatted_messages = [SystemMessage(content=system_prompt)]
@@ -38,27 +95,37 @@ def generate_answer(query, messages=None):
     formatted_messages.append(HumanMessage(content=f"Question: {query}"))
 
     # Call the OpenAI model and get the response
-    response = chat.invoke(formatted_messages)
-
-    return response.content
+    return invoke_chat(chat, formatted_messages)
 
-def generate_multimodal_answer(query, image_path, messages=None, temperature=0.9, api_key=None, model="gpt-4o-mini"):
+def generate_multimodal_answer(query, image_path, messages=None, temperature=0.9, api_key=None, model="gpt-4o-mini", base_url=None, use_cache=True, image_data=None, detail=None, response_format=None, on_token=None, on_usage=None, on_logprobs=None):
     if messages is None:
         messages = []
 
+    # Use the preprocessed image(s) if given, otherwise read the original file
+    if image_data is None:
+        with open(image_path, "rb") as img_file:
+            image_data = img_file.read()
+
+    # Answers for the same image, prompt, model and temperature are served from the cache,
+    # unless the logprobs are needed as well
+    cache = get_default_cache() if use_cache and not messages and on_logprobs is None else None
+    if cache is not None:
+        key = multimodal_cache_key(image_data, query, model, temperature, detail, response_format)
+        answer = cache.get(key)
+        if answer is not None:
+            return answer
+
     # Use provided API key if available and not empty, otherwise use default from env
-    if api_key and api_key.strip():
-        chat = ChatOpenAI(api_key=api_key, model=model, temperature=temperature)
-    else:
-        chat = ChatOpenAI(model=model, temperature=temperature)  # Uses default API key from env
+    chat = get_chat(model, temperature, api_key=api_key, base_url=base_url)
 
-    # Define the system prompt
-    system_prompt = """You are a multi-modal assistant that answers questions based on the provided context. 
-    Use the information from the context and the provided image to answer the question.
-    If you can't find relevant information in the context, say so."""
+    # Structured output, e.g. a JSON schema of the answer fields
+    if response_format is not None:
+        chat = chat.bind(response_format=response_format)
+    if on_logprobs is not None:
+        chat = chat.bind(logprobs=True)
 
     # Convert messages to LangChain's format
-    formatted_messages = [SystemMessage(content=system_prompt)]
+    formatted_messages = [SystemMessage(content=MULTIMODAL_SYSTEM_PROMPT)]
     for msg in messages:
         if msg["role"] == "user":
             formatted_messages.append(HumanMessage(content=msg["content"]))
@@ -68,24 +135,45 @@ def generate_multimodal_answer(query, image_path, messages=None, temperature=0.9
     ## Add the new query
     #formatted_messages.append(HumanMessage(content=query))
 
-    # Encode the image in base64
-    with open(image_path, "rb") as img_file:
-        image_bytes = base64.b64encode(img_file.read()).decode("utf-8")
+    content = [{"type": "text", "text": query}]
+    for image in (image_data if isinstance(image_data, list) else [image_data]):
+        # Encode the image in base64
+        image_bytes = base64.b64encode(image).decode("utf-8")
+
+        image_url = {"url": f"data:image/jpeg;base64,{image_bytes}"}
+        if detail is not None:
+            image_url["detail"] = detail
 
-    prompt = HumanMessage(content=[
-            {"type": "text", "text": query},
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{image_bytes}"
-                },
-            },
-        ])
+        content.append({
+            "type": "image_url",
+            "image_url": image_url,
+        })
+
+    prompt = HumanMessage(content=content)
 
 
     formatted_messages.append(prompt)
 
-    # Call the multi-modal model
-    response = chat.invoke(formatted_messages)
+    # Call the multi-modal model, streaming the answer if a preview is shown
+    answer = invoke_chat(chat, formatted_messages, on_token, on_usage, on_logprobs)
+
+    if cache is not None:
+        cache.put(key, answer)
+
+    return answer
+
+def generate_multipage_answer(query, images, messages=None, temperature=0.9, api_key=None, model="gpt-4o-mini", base_url=None, use_cache=True, detail=None, response_format=None, on_token=None, on_usage=None, on_logprobs=None):
+    """
+    Sends several page images in a single request.
 
-    return response.content
\ No newline at end of file
+    Args:
+        query (str): The prompt, asking for one answer per image.
+        images (list): The JPG images as bytes, in page order.
+
+    Returns:
+        str: The model's answer for all pages.
+    """
+    return generate_multimodal_answer(query, None, messages=messages, temperature=temperature, api_key=api_key, model=model,
+                                      base_url=base_url, use_cache=use_cache, image_data=list(images), detail=detail,
+                                      response_format=response_format, on_token=on_token, on_usage=on_usage,
+                                      on_logprobs=on_logprobs)
@@ -0,0 +1,109 @@
+from aisisax.llm.schema import parse_json_object
+
+# Context and image limits per model. Unknown models (e.g. local Ollama models) are
+# not packed, since their context is usually too small for several pages.
+MODEL_LIMITS = {
+    "gpt-4o": {"context_tokens": 128000, "max_output_tokens": 16384, "max_images": 10},
+    "chatgpt-4o-latest": {"context_tokens": 128000, "max_output_tokens": 16384, "max_images": 10},
+    "gpt-4o-mini": {"context_tokens": 128000, "max_output_tokens": 16384, "max_images": 10},
+}
+DEFAULT_LIMITS = {"context_tokens": 8192, "max_output_tokens": 2048, "max_images": 1}
+
+# Output tokens reserved for the JSON answer of one page
+OUTPUT_TOKENS_PER_PAGE = 250
+
+PACKING_INSTRUCTIONS = """
+You will receive {count} images. Each image is a separate page, numbered 1 to {count} in the order they are attached.
+Answer the questions above for every page separately and respond with a pure JSON object {{"pages": [...]}} whose array "pages" holds exactly {count} objects, one per page in the same order.
+Add the field "Page index" (Integer) with the page's number to every object in "pages"."""
+
+
+def packing_prompt(query, count):
+    """
+    Extends the analysis prompt with the instructions for a packed request of count pages.
+    """
+    return query + PACKING_INSTRUCTIONS.format(count=count)
+
+
+def max_pages_per_request(model, pack_size):
+    """
+    Returns how many pages may be packed into one request for the model.
+
+    Args:
+        model (str): The model name.
+        pack_size (int): The configured upper bound.
+    """
+    limits = MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+    return max(1, min(pack_size, limits["max_images"], limits["max_output_tokens"] // OUTPUT_TOKENS_PER_PAGE))
+
+
+def iter_packs(file_paths, model, pack_size, prompt_tokens, estimate_image_tokens):
+    """
+    Groups pages into packs that fit into the model's context and image limits.
+
+    Args:
+        file_paths (iterable): Page paths, may be a generator.
+        model (str): The model name.
+        pack_size (int): Maximum number of pages per pack.
+        prompt_tokens (int): Estimated tokens of the prompt.
+        estimate_image_tokens (callable): Returns the estimated image tokens of a page.
+
+    Yields:
+        list: Page paths of one pack, in page order.
+    """
+    limits = MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+    max_pages = max_pages_per_request(model, pack_size)
+
+    pack = []
+    pack_tokens = 0
+    for file_path in file_paths:
+        tokens = estimate_image_tokens(file_path)
+        budget = limits["context_tokens"] - prompt_tokens - OUTPUT_TOKENS_PER_PAGE * (len(pack) + 1)
+        if pack and (len(pack) >= max_pages or pack_tokens + tokens > budget):
+            yield pack
+            pack = []
+            pack_tokens = 0
+        pack.append(file_path)
+        pack_tokens += tokens
+
+    if pack:
+        yield pack
+
+
+def parse_packed_answer(raw_result, count):
+    """
+    Parses the JSON object {"pages": [...]} of a packed answer, the shape of
+    json_schema(fields, packed=True).
+
+    Entries are matched to pages by their "Page index" if present, otherwise by
+    position. Pages without a usable entry are None, so that only those pages need
+    to be analysed again.
+
+    Args:
+        raw_result (str): The model's answer.
+        count (int): The number of pages in the request.
+
+    Returns:
+        list: One dict or None per page.
+    """
+    answers = [None] * count
+
+    try:
+        entries = parse_json_object(raw_result).get("pages")
+    except ValueError:
+        return answers
+    if not isinstance(entries, list):
+        return answers
+
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            continue
+        page_index = entry.pop("Page index", None)
+        try:
+            index = int(page_index) - 1 if page_index is not None else position
+        except (TypeError, ValueError):
+            index = position
+        if 0 <= index < count and answers[index] is None:
+            answers[index] = entry
+
+    return answers
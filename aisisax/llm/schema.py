@@ -0,0 +1,221 @@
+import json
+import re
+
+# A field line of the analysis prompt, e.g.
+#   "Frame present" (String): Analyze the image to detect vertical lines ...
+FIELD_PATTERN = re.compile(r'^\s*"(?P<name>[^"]+)"\s*\((?P<type>\w+)\)\s*:\s*(?P<question>.*)$')
+
+FIELD_TYPES = {
+    "bool": "boolean",
+    "boolean": "boolean",
+    "integer": "integer",
+    "int": "integer",
+    "string": "string",
+    "str": "string",
+}
+
+# Allowed answers of fields whose question names a fixed set of values
+FIELD_ENUMS = {
+    "Illustration position": ["none", "left", "right", "center"],
+    "Frame present": ["None", "Red", "Black"],
+}
+
+TRUE_VALUES = {"true", "yes", "1"}
+FALSE_VALUES = {"false", "no", "0"}
+NONE_VALUES = {"", "none", "null", "n/a"}
+
+
+def fields_from_prompt(prompt):
+    """
+    Extracts the answer fields from the field lines of the analysis prompt.
+
+    Args:
+        prompt (str): The analysis prompt.
+
+    Returns:
+        list: One dict per field with "name", "type" ('boolean', 'integer' or 'string'),
+            "question", "line" (the prompt line) and optionally "enum".
+    """
+    fields = []
+    for line in prompt.splitlines():
+        match = FIELD_PATTERN.match(line)
+        if match is None:
+            continue
+        field = {
+            "name": match.group("name"),
+            "type": FIELD_TYPES.get(match.group("type").lower(), "string"),
+            "question": match.group("question").strip(),
+            "line": line.strip(),
+        }
+        if field["type"] == "string" and field["name"] in FIELD_ENUMS:
+            field["enum"] = FIELD_ENUMS[field["name"]]
+        fields.append(field)
+    return fields
+
+
+def json_schema(fields, packed=False):
+    """
+    Builds the JSON schema of an answer for structured output.
+
+    Integers are nullable, since they are only asked for if present on the page.
+
+    Args:
+        fields (list): The answer fields, see fields_from_prompt.
+        packed (bool): Schema for a packed request, an object with a "pages" array of
+            answers that each carry a "Page index".
+
+    Returns:
+        dict: The JSON schema.
+    """
+    properties = {}
+    for field in fields:
+        if "enum" in field:
+            properties[field["name"]] = {"type": "string", "enum": field["enum"]}
+        elif field["type"] == "integer":
+            properties[field["name"]] = {"type": ["integer", "null"]}
+        else:
+            properties[field["name"]] = {"type": field["type"]}
+
+    if packed:
+        properties["Page index"] = {"type": "integer"}
+
+    schema = {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+    if packed:
+        schema = {
+            "type": "object",
+            "properties": {"pages": {"type": "array", "items": schema}},
+            "required": ["pages"],
+            "additionalProperties": False,
+        }
+    return schema
+
+
+def response_format(fields, packed=False):
+    """
+    Returns the OpenAI response_format for structured output with the fields' schema.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "page_analysis", "strict": True, "schema": json_schema(fields, packed)},
+    }
+
+
+def parse_json_object(raw_result):
+    """
+    Extracts the first JSON object from an answer, with or without a fenced code block.
+
+    Raises:
+        ValueError: If the answer contains no valid JSON object.
+    """
+    start = raw_result.find("{")
+    end = raw_result.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("No JSON object found")
+    result = json.loads(raw_result[start:end + 1])
+    if not isinstance(result, dict):
+        raise ValueError("Answer is not a JSON object")
+    return result
+
+
+def coerce_value(value, field):
+    """
+    Converts an answer to the field's type.
+
+    Returns:
+        tuple: (value, valid). Invalid answers return (None, False).
+    """
+    text = str(value).strip().lower() if value is not None else ""
+
+    if "enum" in field:
+        if value is None:
+            text = "none"
+        for option in field["enum"]:
+            if option.lower() == text:
+                return option, True
+        return None, False
+
+    if field["type"] == "boolean":
+        if isinstance(value, bool):
+            return value, True
+        if text in TRUE_VALUES:
+            return True, True
+        if text in FALSE_VALUES:
+            return False, True
+        return None, False
+
+    if field["type"] == "integer":
+        if isinstance(value, bool):
+            return None, False
+        if isinstance(value, int):
+            return value, True
+        if isinstance(value, float) and value.is_integer():
+            return int(value), True
+        if text in NONE_VALUES:
+            return None, True
+        try:
+            # int() also accepts Tibetan and other Unicode decimal digits
+            return int(text), True
+        except ValueError:
+            return None, False
+
+    if value is None:
+        return None, False
+    return str(value), True
+
+
+def validate_answer(answer, fields):
+    """
+    Coerces a parsed answer to the fields' types.
+
+    Args:
+        answer (dict): The parsed answer, or None if it could not be parsed.
+        fields (list): The answer fields, see fields_from_prompt.
+
+    Returns:
+        tuple: (values, invalid) with the coerced values of all valid fields and the names
+            of the missing or invalid fields.
+    """
+    values = {}
+    invalid = []
+    for field in fields:
+        if answer is None or field["name"] not in answer:
+            invalid.append(field["name"])
+            continue
+        value, valid = coerce_value(answer[field["name"]], field)
+        if valid:
+            values[field["name"]] = value
+        else:
+            invalid.append(field["name"])
+    return values, invalid
+
+
+def retry_prompt(prompt, fields):
+    """
+    Builds a prompt that only asks the given fields again.
+
+    The instructions before the field list of the original prompt are kept.
+    """
+    lines = prompt.splitlines()
+    first_field = next((i for i, line in enumerate(lines) if FIELD_PATTERN.match(line)), len(lines))
+    preamble = "\n".join(lines[:first_field]).rstrip()
+    field_lines = "\n".join(field["line"] for field in fields)
+    return (f"{preamble}\n\nYour previous answer for the following fields was missing or invalid. "
+            f"Answer only these questions and respond as a pure JSON object with exactly these fields:\n\n{field_lines}\n")
+
+
+def remove_fields(prompt, names):
+    """
+    Returns the prompt without the field lines of the given fields, e.g. because they
+    are already answered locally.
+    """
+    lines = []
+    for line in prompt.splitlines(keepends=True):
+        match = FIELD_PATTERN.match(line.rstrip("\n"))
+        if match is None or match.group("name") not in names:
+            lines.append(line)
+    return "".join(lines)
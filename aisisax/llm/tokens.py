@@ -0,0 +1,82 @@
+import json
+import math
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# USD per million input and output tokens. Dated versions (e.g. gpt-4o-2024-08-06) use
+# the price of their model, unknown models (e.g. local Ollama models) have no price.
+# Prices change, AISISAX_MODEL_PRICES='{"gpt-4o": [2.5, 10]}' overrides them.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "chatgpt-4o-latest": (5.00, 15.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+MODEL_PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv("AISISAX_MODEL_PRICES", "{}")).items()})
+
+
+def estimate_text_tokens(text):
+    """
+    Rough token estimate for a prompt (about four characters per token).
+
+    Args:
+        text (str): The prompt text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / 4)
+
+
+def estimate_image_tokens(width, height, detail="high"):
+    """
+    Estimates the image tokens billed by the OpenAI vision models.
+
+    Images are first scaled to fit into 2048x2048, then so that the shortest side is
+    at most 768px, and finally billed per 512px tile plus a fixed base amount.
+
+    Args:
+        width (int): Image width in pixels.
+        height (int): Image height in pixels.
+        detail (str): The "detail" parameter of the request ('low' or 'high').
+
+    Returns:
+        int: The estimated number of image tokens.
+    """
+    if detail == "low":
+        return 85
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def model_cost(model, input_tokens, output_tokens):
+    """
+    Computes the cost of a request from its token usage.
+
+    Args:
+        model (str): The model name.
+        input_tokens (int): Prompt tokens including images.
+        output_tokens (int): Answer tokens.
+
+    Returns:
+        float: The cost in USD, or None if the model has no known price.
+    """
+    # The longest matching name, so gpt-4o-mini-2024-07-18 is not priced as gpt-4o
+    names = [name for name in MODEL_PRICES if model == name or model.startswith(name + "-")]
+    if not names:
+        return None
+    input_price, output_price = MODEL_PRICES[max(names, key=len)]
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from aisisax.llm.tokens import model_cost
+
+# Stages of a page in processing order
+STAGES = ["unzip", "convert", "prefilter", "hash", "encode", "request", "parse", "insert"]
+
+
+class PageMetrics:
+    """
+    Time per stage, requests, tokens and cost of a single page.
+
+    Every "request" span is one request to the model, retries included.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.calls = {}
+        self.usage = {}  # model -> {"input_tokens", "output_tokens", "cost"}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, calls=1):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+
+    def add_usage(self, model, usage, discount=1.0):
+        """
+        Records the token usage of a request as returned by the API.
+
+        Args:
+            model (str): The model the request was sent to.
+            usage (dict): "input_tokens" and "output_tokens" (LangChain's usage_metadata).
+            discount (float): Price factor, e.g. 0.5 for the Batch API.
+        """
+        input_tokens = usage.get("input_tokens") or 0
+        output_tokens = usage.get("output_tokens") or 0
+        cost = model_cost(model, input_tokens, output_tokens)
+        with self._lock:
+            entry = self.usage.setdefault(model, {"input_tokens": 0, "output_tokens": 0, "cost": 0.0})
+            entry["input_tokens"] += input_tokens
+            entry["output_tokens"] += output_tokens
+            if cost is None:
+                entry["cost"] = None
+            elif entry["cost"] is not None:
+                entry["cost"] += cost * discount
+
+    def merge(self, other, share=1.0):
+        """
+        Adds a share of another record, e.g. of a request for several pages.
+        """
+        for stage, seconds in other.stages.items():
+            self.add(stage, seconds * share, other.calls[stage] * share)
+        with self._lock:
+            for model, usage in other.usage.items():
+                entry = self.usage.setdefault(model, {"input_tokens": 0, "output_tokens": 0, "cost": 0.0})
+                entry["input_tokens"] += usage["input_tokens"] * share
+                entry["output_tokens"] += usage["output_tokens"] * share
+                entry["cost"] = None if entry["cost"] is None or usage["cost"] is None else entry["cost"] + usage["cost"] * share
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "page": self.name,
+                "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+                "requests": self.calls.get("request", 0),
+                "usage": {model: dict(usage) for model, usage in self.usage.items()},
+            }
+
+
+@contextmanager
+def span(page, stage):
+    """
+    Adds the time spent in the block to a stage of the page, if page is not None.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if page is not None:
+            page.add(stage, time.perf_counter() - start)
+
+
+class RunMetrics:
+    """
+    Collects the metrics of all pages of a run and aggregates them.
+
+    Pages are recorded from the worker threads, so all methods are thread-safe.
+    """
+
+    def __init__(self, name="analysis"):
+        self.name = name
+        self.started = time.time()
+        self.finished = None
+        self.pages = {}
+        self.counts = {"analysed": 0, "failed": 0, "skipped": 0, "local": 0, "reused": 0}
+        self.run_stages = {}
+        self._lock = threading.Lock()
+
+    def page(self, file_path):
+        """
+        Returns the record of a page, creating it on first use.
+        """
+        with self._lock:
+            page = self.pages.get(file_path)
+            if page is None:
+                page = self.pages[file_path] = PageMetrics(os.path.basename(file_path))
+            return page
+
+    def count(self, status):
+        with self._lock:
+            self.counts[status] += 1
+
+    def add(self, stage, seconds):
+        """
+        Records a stage of the whole run, e.g. building the results table.
+        """
+        with self._lock:
+            self.run_stages[stage] = self.run_stages.get(stage, 0.0) + seconds
+
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self):
+        """
+        Aggregates the run.
+
+        Returns:
+            dict: "pages" (counts by status), "elapsed_s", "stages" (total, mean, p50, p95,
+                p99 and max seconds per stage over the pages that went through it),
+                "run_stages", "requests", "models" (tokens and cost per model) and
+                "cost" (total, None if a model has no known price).
+        """
+        with self._lock:
+            pages = [page.to_dict() for page in self.pages.values()]
+            counts = dict(self.counts)
+            run_stages = dict(self.run_stages)
+
+        stages = {}
+        for stage in STAGES + sorted({name for page in pages for name in page["stages"]} - set(STAGES)):
+            values = [page["stages"][stage] for page in pages if stage in page["stages"]]
+            if not values:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {
+                "pages": len(values),
+                "total_s": round(float(np.sum(values)), 3),
+                "mean_s": round(float(np.mean(values)), 4),
+                "p50_s": round(float(p50), 4),
+                "p95_s": round(float(p95), 4),
+                "p99_s": round(float(p99), 4),
+                "max_s": round(float(np.max(values)), 4),
+            }
+
+        models = {}
+        for page in pages:
+            for model, usage in page["usage"].items():
+                entry = models.setdefault(model, {"input_tokens": 0, "output_tokens": 0, "cost": 0.0})
+                entry["input_tokens"] += usage["input_tokens"]
+                entry["output_tokens"] += usage["output_tokens"]
+                entry["cost"] = None if entry["cost"] is None or usage["cost"] is None else entry["cost"] + usage["cost"]
+        for entry in models.values():
+            entry["input_tokens"] = round(entry["input_tokens"])
+            entry["output_tokens"] = round(entry["output_tokens"])
+            if entry["cost"] is not None:
+                entry["cost"] = round(entry["cost"], 6)
+
+        costs = [entry["cost"] for entry in models.values()]
+        finished = self.finished or time.time()
+        return {
+            "name": self.name,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+            "elapsed_s": round(finished - self.started, 3),
+            "pages": counts,
+            "stages": stages,
+            "run_stages": {stage: round(seconds, 3) for stage, seconds in run_stages.items()},
+            "requests": round(sum(page["requests"] for page in pages)),
+            "models": models,
+            "cost": None if None in costs else round(sum(costs), 6),
+        }
+
+    def to_json(self, pages=False):
+        """
+        Returns the summary as JSON, with pages=True also the record of every page.
+        """
+        report = self.summary()
+        if pages:
+            with self._lock:
+                report["page_metrics"] = [page.to_dict() for page in self.pages.values()]
+        return json.dumps(report, indent=2)
+
+    def to_prometheus(self):
+        """
+        Returns the summary in the Prometheus text exposition format, e.g. for the
+        textfile collector of node_exporter.
+        """
+        summary = self.summary()
+        run = _label_value(self.name)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join([f'run="{run}"'] + [f'{key}="{_label_value(val)}"' for key, val in labels.items()])
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        metric("aisisax_run_duration_seconds", "gauge", "Wall-clock time of the run.",
+               [({}, summary["elapsed_s"])])
+        metric("aisisax_pages_total", "counter", "Pages by status.",
+               [({"status": status}, count) for status, count in summary["pages"].items()])
+        metric("aisisax_requests_total", "counter", "Requests sent to the model.",
+               [({}, summary["requests"])])
+
+        lines.append("# HELP aisisax_stage_seconds Time per page spent in a stage.")
+        lines.append("# TYPE aisisax_stage_seconds summary")
+        for stage, values in summary["stages"].items():
+            labels = f'run="{run}",stage="{stage}"'
+            for quantile, key in (("0.5", "p50_s"), ("0.95", "p95_s"), ("0.99", "p99_s")):
+                lines.append(f'aisisax_stage_seconds{{{labels},quantile="{quantile}"}} {values[key]}')
+            lines.append(f"aisisax_stage_seconds_sum{{{labels}}} {values['total_s']}")
+            lines.append(f"aisisax_stage_seconds_count{{{labels}}} {values['pages']}")
+
+        metric("aisisax_tokens_total", "counter", "Tokens reported by the API.",
+               [({"model": model, "type": kind}, usage[f"{kind}_tokens"])
+                for model, usage in summary["models"].items() for kind in ("input", "output")])
+        metric("aisisax_cost_usd_total", "counter", "Cost of the requests in USD, for models with a known price.",
+               [({"model": model}, usage["cost"]) for model, usage in summary["models"].items() if usage["cost"] is not None])
+        return "\n".join(lines) + "\n"
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
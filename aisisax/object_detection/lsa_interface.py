@@ -1,34 +1,332 @@
 import requests
 import base64
+import hashlib
+import json
+import logging
 from PIL import Image
 from io import BytesIO
 from dotenv import load_dotenv
 import os
 
+import numpy as np
+from requests.adapters import HTTPAdapter
+
+from aisisax.llm.backend import get_pooled, http_max_connections
+from aisisax.llm.cache import AnalysisCache
+from aisisax.llm.concurrency import run_concurrent
+
 # Load the .env file
 load_dotenv()
 
-def call_lsa(image_path, text_prompt, sam_type = "sam2.1_hiera_small", box_threshold = 0.5, text_threshold = 0.5):
-    #image_path = "/home/ubuntu/lang-segment-anything/assets/car.jpeg"
-
-    # Prepare the multipart form-data payload
-    with open(image_path, "rb") as image_file:
-                files = {"image": image_file}  # Server expects the key 'image_file'
-                data = {
-                       "sam_type": sam_type,
-                       "box_threshold": box_threshold,
-                       "text_threshold": text_threshold,
-                       "text_prompt": text_prompt,
-                       }
-
-                    # Send the POST request to the predict endpoint
-                object_detection_host = os.getenv("OBJECT_DETECTION_HOST")
-                response = requests.post(f"{object_detection_host}/predict", files=files, data=data)
-
-                # Handle the response
-                if response.status_code == 200:
-                     output_image = Image.open(BytesIO(response.content)).convert("RGB")
-                else:
-                     print(f"Error: {response.status_code} - {response.text}")
-
-    return output_image
\ No newline at end of file
+logger = logging.getLogger("tibet_processor")
+
+object_detection_host = os.getenv("OBJECT_DETECTION_HOST")
+detection_cache_path = os.getenv("AISISAX_DETECTION_CACHE_PATH", os.path.join(".cache", "detection_cache.sqlite"))
+
+DEFAULT_SAM_TYPE = "sam2.1_hiera_small"
+
+# The /predict endpoint of lang-segment-anything returns the image with the masks, boxes
+# and labels drawn into it, as a PNG. The detections are recovered from the pixels the
+# server changed, see overlay_detections. A server extended to return the raw prediction
+# as JSON ({"boxes": [...], "scores": [...], "labels": [...], "masks": [...]}) gets exact
+# boxes, scores and labels instead.
+
+# Minimum change of a colour channel that counts as drawn by the server, above the
+# differences of decoding the same JPEG twice
+OVERLAY_THRESHOLD = 40
+
+# Changed pixels are grouped into objects on a grid of this many pixels
+OVERLAY_CELL = 8
+
+# Groups of fewer grid cells are noise
+OVERLAY_MIN_CELLS = 4
+
+def get_session():
+    """
+    Returns the pooled HTTP session, so that connections to the server are kept alive.
+    """
+    def create():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=http_max_connections)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    return get_pooled(("lsa-session",), create)
+
+
+def get_detection_cache():
+    """
+    Returns the detection cache, stored next to the analysis cache by default.
+    """
+    return get_pooled(("lsa-cache", detection_cache_path), lambda: AnalysisCache(path=detection_cache_path))
+
+
+def rle_encode(mask):
+    """
+    Run-length encodes a binary mask in COCO's uncompressed format.
+
+    Counts alternate between runs of 0 and 1 in column-major order, starting with 0.
+
+    Returns:
+        dict: {"size": [height, width], "counts": [...]}
+    """
+    mask = np.asarray(mask, dtype=bool)
+    pixels = np.concatenate([[False], mask.ravel(order="F"), [False]])
+    changes = np.flatnonzero(pixels[1:] != pixels[:-1])
+    counts = np.diff(np.concatenate([[0], changes, [mask.size]]))
+    # The trailing run of zeros is only counted if the mask does not end with ones
+    if counts[-1] == 0:
+        counts = counts[:-1]
+    return {"size": list(mask.shape), "counts": counts.tolist()}
+
+
+def rle_decode(rle):
+    """
+    Decodes a mask encoded by rle_encode.
+
+    Returns:
+        np.ndarray: The boolean mask.
+    """
+    height, width = rle["size"]
+    values = np.arange(len(rle["counts"])) % 2 == 1
+    flat = np.repeat(values, rle["counts"])
+    flat = np.concatenate([flat, np.zeros(height * width - len(flat), dtype=bool)])
+    return flat.reshape((height, width), order="F")
+
+
+def detection_cache_key(image_data, prompts, sam_type, box_threshold, text_threshold, overlay):
+    """
+    Returns the cache key of a detection request, by image hash, prompts and parameters.
+    """
+    image_hash = hashlib.sha256(image_data).hexdigest()
+    request = json.dumps([image_hash, list(prompts), sam_type, float(box_threshold), float(text_threshold), bool(overlay)])
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+def match_prompt(label, prompts):
+    """
+    Returns the prompt a detected phrase belongs to, or the label itself.
+    """
+    label = label.strip().lower()
+    for prompt in prompts:
+        if prompt.lower() == label:
+            return prompt
+    for prompt in prompts:
+        if prompt.lower() in label or label in prompt.lower():
+            return prompt
+    return label
+
+
+def parse_detections(prediction, prompts):
+    """
+    Converts the server's raw prediction to one dict per detected object.
+
+    Returns:
+        list: Dicts with "prompt", "label", "box" ([x0, y0, x1, y1]), "score" and
+            "mask" (RLE, see rle_encode, or None).
+    """
+    boxes = prediction.get("boxes") or []
+    scores = prediction.get("scores") or [None] * len(boxes)
+    labels = prediction.get("labels") or [""] * len(boxes)
+    masks = prediction.get("masks") or [None] * len(boxes)
+
+    detections = []
+    for box, score, label, mask in zip(boxes, scores, labels, masks):
+        if mask is not None and not isinstance(mask, dict):
+            mask = rle_encode(mask)
+        detections.append({
+            "prompt": match_prompt(label, prompts),
+            "label": label,
+            "box": [float(value) for value in box],
+            "score": float(score) if score is not None else None,
+            "mask": mask,
+        })
+    return detections
+
+
+def overlay_detections(image, overlay, prompts):
+    """
+    Recovers the detected objects from the overlay the server rendered into the image.
+
+    Pixels that differ from the uploaded image were drawn by the server. They are grouped
+    into connected regions on a grid of OVERLAY_CELL pixels, each region is one object.
+    The overlay has no scores, and with several prompts it does not tell which prompt
+    an object belongs to. Objects that touch are merged.
+
+    Args:
+        image (PIL.Image.Image): The uploaded image.
+        overlay (PIL.Image.Image): The server's response.
+        prompts (list): The prompts of the request.
+
+    Returns:
+        list: Dicts like parse_detections, "prompt" is None with several prompts, "label"
+            is empty and "score" is None.
+    """
+    original = np.asarray(image.convert("RGB"), dtype=np.int16)
+    drawn = np.asarray(overlay.convert("RGB"), dtype=np.int16)
+    if original.shape != drawn.shape:
+        logger.warning(f"The overlay ({drawn.shape[1]}x{drawn.shape[0]}) does not match the image, no detections")
+        return []
+    changed = np.abs(drawn - original).max(axis=2) > OVERLAY_THRESHOLD
+
+    # Mark the grid cells with changed pixels, then group neighbouring cells
+    height, width = changed.shape
+    rows, cols = -(-height // OVERLAY_CELL), -(-width // OVERLAY_CELL)
+    padded = np.zeros((rows * OVERLAY_CELL, cols * OVERLAY_CELL), dtype=bool)
+    padded[:height, :width] = changed
+    cells = padded.reshape(rows, OVERLAY_CELL, cols, OVERLAY_CELL).any(axis=(1, 3))
+
+    labels = np.zeros(cells.shape, dtype=np.int32)
+    groups = []
+    for start in zip(*np.nonzero(cells)):
+        if labels[start]:
+            continue
+        labels[start] = len(groups) + 1
+        group = [start]
+        stack = [start]
+        while stack:
+            row, col = stack.pop()
+            for neighbour in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+                if 0 <= neighbour[0] < rows and 0 <= neighbour[1] < cols and cells[neighbour] and not labels[neighbour]:
+                    labels[neighbour] = len(groups) + 1
+                    group.append(neighbour)
+                    stack.append(neighbour)
+        groups.append(group)
+
+    prompt = prompts[0] if len(prompts) == 1 else None
+    detections = []
+    for number, group in enumerate(groups, start=1):
+        if len(group) < OVERLAY_MIN_CELLS:
+            continue
+        # Only the cells of the object's bounding box are expanded to pixels
+        (top, left), (bottom, right) = np.min(group, axis=0), np.max(group, axis=0) + 1
+        region = np.repeat(np.repeat(labels[top:bottom, left:right] == number, OVERLAY_CELL, axis=0), OVERLAY_CELL, axis=1)
+        y0, x0 = top * OVERLAY_CELL, left * OVERLAY_CELL
+        mask = np.zeros(changed.shape, dtype=bool)
+        window = changed[y0:bottom * OVERLAY_CELL, x0:right * OVERLAY_CELL]
+        mask[y0:y0 + window.shape[0], x0:x0 + window.shape[1]] = window & region[:window.shape[0], :window.shape[1]]
+        ys, xs = np.nonzero(mask)
+        detections.append({
+            "prompt": prompt,
+            "label": "",
+            "box": [float(xs.min()), float(ys.min()), float(xs.max() + 1), float(ys.max() + 1)],
+            "score": None,
+            "mask": rle_encode(mask),
+        })
+    return detections
+
+
+def detect_objects(image_path, prompts, sam_type=DEFAULT_SAM_TYPE, box_threshold=0.5, text_threshold=0.5,
+                   overlay=False, use_cache=True, image_data=None, host=None):
+    """
+    Detects several kinds of objects on an image in a single request.
+
+    The prompts are sent as one text prompt ("illustration. stamp. frame."), so the
+    image is uploaded and encoded by the server only once. The detections are read from
+    the rendered overlay (see overlay_detections), or from the raw prediction if the
+    server returns JSON. Results are cached by image hash, prompts and parameters.
+
+    Args:
+        image_path (str): Path of the image.
+        prompts (list): Object descriptions, e.g. ["illustration", "round red stamp"].
+        sam_type (str): The SAM model of the server.
+        box_threshold (float): Minimum box score.
+        text_threshold (float): Minimum text score.
+        overlay (bool): Also return the rendered overlay image.
+        use_cache (bool): Serve repeated requests from the detection cache.
+        image_data (bytes): Optional image bytes, otherwise the file is read.
+        host (str): Optional server URL, otherwise OBJECT_DETECTION_HOST.
+
+    Returns:
+        dict: {"detections": list (see parse_detections and overlay_detections),
+            "overlay": PIL image or None}
+
+    Raises:
+        requests.HTTPError: If the server returns an error.
+    """
+    if image_data is None:
+        with open(image_path, "rb") as image_file:
+            image_data = image_file.read()
+
+    cache = get_detection_cache() if use_cache else None
+    if cache is not None:
+        key = detection_cache_key(image_data, prompts, sam_type, box_threshold, text_threshold, overlay)
+        cached = cache.get(key)
+        if cached is not None:
+            return _load_result(json.loads(cached))
+
+    data = {
+        "sam_type": sam_type,
+        "box_threshold": box_threshold,
+        "text_threshold": text_threshold,
+        "text_prompt": " ".join(f"{prompt.strip().rstrip('.')}." for prompt in prompts),
+    }
+    response = get_session().post(
+        f"{host or object_detection_host}/predict",
+        files={"image": (os.path.basename(image_path), image_data)},
+        data=data,
+        headers={"Accept": "application/json"},
+        timeout=300
+    )
+    response.raise_for_status()
+
+    if response.headers.get("content-type", "").startswith("application/json"):
+        prediction = response.json()
+        result = {
+            "detections": parse_detections(prediction, prompts),
+            "overlay": prediction.get("overlay") if overlay else None,
+        }
+    else:
+        # The stock server: the detections are drawn into the image
+        rendered = Image.open(BytesIO(response.content))
+        result = {
+            "detections": overlay_detections(Image.open(BytesIO(image_data)), rendered, prompts),
+            "overlay": base64.b64encode(response.content).decode("ascii") if overlay else None,
+        }
+    if cache is not None:
+        cache.put(key, json.dumps(result))
+    return _load_result(result)
+
+
+def detect_many(image_paths, prompts, max_in_flight=4, on_complete=None, **kwargs):
+    """
+    Runs detect_objects on many images concurrently, e.g. over a whole manuscript.
+
+    Rate limits and transient server errors are retried with backoff.
+
+    Args:
+        image_paths (list): Paths of the images.
+        prompts (list): Object descriptions, see detect_objects.
+        max_in_flight (int): Maximum concurrent requests.
+        on_complete (callable): Called as on_complete(index, result, error) per image.
+        **kwargs: Passed on to detect_objects.
+
+    Returns:
+        list: One result per image, see detect_objects. Failed images hold the exception.
+    """
+    return run_concurrent(
+        lambda image_path: detect_objects(image_path, prompts, **kwargs),
+        image_paths,
+        on_complete=on_complete,
+        max_in_flight=max_in_flight
+    )
+
+
+def call_lsa(image_path, text_prompt, sam_type = DEFAULT_SAM_TYPE, box_threshold = 0.5, text_threshold = 0.5):
+    """
+    Returns the overlay image of the detections for a single text prompt.
+
+    Raises:
+        requests.HTTPError: If the server returns an error.
+    """
+    result = detect_objects(image_path, [text_prompt], sam_type=sam_type, box_threshold=box_threshold,
+                            text_threshold=text_threshold, overlay=True)
+    return result["overlay"]
+
+
+def _load_result(result):
+    # The overlay is stored as base64 PNG in the cache and in JSON responses
+    if isinstance(result.get("overlay"), str):
+        result["overlay"] = Image.open(BytesIO(base64.b64decode(result["overlay"]))).convert("RGB")
+    return result
@@ -0,0 +1,1082 @@
+import logging
+import os
+import sqlite3
+import time
+
+from aisisax.io.ingest import iter_pages
+from aisisax.io.preprocess import fit_to_tiles, prepare_image
+from aisisax.io.result_store import get_default_result_store
+from aisisax.io.results import ResultBuffer
+from aisisax.io.roi import ROI_MARGIN, prepare_roi_images, roi_prompt
+from aisisax.llm.backend import get_backend
+from aisisax.llm.cache import get_default_cache, multimodal_cache_key
+from aisisax.llm.cascade import SAMPLE_TEMPERATURE, CascadeReport, field_confidences, sample_agreement
+from aisisax.llm.concurrency import RateLimiter, imap_concurrent
+from aisisax.llm.field_cache import get_default_field_cache, settings_key
+from aisisax.llm.openai_batch import BATCH_DISCOUNT, build_request, get_client, run_batch
+from aisisax.llm.packing import iter_packs, packing_prompt, parse_packed_answer
+from aisisax.llm.schema import (fields_from_prompt, parse_json_object, remove_fields, response_format, retry_prompt,
+                                validate_answer)
+from aisisax.llm.tokens import estimate_image_tokens, estimate_text_tokens
+from aisisax.metrics import PageMetrics, span
+
+logger = logging.getLogger("tibet_processor")
+
+DEFAULT_PROMPT = """You are an expert for interpreting Tibetan manuscripts. 
+Attached you will find an image of a Tibetan manuscript. Use your expertise to analyze the image and provide responses. The analysis should specifically account for the presence of Tibetan, Chinese, and Arabic numerals, as well as structural and illustrative elements. Consider the following charsets for enhanced accuracy:
+Tibetan script (U+0F00–U+0FFF): Including Tibetan characters, numerals (e.g., ཀ, ཁ, ག, ༡, ༢, ༣), and annotations.
+Chinese characters (U+4E00–U+9FFF): Traditional and simplified forms.
+Arabic numerals (0–9): Standard decimal numbers.
+
+Answer the following questions and respond as a pure JSON object the following format:
+
+"Chinese character present" (Bool): Is there at least one Chinese character or number on the image
+"Chinese page number" (Bool): Does the image contain at least one chinese character or number, that is vertical oriented and is on the right side of the image outside of the tibet?
+"Arabic numeral present" (Bool): Does the image contain an Arabic numeral?
+"Arabic numeral int" (Integer): If there is an Arabic numeral, which one?
+"Illustration present" (Bool): Does the image contain an illustration? Round red stamps are not illustrations
+"Illustration position" (String): If the image contains not an illustration return 'none', else return the postion of the illustrated area as 'left', 'right' or 'center'
+"Illustration caption" (Bool): Does the image contain an illustration with a caption?
+"Tibetian page number" (Bool): Does the image contain a page number in tibetian, that are vertical oriented and left aligned. If so return 'true', 'false' otherwise
+"Frame present" (String): Analyze the image to detect vertical lines framing the text. The lines may be thin, uniform, and either red or black. Respond with one of the following: None if no lines are present, Red if red lines are detected, or Black if black lines are detected
+"""
+
+# Settings shared by the Streamlit app and the batch CLI
+DEFAULT_SETTINGS = {
+    "backend": os.getenv("AISISAX_BACKEND", "openai"),
+    "base_url": None,
+    "ai_prompt": DEFAULT_PROMPT,
+    "temperature": 0.5,
+    "api_key": None,
+    "model": "gpt-4o",
+    "use_cache": True,
+    "jpg_quality": 70,
+    "detail": "high",
+    "max_in_flight": 4,
+    "pack_size": 1,  # pages per request, 1 = no packing
+    "requests_per_minute": 0,  # 0 = unlimited
+    "tokens_per_minute": 0,  # 0 = unlimited
+    "structured_output": True,  # ask for the JSON schema of the prompt's fields
+    "max_retries": 2,  # follow-up requests for missing or invalid fields per page
+    "prefilter": True,  # skip calibration charts, answer frame lines and stamps found locally
+    "roi_crop": False,  # send a reduced page view and a high-resolution image of the margins
+    "roi_margin": ROI_MARGIN,  # share of the page width cut as margin
+    "image_store": None,  # root of the image store converted pages are deduplicated into
+    "reuse_fields": True,  # ask only for fields whose question changed since the page was analysed
+    "store_results": True,  # keep every page's result in the result store, see aisisax.io.result_store
+    "cascade_model": None,  # cheap model asked first, "model" only gets the fields it is unsure about
+    "cascade_threshold": 0.9,  # confidence below which a field is escalated
+    "cascade_samples": 3,  # answers compared for the confidence if the backend has no logprobs
+}
+
+# Fields the local pre-filter can answer
+FRAME_FIELD = "Frame present"
+STAMP_FIELD = "Red stamp present"
+
+
+def parse_page_path(file_path):
+    """
+    Extracts PPN and page number from a page path like .../<PPN>/00000001.jpg.
+
+    Returns:
+        tuple: (ppn, page_number). The page number is "unknown" if it is not an integer.
+    """
+    filename_parts = file_path.split("/")
+
+    logger.debug(f"Filename parts: {filename_parts}")
+    ppn = filename_parts[-2] if len(filename_parts) > 1 else "unknown"
+    page_number = filename_parts[-1] if len(filename_parts) > 0 else "unknown"
+    # strip extension from page number and convert to int (if possible)
+    try:
+        page_number = int(os.path.splitext(page_number)[0])
+    except ValueError:
+        page_number = "unknown"
+
+    return ppn, page_number
+
+
+def add_page_metadata(result, file_path):
+    """
+    Adds PPN, page number and image path to a parsed answer.
+    """
+    ppn, page_number = parse_page_path(file_path)
+
+    # Add additional metadata
+    if ppn.isdigit():
+        result["PPN"] = ppn
+    result["Page number"] = page_number
+
+    # Store the absolute path
+    result["Image"] = file_path
+
+    return result
+
+
+def local_answers(prefilter, fields):
+    """
+    Maps the results of the pre-filter (see aisisax.io.prefilter) to answers.
+
+    Only detections are used: a frame line or stamp the pre-filter did not find, e.g. on
+    a blank page, is left to the model.
+
+    Args:
+        prefilter (dict): The result of prefilter_page.
+        fields (list): The answer fields of the prompt.
+
+    Returns:
+        dict: The answers the model does not need to be asked for.
+    """
+    names = {field["name"] for field in fields}
+    answers = {}
+    if prefilter["frame"] is not None and FRAME_FIELD in names:
+        answers[FRAME_FIELD] = prefilter["frame"]
+    if prefilter["red_stamp"] and STAMP_FIELD in names:
+        answers[STAMP_FIELD] = True
+    return answers
+
+
+def answer_format(fields, settings, packed=False):
+    """
+    Returns the structured output format for the fields, or None if it is turned off.
+
+    Prompts without field lines (see aisisax.llm.schema) are sent without a schema.
+    """
+    if not settings.get("structured_output") or not fields:
+        return None
+    return response_format(fields, packed=packed)
+
+
+def prepare_page(file_path, settings):
+    """
+    Prepares a page for upload, with settings["roi_crop"] as page view and margin image.
+
+    Returns:
+        tuple: (image_data, upload_stats) with the JPG, or a list of both JPGs for margin
+            crops, and the size and token savings as in prepare_image.
+    """
+    if settings["roi_crop"] and settings["detail"] != "low":
+        images, upload_stats = prepare_roi_images(file_path, quality=settings["jpg_quality"], margin=settings["roi_margin"])
+        return (images if len(images) > 1 else images[0]), upload_stats
+    return prepare_image(file_path, quality=settings["jpg_quality"], detail=settings["detail"])
+
+
+def page_prompt(prompt, fields, image_data):
+    """
+    Returns the prompt for the prepared images of a page, see prepare_page.
+    """
+    return roi_prompt(prompt, fields) if isinstance(image_data, list) else prompt
+
+
+def parse_answer(raw_result, fields):
+    """
+    Parses the model's answer for a page and checks it against the prompt's fields.
+
+    The JSON object is accepted with or without a fenced code block around it.
+
+    Args:
+        raw_result (str): The model's answer.
+        fields (list): The answer fields, see aisisax.llm.schema.fields_from_prompt.
+
+    Returns:
+        tuple: (values, invalid) with the coerced values and the names of the missing
+            or invalid fields. Without fields, the parsed object is returned as it is.
+
+    Raises:
+        ValueError: If the prompt has no fields and the answer is not a JSON object.
+    """
+    if not fields:
+        try:
+            return parse_json_object(raw_result), []
+        except ValueError as e:
+            raise ValueError(f"{str(e)}\nRaw result: {raw_result}") from e
+
+    try:
+        answer = parse_json_object(raw_result)
+    except ValueError:
+        answer = None
+    return validate_answer(answer, fields)
+
+
+def retry_invalid_fields(values, invalid, file_path, image_data, fields, settings, metrics=None):
+    """
+    Asks again for the missing or invalid fields of a page, up to settings["max_retries"] times.
+
+    Only the failed fields are asked and, with structured output, constrained by their
+    schema, so a retry is much cheaper than analysing the page again. The retries are
+    recorded in metrics (a PageMetrics, see aisisax.metrics) if given.
+
+    Returns:
+        tuple: (values, invalid, retries) with the merged values, the fields that are
+            still invalid and the number of follow-up requests.
+    """
+    retries = 0
+    while invalid and retries < settings["max_retries"]:
+        retries += 1
+        retry = [field for field in fields if field["name"] in invalid]
+        logger.info(f"Retrying {len(retry)} fields of {os.path.basename(file_path)} "
+                    f"({retries}/{settings['max_retries']}): {', '.join(invalid)}")
+
+        # Bypass the cache, a second retry with the same prompt has to reach the model
+        with span(metrics, "request"):
+            raw_result = get_backend(settings["backend"]).generate_multimodal_answer(
+                page_prompt(retry_prompt(settings["ai_prompt"], retry), retry, image_data),
+                image_path=file_path,
+                image_data=image_data,
+                detail=settings["detail"],
+                temperature=settings["temperature"],
+                api_key=settings["api_key"],
+                model=settings["model"],
+                base_url=settings["base_url"],
+                use_cache=False,
+                response_format=answer_format(retry, settings),
+                on_usage=usage_recorder(metrics, settings)
+            )
+        with span(metrics, "parse"):
+            retry_values, invalid = parse_answer(raw_result, retry)
+        values.update(retry_values)
+
+    return values, invalid, retries
+
+
+def finish_answer(values, invalid, file_path, image_data, fields, upload_stats, settings, known=None, metrics=None):
+    """
+    Retries the invalid fields of a parsed answer and returns the result row.
+
+    Fields that are still invalid after the retries stay empty in the results. Answers
+    of the pre-filter (known) are added to the row.
+
+    Raises:
+        ValueError: If none of the fields could be answered.
+    """
+    values, invalid, retries = retry_invalid_fields(values, invalid, file_path, image_data, fields, settings, metrics)
+    if fields and len(invalid) == len(fields):
+        raise ValueError(f"No valid answer after {retries} retries")
+    if invalid:
+        logger.warning(f"Invalid fields in {os.path.basename(file_path)} after {retries} retries: {', '.join(invalid)}")
+
+    upload_stats["retries"] = retries
+    upload_stats["invalid_fields"] = invalid
+    values.update(known or {})
+    return add_page_metadata(values, file_path), upload_stats
+
+
+def usage_recorder(metrics, settings):
+    """
+    Returns the on_usage callback recording the API's token usage in metrics, or None.
+    """
+    if metrics is None:
+        return None
+    return lambda usage: metrics.add_usage(settings["model"], usage)
+
+
+def answers_model(settings):
+    """
+    Returns the model name answers are stored under, see aisisax.llm.field_cache.
+    """
+    if settings.get("cascade_model"):
+        return f"{settings['cascade_model']}>{settings['model']}"
+    return settings["model"]
+
+
+def answers_key(settings):
+    """
+    Returns the key of the settings answers are stored under in the field cache: the
+    model and the request and image settings that change an answer.
+    """
+    options = {"jpg_quality": settings["jpg_quality"]}
+    if settings["roi_crop"] and settings["detail"] != "low":
+        options["roi_margin"] = settings["roi_margin"]  # see prepare_page
+    if settings.get("cascade_model"):
+        options.update(cascade_threshold=settings["cascade_threshold"], cascade_samples=settings["cascade_samples"])
+    return settings_key(answers_model(settings), settings["temperature"], settings["detail"], settings["backend"], options)
+
+
+def cascade_answer(file_path, image_data, prompt, fields, settings, on_token=None, metrics=None):
+    """
+    Asks the cheap model settings["cascade_model"] first, and the strong model
+    settings["model"] only for the fields the cheap model is unsure about.
+
+    The confidence of a field comes from the token logprobs if the backend returns them,
+    otherwise from the agreement of settings["cascade_samples"] answers of the cheap
+    model. Missing and invalid fields and fields below settings["cascade_threshold"] are
+    escalated. A field the strong model cannot answer either keeps the cheap answer.
+
+    Args:
+        file_path (str): Path of the page image.
+        image_data (bytes): The prepared page, see prepare_page.
+        prompt (str): The prompt without the known fields.
+        fields (list): The fields to ask for.
+        settings (dict): Analysis settings, see DEFAULT_SETTINGS.
+        on_token (callable): Optional, called with every streamed chunk of the cheap answer.
+        metrics (PageMetrics): Records the stages, tokens and cost of both models.
+
+    Returns:
+        tuple: (values, invalid, cascade) with the merged values, the fields without a valid
+            answer and the cascade statistics of the page ("fields", "escalated",
+            "confidence", "method", "baseline_tokens", "seconds" of all requests and
+            "strong_seconds" of the escalation).
+    """
+    backend = get_backend(settings["backend"])
+    cheap_settings = dict(settings, model=settings["cascade_model"])
+
+    def ask(query, ask_fields, model_settings, temperature, use_cache, on_token=None, on_logprobs=None):
+        with span(metrics, "request"):
+            raw_result = backend.generate_multimodal_answer(
+                page_prompt(query, ask_fields, image_data),
+                image_path=file_path,
+                image_data=image_data,
+                detail=settings["detail"],
+                temperature=temperature,
+                api_key=settings["api_key"],
+                model=model_settings["model"],
+                base_url=settings["base_url"],
+                use_cache=use_cache,
+                response_format=answer_format(ask_fields, settings),
+                on_token=on_token,
+                on_usage=usage_recorder(metrics, model_settings),
+                on_logprobs=on_logprobs
+            )
+        with span(metrics, "parse"):
+            values, invalid = parse_answer(raw_result, ask_fields)
+        return raw_result, values, invalid
+
+    start_time = time.monotonic()
+    logprobs = []
+    raw_result, values, invalid = ask(prompt, fields, cheap_settings, settings["temperature"], settings["use_cache"],
+                                      on_token=on_token, on_logprobs=logprobs.extend)
+    if logprobs:
+        method = "logprobs"
+        confidences = field_confidences(raw_result, logprobs, fields)
+    else:
+        method = "samples"
+        samples = [values]
+        for _ in range(settings["cascade_samples"] - 1):
+            _, sample, _ = ask(prompt, fields, cheap_settings, max(settings["temperature"], SAMPLE_TEMPERATURE), False)
+            samples.append(sample)
+        values, confidences = sample_agreement(samples, fields)
+        invalid = [field["name"] for field in fields if field["name"] not in values]
+
+    uncertain = [field for field in fields
+                 if field["name"] in invalid or confidences.get(field["name"], 0.0) < settings["cascade_threshold"]]
+    strong_seconds = None
+    if uncertain:
+        logger.info(f"Escalating {len(uncertain)} fields of {os.path.basename(file_path)} to {settings['model']}: "
+                    f"{', '.join(field['name'] for field in uncertain)}")
+        names = {field["name"] for field in uncertain}
+        strong_start = time.monotonic()
+        _, strong_values, strong_invalid = ask(
+            remove_fields(prompt, [field["name"] for field in fields if field["name"] not in names]),
+            uncertain, settings, settings["temperature"], settings["use_cache"]
+        )
+        strong_seconds = time.monotonic() - strong_start
+        values.update(strong_values)
+        invalid = [name for name in strong_invalid if name in invalid]
+
+    cascade = {
+        "fields": [field["name"] for field in fields],
+        "escalated": [field["name"] for field in uncertain],
+        "confidence": {name: round(value, 4) for name, value in confidences.items()},
+        "method": method,
+        # A single request to the strong model, for the comparison with the cascade
+        "baseline_tokens": (estimate_text_tokens(page_prompt(prompt, fields, image_data)), estimate_text_tokens(raw_result)),
+        "seconds": time.monotonic() - start_time,
+        "strong_seconds": strong_seconds,
+    }
+    return values, invalid, cascade
+
+
+def analyze_page(file_path, settings, on_token=None, known=None, metrics=None):
+    """
+    Sends a single page to the LLM and returns the parsed result row.
+
+    Args:
+        file_path (str): Path of the page image.
+        settings (dict): Analysis settings, see DEFAULT_SETTINGS.
+        on_token (callable): Optional, called with every streamed chunk of the answer.
+        known (dict): Answers of the pre-filter or of earlier runs, these fields are left
+            out of the prompt.
+        metrics (PageMetrics): Optional, records the stages, tokens and cost of the page.
+
+    Returns:
+        tuple: (result, upload_stats) with the analysis result including PPN, page number
+            and image path, and the size and token savings of the preprocessed upload.
+            upload_stats also holds the "retries", the remaining "invalid_fields" and
+            the "seconds" the page took, and with settings["cascade_model"] the
+            "cascade" statistics, see cascade_answer.
+    """
+    start_time = time.monotonic()
+    filename = os.path.basename(file_path)
+    cascade = settings.get("cascade_model") is not None
+    if cascade and metrics is None:
+        metrics = PageMetrics(filename)  # the cascade statistics need the usage per model
+    logger.info(f"Processing {filename} Size: {os.path.getsize(file_path) / 1024:.2f} KB with {settings['backend']} model {settings['model']}, temperature {settings['temperature']}")
+
+    # Fit the page to the model's tiling grid and re-encode it in memory
+    with span(metrics, "encode"):
+        image_data, upload_stats = prepare_page(file_path, settings)
+    logger.info(f"Prepared {filename} for upload{' with margin crops' if isinstance(image_data, list) else ''}: "
+                f"{upload_stats['original_bytes'] / 1024:.2f} KB -> {upload_stats['bytes'] / 1024:.2f} KB, "
+                f"~{upload_stats['original_tokens']} -> {upload_stats['tokens']} image tokens")
+
+    known = known or {}
+    fields = [field for field in fields_from_prompt(settings["ai_prompt"]) if field["name"] not in known]
+    prompt = remove_fields(settings["ai_prompt"], known) if known else settings["ai_prompt"]
+    if cascade and fields:
+        values, invalid, cascade_stats = cascade_answer(file_path, image_data, prompt, fields, settings, on_token, metrics)
+    else:
+        with span(metrics, "request"):
+            raw_result = get_backend(settings["backend"]).generate_multimodal_answer(
+                page_prompt(prompt, fields, image_data),
+                image_path=file_path,
+                image_data=image_data,
+                detail=settings["detail"],
+                temperature=settings["temperature"],
+                api_key=settings["api_key"],
+                model=settings["model"],
+                base_url=settings["base_url"],
+                use_cache=settings["use_cache"],
+                response_format=answer_format(fields, settings),
+                on_token=on_token,
+                on_usage=usage_recorder(metrics, settings)
+            )
+
+        with span(metrics, "parse"):
+            values, invalid = parse_answer(raw_result, fields)
+    result, upload_stats = finish_answer(values, invalid, file_path, image_data, fields, upload_stats, settings, known, metrics)
+    upload_stats["seconds"] = time.monotonic() - start_time
+    if cascade and fields:
+        cascade_stats["baseline_tokens"] = (cascade_stats["baseline_tokens"][0] + upload_stats["tokens"],
+                                            cascade_stats["baseline_tokens"][1])
+        cascade_stats["usage"] = metrics.to_dict()["usage"]
+        upload_stats["cascade"] = cascade_stats
+    return result, upload_stats
+
+
+def analyze_pack(file_paths, settings, on_token=None, known=None, metrics=None):
+    """
+    Sends several pages in a single request and returns one result per page.
+
+    Args:
+        file_paths (list): Paths of the page images, in page order.
+        settings (dict): Analysis settings, see DEFAULT_SETTINGS.
+        on_token (callable): Optional, called with every streamed chunk of the answer.
+        known (list): Answers of the pre-filter per page. They replace the model's answers,
+            the prompt is shared by all pages of the pack and leaves out only the fields
+            known for all of them.
+        metrics (list): Optional PageMetrics per page. The request and its tokens are
+            split evenly between the pages.
+
+    Returns:
+        list: (result, upload_stats) per page as in analyze_page, or None for pages
+            without a usable entry in the answer. Those have to be analysed on their own.
+            The "seconds" of a page include the whole request and its own retries.
+    """
+    start_time = time.monotonic()
+    logger.info(f"Processing {', '.join(os.path.basename(file_path) for file_path in file_paths)} in one request "
+                f"with {settings['backend']} model {settings['model']}, temperature {settings['temperature']}")
+
+    metrics = metrics or [None] * len(file_paths)
+    pack_metrics = PageMetrics("pack") if metrics[0] is not None else None
+
+    images = []
+    upload_stats = []
+    for file_path, page_metrics in zip(file_paths, metrics):
+        with span(page_metrics, "encode"):
+            image_data, stats = prepare_image(file_path, quality=settings["jpg_quality"], detail=settings["detail"])
+        images.append(image_data)
+        upload_stats.append(stats)
+
+    # Fields answered for every page of the pack are left out of the shared prompt
+    known = known or [{}] * len(file_paths)
+    shared = set.intersection(*(set(page_known) for page_known in known))
+    fields = [field for field in fields_from_prompt(settings["ai_prompt"]) if field["name"] not in shared]
+    prompt = remove_fields(settings["ai_prompt"], shared) if shared else settings["ai_prompt"]
+    with span(pack_metrics, "request"):
+        raw_result = get_backend(settings["backend"]).generate_multipage_answer(
+            packing_prompt(prompt, len(file_paths)),
+            images=images,
+            detail=settings["detail"],
+            temperature=settings["temperature"],
+            api_key=settings["api_key"],
+            model=settings["model"],
+            base_url=settings["base_url"],
+            use_cache=settings["use_cache"],
+            response_format=answer_format(fields, settings, packed=True),
+            on_token=on_token,
+            on_usage=usage_recorder(pack_metrics, settings)
+        )
+
+    with span(pack_metrics, "parse"):
+        answers = parse_packed_answer(raw_result, len(file_paths))
+    if pack_metrics is not None:
+        for page_metrics in metrics:
+            page_metrics.merge(pack_metrics, share=1 / len(file_paths))
+
+    results = []
+    for file_path, answer, image_data, stats, page_known, page_metrics in zip(
+            file_paths, answers, images, upload_stats, known, metrics):
+        if answer is None:
+            results.append(None)
+            continue
+        with span(page_metrics, "parse"):
+            values, invalid = validate_answer(answer, fields) if fields else (answer, [])
+        invalid = [name for name in invalid if name not in page_known]
+        try:
+            result, stats = finish_answer(values, invalid, file_path, image_data, fields, stats, settings, page_known, page_metrics)
+        except ValueError as e:
+            logger.warning(f"Unusable entry for {os.path.basename(file_path)} in packed answer: {str(e)}")
+            results.append(None)
+            continue
+        stats["seconds"] = time.monotonic() - start_time
+        results.append((result, stats))
+    return results
+
+
+def store_result(result_store, result, image_hash, run, model):
+    """
+    Adds a page result to the result store. A failing store only costs the archive entry,
+    never the run.
+    """
+    try:
+        result_store.add(result, image_hash=image_hash, run=run, model=model)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Could not store the result of {os.path.basename(result['Image'])}: {str(e)}")
+
+
+class PageTracker:
+    """
+    The page handling run_analysis and run_batch_analysis share before a page is sent
+    and after its answer is in.
+
+    Pages are inspected in the ingest pool (see inspect_options). add then answers what it
+    can without the model: with settings["prefilter"], calibration charts are skipped and
+    frame lines and stamps that are found locally are not asked. With settings["reuse_fields"],
+    answers of earlier runs are reused for the fields whose question is unchanged (see
+    aisisax.llm.field_cache). finish collects the results in page order, keeps the model's
+    valid answers for the next run and, with settings["store_results"], adds every result
+    to the result store.
+
+    Attributes:
+        results (ResultBuffer): The results in page order.
+        page_indices (dict): Page path -> index in the order the pages were added.
+        known (dict): Page path -> the answers of a page that are not asked.
+
+    Args:
+        settings (dict): Analysis settings, see DEFAULT_SETTINGS.
+        run_name (str): Name of the run in the result store.
+        metrics (RunMetrics): Optional, records the insert stage of every page.
+    """
+
+    def __init__(self, settings, run_name, metrics=None):
+        self.settings = settings
+        self.metrics = metrics
+        self.fields = fields_from_prompt(settings["ai_prompt"])
+        self.field_cache = get_default_field_cache() if settings.get("reuse_fields") and self.fields else None
+        self.result_store = get_default_result_store() if settings.get("store_results") else None
+        self.run_name = run_name
+        self.results = ResultBuffer()
+        self.page_indices = {}
+        self.known = {}
+        self.page_hashes = {}
+        self.calibration_pages = 0
+        self.local_pages = 0
+        self.local_fields = 0
+        self.looked_up_pages = 0
+        self.reused_pages = 0
+        self.reused_fields = 0
+
+    def inspect_options(self):
+        """
+        Returns what the ingest workers have to find out about every page, see
+        aisisax.io.ingest.inspect_page.
+        """
+        return {
+            "prefilter": bool(self.settings["prefilter"]),
+            "sha256": self.field_cache is not None or self.result_store is not None,
+        }
+
+    def add(self, file_path, info):
+        """
+        Adds the next page and answers it without the model if possible.
+
+        Args:
+            file_path (str): Path of the page image.
+            info (dict): What the ingest workers found out about the page, see
+                aisisax.io.ingest.inspect_page.
+
+        Returns:
+            tuple: (result, status) for a page that needs no request, with status "skipped"
+                and result None for calibration charts, "local" for pages the pre-filter
+                answered and "reused" for pages answered from earlier runs. None if the
+                page has to be sent, the answers that are not asked are in known.
+
+        Raises:
+            OSError: If the page cannot be read.
+        """
+        self.page_indices[file_path] = len(self.page_indices)
+        if info["error"] is not None:
+            raise OSError(info["error"])
+        if info["sha256"] is not None:
+            self.page_hashes[file_path] = info["sha256"]
+
+        answers = {}
+        prefilter = info["prefilter"]
+        if prefilter is not None:
+            if prefilter["calibration"]:
+                logger.info(f"Skipping {os.path.basename(file_path)}: colour calibration chart")
+                self.calibration_pages += 1
+                return None, "skipped"
+            answers = local_answers(prefilter, self.fields)
+            self.local_fields += len(answers)
+            if self.fields and all(field["name"] in answers for field in self.fields):
+                logger.info(f"Answered {os.path.basename(file_path)} locally")
+                self.local_pages += 1
+                return add_page_metadata(answers, file_path), "local"
+
+        # Answers of earlier runs for unchanged questions, the pre-filter's answers take precedence
+        if self.field_cache is not None:
+            self.looked_up_pages += 1
+            stored = self.field_cache.get(info["sha256"], self.fields, answers_key(self.settings))
+            stored = {name: value for name, value in stored.items() if name not in answers}
+            self.reused_fields += len(stored)
+            answers = dict(stored, **answers)
+            if all(field["name"] in answers for field in self.fields):
+                self.reused_pages += 1
+                return add_page_metadata(answers, file_path), "reused"
+
+        if answers:
+            self.known[file_path] = answers
+        return None
+
+    def finish(self, file_path, result, invalid=None):
+        """
+        Adds the result of a page to the results and the result store.
+
+        Args:
+            file_path (str): Path of the page image.
+            result (dict): The result row, see add_page_metadata.
+            invalid (list): The names of the invalid fields of a model answer. The other
+                asked fields are kept for the next run. None for results that did not come
+                from the model.
+        """
+        metrics = self.metrics.page(file_path) if self.metrics is not None else None
+        with span(metrics, "insert"):
+            self.results.add(result, self.page_indices[file_path])
+            if invalid is not None and self.field_cache is not None:
+                page_known = self.known.get(file_path, {})
+                asked = [field for field in self.fields if field["name"] not in page_known and field["name"] not in invalid]
+                self.field_cache.put(self.page_hashes[file_path], result, asked, answers_key(self.settings))
+            if self.result_store is not None:
+                store_result(self.result_store, result, self.page_hashes.get(file_path), self.run_name,
+                             answers_model(self.settings))
+
+    def log(self):
+        """
+        Logs how many pages and fields were answered without the model.
+        """
+        if self.settings["prefilter"]:
+            logger.info(f"Pre-filter: saved {self.calibration_pages + self.local_pages} LLM calls "
+                        f"({self.calibration_pages} calibration charts skipped, {self.local_pages} pages answered locally), "
+                        f"{self.local_fields} fields answered without the model")
+        if self.field_cache is not None and self.looked_up_pages:
+            logger.info(f"Field reuse: {self.reused_fields} of {self.looked_up_pages * len(self.fields)} fields answered "
+                        f"from earlier runs, {self.reused_pages} pages without a request")
+
+
+class RunCancelled(Exception):
+    """
+    Raised for the requests that had not started when a run was cancelled.
+    """
+
+
+def run_analysis(pages, settings, on_page=None, initializer=None, on_token=None, metrics=None,
+                 rate_limiter=None, budget=None, cancel=None):
+    """
+    Converts and analyses pages concurrently, results are collected in page order.
+
+    Pages are converted in a process pool and analysed as soon as they are ready. With a
+    pack size above 1, several pages are sent per request as far as the model's limits
+    allow. Pages missing from a malformed packed answer are analysed on their own afterwards.
+    Local backends are warmed up first, and settings["max_in_flight"] is lowered to their
+    number of parallel slots. With settings["prefilter"], calibration charts are skipped
+    and frame lines and stamps that are found locally are not asked. With settings["roi_crop"], every page is sent on its own with its margin crops.
+    With settings["reuse_fields"], answers of earlier runs are reused for the fields whose
+    question is unchanged (see aisisax.llm.field_cache), only the other fields are asked.
+    With settings["store_results"], every result is also added to the result store.
+    With settings["cascade_model"], every page goes to the cheap model first and only
+    uncertain fields to settings["model"], see cascade_answer.
+
+    Args:
+        pages (list): Pages as planned by aisisax.io.ingest (plan_zip_pages etc.).
+        settings (dict): Analysis settings, see DEFAULT_SETTINGS.
+        on_page (callable): Called as on_page(done, file_path, result, error) in the
+            calling thread after every page, e.g. to update a progress bar or a journal.
+            result is None for skipped calibration charts.
+        initializer (callable): Called once in every worker thread.
+        on_token (callable): Called as on_token(file_paths, text) in the worker threads with
+            every streamed chunk of an answer, e.g. for a live preview. text is None when a
+            retried request starts the answer over. Answers are only streamed if it is given.
+        metrics (RunMetrics): Optional, records the stages, tokens and cost of every page,
+            see aisisax.metrics.
+        rate_limiter (RateLimiter): Optional requests and tokens per minute budget shared with
+            other runs, applies in addition to the budget of the settings.
+        budget (BudgetShare): Optional share of a requests in flight budget shared with other
+            runs, see aisisax.llm.concurrency.FairBudget.
+        cancel (threading.Event): Once set, no further pages are started. Requests in flight
+            are finished and their pages reported, then the partial results are returned.
+
+    Returns:
+        tuple: (ResultBuffer, upload_stats) where upload_stats holds one row of upload
+            savings per analysed page.
+    """
+    start_time = time.monotonic()
+
+    # Load a local model before the first page and send it as many requests as it has slots
+    backend = get_backend(settings["backend"])
+    try:
+        backend.warm_up(settings["model"], base_url=settings["base_url"])
+    except Exception as e:
+        logger.warning(f"Warm-up of {settings['backend']} model {settings['model']} failed: {str(e)}")
+    max_in_flight = settings["max_in_flight"]
+    slots = backend.parallel_slots()
+    if slots is not None and slots < max_in_flight:
+        logger.info(f"Sending up to {slots} concurrent requests to match the {settings['backend']} server's parallel slots")
+        max_in_flight = slots
+
+    # Margin crops are sent as two images per page, which packing cannot combine
+    pack_size = settings["pack_size"]
+    if settings["roi_crop"] and pack_size > 1:
+        logger.info("Margin crops are on, sending one page per request")
+        pack_size = 1
+    # The cascade escalates the fields of every page on their own
+    cascade_report = None
+    if settings.get("cascade_model"):
+        cascade_report = CascadeReport(settings["cascade_model"], settings["model"])
+        if pack_size > 1:
+            logger.info("The model cascade is on, sending one page per request")
+            pack_size = 1
+
+    rate_limiter = RateLimiter(
+        requests_per_minute=settings["requests_per_minute"],
+        tokens_per_minute=settings["tokens_per_minute"],
+        parent=rate_limiter
+    )
+
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+    prompt_tokens = estimate_text_tokens(settings["ai_prompt"])
+
+    def estimate_page_tokens(size):
+        return estimate_image_tokens(*fit_to_tiles(*size, detail=settings["detail"]), detail=settings["detail"])
+
+    cache = get_default_cache()
+    hits, misses = cache.hits, cache.misses
+
+    def page_metrics(file_path):
+        return metrics.page(file_path) if metrics is not None else None
+
+    def record_conversion(file_path, timings):
+        for stage, seconds in timings.items():
+            page_metrics(file_path).add(stage, seconds)
+
+    tracker = PageTracker(settings, time.strftime("%Y-%m-%d %H:%M:%S"), metrics)
+    page_indices = tracker.page_indices
+    known = tracker.known
+    page_tokens = {}
+
+    def track_pages(pages):
+        for path, info in pages:
+            if cancelled():
+                return
+            try:
+                answered = tracker.add(path, info)
+            except OSError as e:
+                finish_page(path, None, e)
+                continue
+            if answered is not None:
+                result, status = answered
+                finish_page(path, (result, None) if result is not None else None, None, status=status)
+                continue
+            page_tokens[path] = estimate_page_tokens(info["size"])
+            yield path
+
+    def estimate_tokens(pack):
+        return prompt_tokens + sum(page_tokens[path] for path in pack)
+
+    def analyze(pack):
+        if cancelled():
+            raise RunCancelled()
+        stream = (lambda text: on_token(pack, text)) if on_token is not None else None
+        if len(pack) == 1:
+            return [analyze_page(pack[0], settings, on_token=stream, known=known.get(pack[0]), metrics=page_metrics(pack[0]))]
+        return analyze_pack(pack, settings, on_token=stream, known=[known.get(path, {}) for path in pack],
+                            metrics=[page_metrics(path) for path in pack])
+
+    upload_stats = []
+    done = 0
+    requests = 0
+    request_tokens = 0
+    retried_pages = 0
+    retries = 0
+    invalid_pages = 0
+    failed_pages = 0
+    image_tokens = 0
+    baseline_image_tokens = 0
+
+    def finish_page(file_path, result, error, status="local"):
+        nonlocal done, retried_pages, retries, invalid_pages, failed_pages, image_tokens, baseline_image_tokens
+        done += 1
+        stats = None
+        if error is not None:
+            failed_pages += 1
+            logger.error(f"Error processing {os.path.basename(file_path)}: {str(error)}")
+        elif result is not None:
+            result, stats = result
+            tracker.finish(file_path, result, stats["invalid_fields"] if stats is not None else None)
+
+        if metrics is not None:
+            if error is not None:
+                metrics.count("failed")
+            elif result is None:
+                metrics.count("skipped")
+            else:
+                metrics.count("analysed" if stats is not None else status)
+
+        # Skipped pages and pages answered by the pre-filter have no upload
+        if stats is not None:
+            retried_pages += stats["retries"] > 0
+            retries += stats["retries"]
+            invalid_pages += bool(stats["invalid_fields"])
+            image_tokens += stats["tokens"]
+            baseline_image_tokens += stats["original_tokens"]
+            if "cascade" in stats:
+                cascade_report.add(stats)
+            upload_stats.append({
+                "Image": os.path.basename(file_path),
+                "Original KB": round(stats["original_bytes"] / 1024, 1),
+                "Uploaded KB": round(stats["bytes"] / 1024, 1),
+                "KB saved": round((stats["original_bytes"] - stats["bytes"]) / 1024, 1),
+                "Image tokens saved": stats["original_tokens"] - stats["tokens"],
+                "Seconds": round(stats["seconds"], 2),
+            })
+
+        if on_page is not None:
+            on_page(done, file_path, result, error)
+
+    def run(packs):
+        """Analyses the packs and returns the pages that have to be analysed on their own."""
+        nonlocal requests, request_tokens
+        packs_started = []
+
+        def track_packs(packs):
+            for pack in packs:
+                packs_started.append(pack)
+                yield pack
+
+        fallback = []
+        analyzed = imap_concurrent(
+            analyze,
+            track_packs(packs),
+            max_in_flight=max_in_flight,
+            rate_limiter=rate_limiter,
+            estimate_tokens=estimate_tokens,
+            initializer=initializer,
+            budget=budget
+        )
+        for index, pack_results, error in analyzed:
+            if isinstance(error, RunCancelled):
+                continue
+            pack = packs_started[index]
+            requests += 1
+            request_tokens += estimate_tokens(pack)
+            if error is not None and len(pack) > 1:
+                logger.warning(f"Packed request for {len(pack)} pages failed, analysing them one by one: {str(error)}")
+                fallback.extend(pack)
+                continue
+            if error is not None:
+                finish_page(pack[0], None, error)
+                continue
+            for file_path, result in zip(pack, pack_results):
+                if result is None:
+                    fallback.append(file_path)
+                else:
+                    finish_page(file_path, result, None)
+        return fallback
+
+    file_paths = track_pages(iter_pages(pages, max_pending=2 * max_in_flight, quality=settings["jpg_quality"],
+                                        on_timing=record_conversion if metrics is not None else None,
+                                        store_dir=settings.get("image_store"), inspect=tracker.inspect_options()))
+    packs = iter_packs(file_paths, settings["model"], pack_size, prompt_tokens, lambda path: page_tokens[path])
+    fallback = run(packs)
+    if fallback and not cancelled():
+        logger.warning(f"{len(fallback)} pages were missing from packed answers, analysing them one by one")
+        run([[file_path] for file_path in sorted(fallback, key=page_indices.get)])
+
+    if cancelled():
+        logger.warning(f"Run cancelled after {done} pages")
+
+    # Compare with what one request per page would have cost (estimated prompt and image tokens)
+    single_tokens = sum(prompt_tokens + tokens for tokens in page_tokens.values())
+    elapsed = time.monotonic() - start_time
+    logger.info(f"Analysed {len(page_indices)} pages with {requests} requests in {elapsed:.1f}s "
+                f"({len(page_indices) / elapsed * 60 if elapsed else 0:.1f} pages/min), "
+                f"~{request_tokens} input tokens (one page per request: ~{single_tokens})")
+    logger.info(f"Analysis cache: {cache.hits - hits} hits, {cache.misses - misses} misses")
+    tracker.log()
+    if settings["roi_crop"]:
+        logger.info(f"Margin crops: ~{image_tokens} image tokens (full pages at full detail: ~{baseline_image_tokens})")
+    if cascade_report is not None:
+        cascade_report.log(logger)
+    if metrics is not None:
+        metrics.finish()
+        summary = metrics.summary()
+        logger.info("Stages: " + ", ".join(f"{stage} {values['total_s']:.1f}s" for stage, values in summary["stages"].items()))
+        for model, usage in summary["models"].items():
+            cost = f"${usage['cost']:.4f}" if usage["cost"] is not None else "no known price"
+            logger.info(f"Usage of {model}: {usage['input_tokens']} input and {usage['output_tokens']} output tokens, {cost}")
+    if page_indices:
+        logger.info(f"Answer validation: {retried_pages / len(page_indices):.1%} of pages retried ({retries} retries), "
+                    f"{invalid_pages / len(page_indices):.1%} with invalid fields, {failed_pages / len(page_indices):.1%} failed")
+
+    return tracker.results, upload_stats
+
+
+def run_batch_analysis(pages, settings, work_dir, poll_interval=30.0, max_attempts=3, on_page=None, metrics=None):
+    """
+    Analyses pages through the OpenAI Batch API instead of interactive requests.
+
+    The pages are converted and written as batch input files. After the batches
+    are done, the answers are merged into the results by page ID. Pages already in
+    the analysis cache are not submitted, and new answers are added to the cache.
+    Answers are validated like interactive ones, but invalid fields are not retried.
+    The pre-filter and the reuse of unchanged fields run before the pages are submitted,
+    as in run_analysis.
+
+    Args:
+        pages (list): Pages as planned by aisisax.io.ingest (plan_zip_pages etc.).
+        settings (dict): Analysis settings, see DEFAULT_SETTINGS. Only the OpenAI backend
+            supports batches.
+        work_dir (str): Directory for the batch input files.
+        poll_interval (float): Seconds between status checks.
+        max_attempts (int): How often failed pages are submitted at most.
+        on_page (callable): Called as on_page(file_path, result) for every finished page,
+            result is None for skipped calibration charts.
+        metrics (RunMetrics): Optional, records the stages, tokens and cost of every page
+            (at the Batch API price). Batches run for hours, so there is no request span.
+
+    Returns:
+        ResultBuffer: The results in page order. Pages that failed are logged and missing.
+    """
+    if settings["backend"] != "openai":
+        raise ValueError("The Batch API mode is only available for the OpenAI backend")
+    if settings.get("cascade_model"):
+        logger.warning(f"The model cascade is not available in Batch API mode, all pages go to {settings['model']}")
+        settings = dict(settings, cascade_model=None)
+
+    def page_metrics(file_path):
+        return metrics.page(file_path) if metrics is not None else None
+
+    def record_conversion(file_path, timings):
+        for stage, seconds in timings.items():
+            page_metrics(file_path).add(stage, seconds)
+
+    tracker = PageTracker(settings, time.strftime("%Y-%m-%d %H:%M:%S") + " (batch)", metrics)
+    all_fields = tracker.fields
+    known = tracker.known
+    cache = get_default_cache() if settings["use_cache"] else None
+    cache_keys = {}
+    failed_pages = 0
+
+    def finish(file_path, result, status, invalid=None):
+        if result is not None:
+            tracker.finish(file_path, result, invalid)
+        if metrics is not None:
+            metrics.count(status)
+        if on_page is not None:
+            on_page(file_path, result)
+
+    def fail(file_path, error):
+        nonlocal failed_pages
+        failed_pages += 1
+        logger.error(f"Error processing {os.path.basename(file_path)}: {str(error)}")
+        if metrics is not None:
+            metrics.count("failed")
+
+    def add_result(file_path, answer):
+        page_known = known.get(file_path, {})
+        fields = [field for field in all_fields if field["name"] not in page_known]
+        try:
+            with span(page_metrics(file_path), "parse"):
+                values, invalid = parse_answer(answer, fields)
+        except ValueError as e:
+            fail(file_path, e)
+            return
+        if fields and len(invalid) == len(fields):
+            fail(file_path, f"no valid answer\nRaw result: {answer}")
+            return
+        if invalid:
+            logger.warning(f"Invalid fields in {os.path.basename(file_path)}: {', '.join(invalid)}")
+        values.update(page_known)
+        finish(file_path, add_page_metadata(values, file_path), "analysed", invalid)
+
+    def build_requests():
+        pages_done = iter_pages(pages, max_pending=2 * settings["max_in_flight"], quality=settings["jpg_quality"],
+                                on_timing=record_conversion if metrics is not None else None,
+                                store_dir=settings.get("image_store"), inspect=tracker.inspect_options())
+        for file_path, info in pages_done:
+            try:
+                answered = tracker.add(file_path, info)
+            except OSError as e:
+                # The page can't be read, so it can't be submitted either
+                fail(file_path, e)
+                continue
+            if answered is not None:
+                result, status = answered
+                finish(file_path, result, status)
+                continue
+
+            page_known = known.get(file_path, {})
+            fields = [field for field in all_fields if field["name"] not in page_known]
+            prompt = remove_fields(settings["ai_prompt"], page_known) if page_known else settings["ai_prompt"]
+            schema = answer_format(fields, settings)
+
+            try:
+                with span(page_metrics(file_path), "encode"):
+                    image_data, _ = prepare_page(file_path, settings)
+            except OSError as e:
+                fail(file_path, e)
+                continue
+            prompt = page_prompt(prompt, fields, image_data)
+            key = multimodal_cache_key(image_data, prompt, settings["model"], settings["temperature"], settings["detail"], schema)
+            answer = cache.get(key) if cache is not None else None
+            if answer is not None:
+                add_result(file_path, answer)
+                continue
+
+            # The page path is the custom ID the answer is matched back to
+            cache_keys[file_path] = key
+            yield build_request(file_path, prompt, image_data, settings["model"], settings["temperature"], settings["detail"],
+                                response_format=schema)
+
+    client = get_client(api_key=settings["api_key"], base_url=settings["base_url"])
+    usage = {}
+    answers, errors = run_batch(client, build_requests(), work_dir, poll_interval=poll_interval, max_attempts=max_attempts,
+                                usage=usage)
+
+    for file_path, answer in answers.items():
+        if cache is not None:
+            cache.put(cache_keys[file_path], answer)
+        if metrics is not None and file_path in usage:
+            page_metrics(file_path).add_usage(settings["model"], usage[file_path], discount=BATCH_DISCOUNT)
+        add_result(file_path, answer)
+
+    for file_path, error in errors.items():
+        logger.error(f"Error processing {os.path.basename(file_path)} in batch: {error}")
+        if metrics is not None:
+            metrics.count("failed")
+    if metrics is not None:
+        metrics.finish()
+
+    logger.info(f"Batch analysis: {len(answers)} answers, {len(errors) + failed_pages} failed pages")
+    tracker.log()
+    return tracker.results
@@ -0,0 +1,89 @@
+import math
+
+import streamlit as st
+
+from aisisax.ui.gallery import MAX_FILTER_OPTIONS, PAGE_SIZES, format_value, render_row
+
+# Columns of the archive that can be filtered besides the analysis fields
+ARCHIVE_FILTERS = ["PPN", "Model", "Run"]
+
+# More PPNs than this are filtered by typing them in
+MAX_PPN_OPTIONS = 1000
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def archive_options(_store, path):
+    """
+    Returns the filterable columns of the result store and their options, refreshed
+    every minute. The path only keys the cache.
+    """
+    options = {}
+    for column in ARCHIVE_FILTERS:
+        values = _store.options(column, MAX_PPN_OPTIONS if column == "PPN" else MAX_FILTER_OPTIONS)
+        if values:
+            options[column] = values
+    for column, dtype in _store.fields.items():
+        if dtype == "boolean":
+            options[column] = [True, False]
+        elif dtype == "string":
+            values = _store.options(column, MAX_FILTER_OPTIONS)
+            if values:
+                options[column] = values
+    return options
+
+
+def render_archive(store, key="archive"):
+    """
+    Shows the pages of all runs in the result store, with filters on the analysis fields.
+
+    Filtering, counting and paging run in SQLite, only the rows of the current view are
+    loaded, so the archive stays fast with hundreds of thousands of pages.
+
+    Args:
+        store (ResultStore): The result store, see aisisax.io.result_store.
+        key (str): Prefix of the widget keys.
+    """
+    stats = store.stats()
+    if not stats["pages"]:
+        st.info("No results stored yet. Results of every run are added here.")
+        return
+    st.caption(f"{stats['pages']} pages of {stats['ppns']} PPNs ({stats['size_mb']:.1f} MB)")
+
+    options = archive_options(store, store.path)
+    filters = {}
+    columns = st.columns(4)
+    for i, (column, values) in enumerate(options.items()):
+        with columns[i % len(columns)]:
+            filters[column] = st.multiselect(
+                column,
+                values,
+                format_func=lambda value: format_value(value) if isinstance(value, bool) else value,
+                key=f"{key}_filter_{column}"
+            )
+    if "PPN" not in options:
+        ppns = st.text_input("PPN", key=f"{key}_filter_ppn_text", help="One or more PPNs, separated by commas")
+        filters["PPN"] = [ppn.strip() for ppn in ppns.split(",") if ppn.strip()]
+
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        page_size = st.selectbox("Pages per view", PAGE_SIZES, index=0, key=f"{key}_page_size")
+
+    total = store.count(filters)
+    page_count = max(1, math.ceil(total / page_size))
+
+    # Keep the current view when filters change, as long as it still exists
+    view_key = f"{key}_view"
+    if st.session_state.get(view_key, 1) > page_count:
+        st.session_state[view_key] = page_count
+    with col2:
+        page = st.number_input(f"View (of {page_count})", 1, page_count, key=view_key)
+
+    start = (page - 1) * page_size
+    df, _ = store.query(filters, limit=page_size, offset=start)
+    df.index = range(start, start + len(df))  # unique widget keys, see render_row
+    st.caption(f"Showing {start + 1 if len(df) else 0}–{start + len(df)} of {total} matching pages")
+
+    columns = [col for col in df.columns if col not in ("Image", "Image hash")]
+    for _, row in df.iterrows():
+        render_row(row, columns, key)
+        st.divider()
@@ -0,0 +1,144 @@
+import math
+import os
+
+import pandas as pd
+import streamlit as st
+
+from aisisax.ui.thumbnails import get_thumbnail
+
+PAGE_SIZES = [10, 25, 50, 100]
+
+# Text columns with more distinct values than this get no filter
+MAX_FILTER_OPTIONS = 20
+
+
+def filter_options(df):
+    """
+    Returns the filterable analysis columns and their options.
+
+    Boolean columns can be filtered by yes/no, text columns (e.g. "Frame present") by
+    their distinct values.
+
+    Returns:
+        dict: column -> list of options.
+    """
+    options = {}
+    for column in df.columns:
+        if column in ("Image", "Page number"):
+            continue
+        if pd.api.types.is_bool_dtype(df[column]):
+            options[column] = [True, False]
+        elif pd.api.types.is_string_dtype(df[column]):
+            values = df[column].dropna().unique()
+            if 0 < len(values) <= MAX_FILTER_OPTIONS:
+                options[column] = sorted(str(value) for value in values)
+    return options
+
+
+def filter_results(df, filters):
+    """
+    Returns the rows matching all filters.
+
+    Args:
+        df (pd.DataFrame): The results.
+        filters (dict): column -> list of accepted values, empty lists match everything.
+    """
+    mask = pd.Series(True, index=df.index)
+    for column, values in filters.items():
+        if values:
+            mask &= df[column].isin(values).fillna(False).astype(bool)
+    return df[mask]
+
+
+def format_value(value):
+    if pd.isna(value):
+        return "–"
+    if pd.api.types.is_bool(value):
+        return "✅ Yes" if value else "❌ No"
+    return f"{value}"
+
+
+def render_filters(df, key):
+    """
+    Shows a multiselect per filterable column and returns the selected filters.
+    """
+    options = filter_options(df)
+    filters = {}
+    columns = st.columns(min(len(options), 4) or 1)
+    for i, (column, values) in enumerate(options.items()):
+        with columns[i % len(columns)]:
+            filters[column] = st.multiselect(
+                column,
+                values,
+                format_func=lambda value: format_value(value) if isinstance(value, bool) else value,
+                key=f"{key}_filter_{column}"
+            )
+    return filters
+
+
+def render_row(row, columns, key):
+    """
+    Shows one page with its thumbnail and values. The full-resolution scan is only
+    sent to the browser when requested.
+
+    The widgets are keyed by the row's index label, which has to be unique among the
+    rows shown, the same image may appear in several rows.
+    """
+    col1, col2, col3 = st.columns([2, 1, 1])
+
+    with col1:
+        image_path = row['Image']
+        if isinstance(image_path, str) and os.path.exists(image_path):
+            st.image(get_thumbnail(image_path))
+            show_full = st.checkbox("Show full resolution", key=f"{key}_full_{row.name}")
+        else:
+            st.error(f"Image not found: {image_path}")
+            show_full = False
+
+    with col2:
+        # Display column labels
+        for col in columns:
+            st.write(f"**{col}**")
+
+    with col3:
+        # Display values, excluding the 'Image' column
+        for col in columns:
+            st.write(format_value(row[col]))
+
+    if show_full:
+        st.image(image_path)
+
+
+def render_gallery(df, key="gallery"):
+    """
+    Shows the results page by page with filters on the analysis columns.
+
+    Only the rows of the current page are rendered, with cached thumbnails, so a rerun
+    costs the same for ten pages as for ten thousand.
+
+    Args:
+        df (pd.DataFrame): The results, one row per page with an 'Image' column.
+        key (str): Prefix of the widget keys.
+    """
+    filtered = filter_results(df, render_filters(df, key))
+
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        page_size = st.selectbox("Pages per view", PAGE_SIZES, index=0, key=f"{key}_page_size")
+    page_count = max(1, math.ceil(len(filtered) / page_size))
+
+    # Keep the current view when filters change, the last one if it no longer exists
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > page_count:
+        st.session_state[page_key] = page_count
+    with col2:
+        page = st.number_input(f"View (of {page_count})", 1, page_count, key=page_key)
+
+    start = (page - 1) * page_size
+    end = min(start + page_size, len(filtered))
+    st.caption(f"Showing {start + 1 if len(filtered) else 0}–{end} of {len(filtered)} matching pages ({len(df)} analysed)")
+
+    columns = [col for col in df.columns if col != 'Image']
+    for _, row in filtered.iloc[start:end].iterrows():
+        render_row(row, columns, key)
+        st.divider()  # Add a separator between rows
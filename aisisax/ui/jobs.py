@@ -0,0 +1,131 @@
+import os
+import time
+
+import pandas as pd
+import streamlit as st
+
+from aisisax.io.image_store import get_default_store
+from aisisax.jobs import ACTIVE_STATES, send_api_key, start_worker
+from aisisax.ui.thumbnails import get_thumbnail
+
+# Seconds between two refreshes of the job list
+JOB_REFRESH = 2
+
+# Jobs listed per user, the oldest ones are hidden
+MAX_JOBS = 10
+
+# Latest finished pages shown while a job is running
+RECENT_PAGES = 8
+
+STATUS_ICONS = {"queued": "⏳", "running": "▶️", "cancelling": "⏹️", "cancelled": "⏹️", "done": "✅", "failed": "❌"}
+
+
+def job_caption(queue, job):
+    """
+    Returns a one-line description of the state of a job.
+    """
+    pages = f"{job['done']} of {job['pages']} pages"
+    if job["failed"]:
+        pages += f", {job['failed']} failed"
+    if job["status"] == "queued":
+        ahead = queue.position(job["id"])
+        return f"Queued{f', {ahead} jobs ahead' if ahead else ''} · {pages}"
+    if job["status"] == "running":
+        return f"Running since {time.strftime('%H:%M', time.localtime(job['started_at']))} · {pages}"
+    if job["status"] == "cancelling":
+        return f"Cancelling, finishing the requests in flight · {pages}"
+    if job["status"] == "failed":
+        return f"Failed: {job['error']} · {pages}"
+    return f"{job['status'].capitalize()} · {pages}"
+
+
+def render_live(queue, job):
+    """
+    Shows the streamed answer in progress and the latest finished pages of a running job.
+    """
+    if job["preview"]:
+        st.code(job["preview"], language=None)
+    for row in queue.results(job["id"], latest=RECENT_PAGES):
+        col1, col2 = st.columns([1, 6])
+        with col1:
+            try:
+                st.image(get_thumbnail(row["Image"]))
+            except (OSError, KeyError, TypeError):
+                pass
+        with col2:
+            st.dataframe(pd.DataFrame([{key: value for key, value in row.items() if key != "Image"}]), hide_index=True)
+
+
+@st.fragment(run_every=JOB_REFRESH)
+def render_jobs(queue, owner, api_key=None, key="jobs"):
+    """
+    Shows the jobs of a user with their progress, refreshed every few seconds, with
+    buttons to cancel, resume, show and remove them.
+
+    The job shown below the list is st.session_state.job_id. While it runs, its answer in
+    progress and latest pages are shown here, and the whole app is rerun when its state
+    changes, so its results are updated.
+
+    Args:
+        queue (JobQueue): The job queue, see aisisax.jobs.
+        owner (str): The user.
+        api_key (str): The user's API key, handed to the worker for resumed jobs.
+        key (str): Prefix of the widget keys.
+    """
+    jobs = queue.jobs(owner=owner, limit=MAX_JOBS)
+    if not jobs:
+        return
+
+    if any(job["status"] in ACTIVE_STATES for job in jobs) and start_worker(queue):
+        st.caption("Starting the job worker...")
+
+    selected = st.session_state.get('job_id')
+    for job in jobs:
+        col1, col2, col3 = st.columns([3, 3, 2])
+        with col1:
+            st.write(f"{STATUS_ICONS.get(job['status'], '')} **{job['name']}**")
+            st.caption(job_caption(queue, job))
+        with col2:
+            st.progress(min(job["done"] / job["pages"], 1.0) if job["pages"] else 1.0)
+        with col3:
+            buttons = st.columns(3)
+            if job["status"] in ("queued", "running"):
+                if buttons[0].button("Cancel", key=f"{key}_cancel_{job['id']}"):
+                    queue.cancel(job["id"])
+                    st.rerun(scope="fragment")
+            elif job["status"] != "cancelling":
+                if job["done"] < job["pages"] or job["failed"]:
+                    if buttons[0].button("Resume", key=f"{key}_resume_{job['id']}"):
+                        start_worker(queue)
+                        try:
+                            api_key_id = send_api_key(queue, api_key) if api_key else None
+                        except OSError as e:
+                            st.error(f"{e}, the job was not resumed")
+                        else:
+                            queue.resume(job["id"], api_key_id=api_key_id)
+                            st.rerun(scope="fragment")
+                if buttons[2].button("Remove", key=f"{key}_remove_{job['id']}"):
+                    queue.remove(job["id"])
+                    if job["work_dir"]:
+                        get_default_store().release(os.path.basename(job["work_dir"]))
+                    if job["id"] == selected:
+                        st.session_state.job_id = None
+                    st.rerun()
+            if job["id"] != selected and buttons[1].button("Show", key=f"{key}_show_{job['id']}"):
+                st.session_state.job_id = job["id"]
+                st.rerun()
+
+    job = next((job for job in jobs if job["id"] == selected), None)
+    if job is not None:
+        if job["status"] in ("running", "cancelling"):
+            render_live(queue, job)
+        with st.expander(f"Log of {job['name']}"):
+            st.code("\n".join(message for _, _, message in queue.log_lines(job["id"])) or "No log yet", language=None)
+
+    # Show the new results of the selected job once it has ended or was resumed
+    seen_key = f"{key}_seen"
+    status = job["status"] if job is not None else None
+    previous = st.session_state.get(seen_key)
+    st.session_state[seen_key] = (selected, status)
+    if previous is not None and previous[0] == selected and previous[1] != status:
+        st.rerun()
@@ -0,0 +1,54 @@
+import json
+
+import pandas as pd
+import streamlit as st
+
+
+def format_cost(cost):
+    return f"${cost:.4f}" if cost is not None else "n/a"
+
+
+def render_metrics(metrics_json, prometheus, key="metrics"):
+    """
+    Shows where the time and money of a run went, with JSON and Prometheus downloads.
+
+    Args:
+        metrics_json (str): The metrics of the run, see aisisax.metrics.RunMetrics.to_json.
+        prometheus (str): The same in the Prometheus text format.
+        key (str): Prefix of the widget keys.
+    """
+    summary = json.loads(metrics_json)
+    pages = sum(summary["pages"].values())
+    pages_per_min = pages / summary["elapsed_s"] * 60 if summary["elapsed_s"] else 0
+
+    with st.expander(
+        f"⏱️ Run metrics: {pages} pages in {summary['elapsed_s']:.0f}s ({pages_per_min:.1f} pages/min), "
+        f"{summary['requests']} requests, {format_cost(summary['cost'])}"
+    ):
+        st.caption(", ".join(f"{count} {status}" for status, count in summary["pages"].items()))
+
+        if summary["stages"]:
+            st.write("**Time per stage** (seconds per page)")
+            stages = pd.DataFrame([
+                {"Stage": stage, "Pages": values["pages"], "Total": values["total_s"], "Mean": values["mean_s"],
+                 "p50": values["p50_s"], "p95": values["p95_s"], "p99": values["p99_s"], "Max": values["max_s"]}
+                for stage, values in summary["stages"].items()
+            ])
+            st.dataframe(stages, hide_index=True)
+
+        if summary["models"]:
+            st.write("**Tokens and cost** (as reported by the API)")
+            models = pd.DataFrame([
+                {"Model": model, "Input tokens": usage["input_tokens"], "Output tokens": usage["output_tokens"],
+                 "Cost": format_cost(usage["cost"])}
+                for model, usage in summary["models"].items()
+            ])
+            st.dataframe(models, hide_index=True)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Metrics (JSON)", metrics_json, file_name="metrics.json",
+                               mime="application/json", key=f"{key}_json")
+        with col2:
+            st.download_button("Metrics (Prometheus)", prometheus, file_name="metrics.prom",
+                               mime="text/plain", key=f"{key}_prometheus")
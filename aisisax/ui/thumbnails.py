@@ -0,0 +1,69 @@
+import functools
+import hashlib
+import os
+import tempfile
+
+from PIL import Image
+
+from aisisax.io.image_store import get_default_store
+
+THUMBNAIL_SIZE = (320, 480)
+THUMBNAIL_QUALITY = 80
+
+
+@functools.lru_cache(maxsize=65536)
+def _file_hash(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_hash(path):
+    """
+    Returns the SHA-256 of an image file.
+
+    Hashes are memoised per path, modification time and size, so a file is only read
+    again after it has changed.
+    """
+    stat = os.stat(path)
+    return _file_hash(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def get_thumbnail(image_path, size=THUMBNAIL_SIZE, store=None):
+    """
+    Returns the path of the cached thumbnail of an image, creating it on first use.
+
+    Thumbnails are stored once per image content in the image store and shared by all
+    runs and sessions. Its garbage collection removes them with their pages, or when they
+    have not been shown for a while (see ImageStore.collect_garbage).
+
+    Args:
+        image_path (str): Path of the page image.
+        size (tuple): Maximum width and height of the thumbnail.
+        store (ImageStore): The image store, the default store if None.
+
+    Returns:
+        str: Path of the thumbnail JPG.
+    """
+    thumbnail_dir = (store or get_default_store()).thumbnails_dir
+    path = os.path.join(thumbnail_dir, f"{image_hash(image_path)}_{size[0]}x{size[1]}.jpg")
+    if os.path.exists(path):
+        os.utime(path)  # shown, see ImageStore.collect_garbage
+        return path
+
+    os.makedirs(thumbnail_dir, exist_ok=True)
+    with Image.open(image_path) as img:
+        img.draft("RGB", size)  # let the JPEG decoder downscale while reading
+        img.thumbnail(size)
+        # Write to a temporary file first, so concurrent sessions never see half a thumbnail
+        fd, tmp_path = tempfile.mkstemp(suffix=".jpg", dir=thumbnail_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.convert("RGB").save(f, format="JPEG", quality=THUMBNAIL_QUALITY)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return path
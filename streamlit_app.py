@@ -1,16 +1,24 @@
-import zipfile
 import streamlit as st
 import pandas as pd
 from datetime import datetime
 import logging
-import io
 import os
-import base64
-import aisisax.llm.openai_connector as aisax_openai
-import json
-from mimetypes import guess_type
-from PIL import Image
-import subprocess
+import threading
+import time
+import uuid
+from aisisax.io.image_store import get_default_store
+from aisisax.io.ingest import plan_zip_pages, save_upload
+from aisisax.io.result_store import get_default_result_store
+from aisisax.io.results import build_exports
+from aisisax.jobs import ACTIVE_STATES, get_default_job_queue, send_api_key, start_worker
+from aisisax.llm.backend import BACKENDS, get_backend
+from aisisax.llm.cache import get_default_cache
+from aisisax.llm.field_cache import get_default_field_cache
+from aisisax.pipeline import DEFAULT_PROMPT, DEFAULT_SETTINGS
+from aisisax.ui.archive import render_archive
+from aisisax.ui.gallery import render_gallery
+from aisisax.ui.jobs import render_jobs
+from aisisax.ui.metrics_panel import render_metrics
 
 __version__ = "0.51"
 
@@ -23,202 +31,181 @@ st.set_page_config(
 # Configure server to handle larger files
 st._config.set_option('server.maxUploadSize', 200)  # Size in MB (1024 MB = 1 GB)
 
-# Configure logging to capture output for display
-class StreamlitHandler(logging.Handler):
-    def __init__(self, placeholder):
-        super().__init__()
-        self.placeholder = placeholder
-        self.logs = []
-
-    def emit(self, record):
-        log_entry = self.format(record)
-        self.logs.append(log_entry)
-        # Join all logs and update the placeholder
-        log_text = '\n'.join(self.logs)
-        self.placeholder.text_area("Processing Logs", log_text, height=200)
-
-def convert_tiff_to_jpg(tiff_path):
-    # Open and convert TIFF to JPG
-    with Image.open(tiff_path) as img:
-        jpg_path = os.path.splitext(tiff_path)[0] + '.jpg'
-        img.convert('RGB').save(jpg_path, 'JPEG', quality=70)
-    # Remove original TIFF file
-    os.remove(tiff_path)
-    return jpg_path
-
-def process_images(uploaded_files, progress_bar, log_placeholder):
-    # Set up logging
-    logger = logging.getLogger('tibet_processor')
-    logger.setLevel(logging.INFO)
-    handler = StreamlitHandler(log_placeholder)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+def submit_images(uploaded_files, owner):
+    """
+    Saves the uploads, plans their pages and submits them as a job to the background
+    worker, which keeps running through reruns and reloads of the page.
 
-    df = pd.DataFrame()
+    Returns:
+        int: The job ID, None if no page was found or the worker could not take the API key.
+    """
+    logger = logging.getLogger('tibet_processor')
 
-    # Clear temp directory at start
-    if not hasattr(st.session_state, 'temp_files'):
-        st.session_state.temp_files = []
-        
-    # Create a directory for storing images if it doesn't exist
-    images_dir = "static/images"
-    os.makedirs(images_dir, exist_ok=True)
+    # Every job writes into its own directory of the image store, which the worker keeps
+    # from expiring while the job runs. Make room for the new pages first
+    store = get_default_store()
+    job_session = f"{owner}-{int(time.time() * 1000)}"
+    store.collect_garbage(keep=[job_session])
+    images_dir = store.session_dir(job_session)
 
-    all_files = []
-    
-    # Handle ZIP files and regular image files
+    # Plan all pages up front: uploads are copied to disk, ZIPs are only listed, not extracted
+    pages = []
     for uploaded_file in uploaded_files:
         try:
             if uploaded_file.type == 'application/zip':
-                # Create a temporary file to save the ZIP content
-                zip_path = os.path.join(images_dir, uploaded_file.name)
-                with open(zip_path, 'wb') as f:
-                    f.write(uploaded_file.read())
-                
-                # Extract ZIP contents
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    # create a directory for the zip file in the images directory, name is the zip file name without extension
-                    zip_dir = os.path.join(images_dir, os.path.splitext(uploaded_file.name)[0])
-                    os.makedirs(zip_dir, exist_ok=True)
-
-                    # Extract all files to the images directory
-                    zip_ref.extractall(zip_dir)
-
-                    logger.info(f"Extracted {len(zip_ref.namelist())} files from ZIP file {uploaded_file.name}")
-
-                    # if zip contains tiff files, convert them to jpg
-                    for name in zip_ref.namelist():
-                        if name.lower().endswith(('.tif', '.tiff')):
-                            tiff_path = os.path.join(zip_dir, name)
-                            jpg_path = convert_tiff_to_jpg(tiff_path)
-                            all_files.append(jpg_path)
-                
-                    # remove the last files from all_files (to skip the color calibration page)
-                    all_files = all_files[:-1]
-
-                # Remove the temporary ZIP file
-                os.remove(zip_path)
+                zip_path = save_upload(uploaded_file, os.path.join(images_dir, uploaded_file.name))
+
+                # create a directory for the zip file in the images directory, name is the zip file name without extension
+                zip_dir = os.path.join(images_dir, os.path.splitext(uploaded_file.name)[0])
+                zip_pages = plan_zip_pages(zip_path, zip_dir)
+                pages.extend(zip_pages)
+
+                logger.info(f"Found {len(zip_pages)} pages in ZIP file {uploaded_file.name}")
             else:
-                # Handle regular image files
-                file_path = os.path.join(images_dir, uploaded_file.name)
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.read())
-                all_files.append(file_path)
-                
+                # Handle regular image files, they share the directory "images" (used as PPN)
+                os.makedirs(os.path.join(images_dir, "images"), exist_ok=True)
+                file_path = store.add(save_upload(uploaded_file, os.path.join(images_dir, "images", uploaded_file.name)))
+                pages.append((None, file_path, file_path))
+
         except Exception as e:
             logger.error(f"Error processing {uploaded_file.name}: {str(e)}")
-            if 'result' in locals():
-                logger.error(f"Raw result: {result}")
-
-    logger.info(f"Processing {len(all_files)} files")
-    
-    # Process all files
-    for i, file_path in enumerate(all_files):
-        filename = os.path.basename(file_path)
-        logger.info(f"Processing {filename} Size: {os.path.getsize(file_path) / 1024:.2f} KB with model {st.session_state.model}, temperature {st.session_state.temperature}")
-
+            st.error(f"Error processing {uploaded_file.name}: {str(e)}")
+
+    if not pages:
+        store.release(job_session)
+        return None
+
+    # The worker runs in another process, so the job gets a snapshot of the settings. The
+    # API key is not part of it, the worker keeps it in memory
+    settings = {
+        "backend": st.session_state.backend,
+        "base_url": st.session_state.base_url,
+        "ai_prompt": st.session_state.ai_prompt,
+        "temperature": st.session_state.temperature,
+        "model": st.session_state.model,
+        "use_cache": st.session_state.use_cache,
+        "reuse_fields": st.session_state.reuse_fields,
+        "store_results": st.session_state.store_results,
+        "jpg_quality": st.session_state.jpg_quality,
+        "detail": st.session_state.detail,
+        "max_in_flight": st.session_state.max_in_flight,
+        "pack_size": st.session_state.pack_size,
+        "requests_per_minute": st.session_state.requests_per_minute,
+        "tokens_per_minute": st.session_state.tokens_per_minute,
+        "structured_output": st.session_state.structured_output,
+        "max_retries": st.session_state.max_retries,
+        "prefilter": st.session_state.prefilter,
+        "roi_crop": st.session_state.roi_crop,
+        "roi_margin": st.session_state.roi_margin,
+        "cascade_model": st.session_state.cascade_model,
+        "cascade_threshold": st.session_state.cascade_threshold,
+        "cascade_samples": st.session_state.cascade_samples,
+        "image_store": store.root,
+    }
+
+    names = [uploaded_file.name for uploaded_file in uploaded_files]
+    name = f"{datetime.now().strftime('%H:%M')} {names[0]}{f' and {len(names) - 1} more' if len(names) > 1 else ''}"
+    queue = get_default_job_queue()
+    api_key_id = None
+    if st.session_state.openai_api_key:
+        start_worker(queue)
         try:
-            # Extract ppn and page number from filename
-            filename_parts = file_path.split("/")
-
-            logger.debug(f"Filename parts: {filename_parts}")
-            ppn = filename_parts[-2] if len(filename_parts) > 1 else "unknown"
-            page_number = filename_parts[-1] if len(filename_parts) > 0 else "unknown"
-            # strip extension from page number and convert to int (if possible)
-            try:
-                page_number = int(os.path.splitext(page_number)[0])
-            except ValueError:
-                page_number = "unknown"
-
-            result = aisax_openai.generate_multimodal_answer(
-                st.session_state.ai_prompt,
-                image_path=file_path, 
-                temperature=st.session_state.temperature,
-                api_key=st.session_state.openai_api_key,
-                model=st.session_state.model
-            )
-
-            # Process the result and convert to JSON
-            result = result.strip().split('\n')[1:-1]
-            result = '\n'.join(result)
-            result = json.loads(result)
-
-            # Add additional metadata
-            if ppn.isdigit():
-                result["PPN"] = ppn
-            result["Page number"] = page_number
-
-            # Store the absolute path
-            result["Image"] = file_path
-
-            # Append the result to DataFrame
-            df = pd.concat([df, pd.DataFrame([result])], ignore_index=True)
-
+            api_key_id = send_api_key(queue, st.session_state.openai_api_key)
+        except OSError as e:
+            logger.error(str(e))
+            st.error(f"{e}, the job was not submitted")
+            store.release(job_session)
+            return None
+    job_id = queue.submit(owner, pages, settings, name, work_dir=images_dir, api_key_id=api_key_id)
+    start_worker(queue)
+    logger.info(f"Submitted job {job_id} with {len(pages)} pages")
+    return job_id
+
+@st.cache_data(ttl=60, show_spinner=False)
+def list_models(backend, base_url):
+    return get_backend(backend).list_models(base_url=base_url)
+
+def start_warm_up(backend, model, base_url):
+    # Load a local model in the background while the user uploads files
+    warm_key = (backend, model, base_url)
+    if st.session_state.get('warm_key') == warm_key:
+        return
+    st.session_state.warm_key = warm_key
+
+    def warm_up():
+        try:
+            get_backend(backend).warm_up(model, base_url=base_url)
         except Exception as e:
-            logger.error(f"Error processing {filename}: {str(e)}")
-            if 'result' in locals():
-                logger.error(f"Raw result: {result}")
+            print(f"Warm-up of {backend} model {model} failed: {e}")
 
-        progress_bar.progress((i + 1) / len(all_files))
+    threading.Thread(target=warm_up, daemon=True).start()
 
-    return df
-
-def cleanup_temp_files():
-    if hasattr(st.session_state, 'temp_files'):
-        for temp_file in st.session_state.temp_files:
-            try:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                # Also remove the parent directory if empty
-                parent_dir = os.path.dirname(temp_file)
-                if not os.listdir(parent_dir):
-                    os.rmdir(parent_dir)
-            except Exception as e:
-                print(f"Error removing temporary file {temp_file}: {e}")
-        st.session_state.temp_files = []
+def user_id():
+    # Kept in the URL, so the jobs of a user are found again after a reload
+    if "user" not in st.query_params:
+        st.query_params["user"] = uuid.uuid4().hex[:16]
+    return st.query_params["user"]
 
 def main():
     # Initialize session state variables
     if 'jpg_quality' not in st.session_state:
         st.session_state.jpg_quality = 70
     if 'ai_prompt' not in st.session_state:
-        st.session_state.ai_prompt = """You are an expert for interpreting Tibetan manuscripts. 
-Attached you will find an image of a Tibetan manuscript. Use your expertise to analyze the image and provide responses. The analysis should specifically account for the presence of Tibetan, Chinese, and Arabic numerals, as well as structural and illustrative elements. Consider the following charsets for enhanced accuracy:
-Tibetan script (U+0F00–U+0FFF): Including Tibetan characters, numerals (e.g., ཀ, ཁ, ག, ༡, ༢, ༣), and annotations.
-Chinese characters (U+4E00–U+9FFF): Traditional and simplified forms.
-Arabic numerals (0–9): Standard decimal numbers.
-
-Answer the following questions and respond as a pure JSON object the following format:
-
-"Chinese character present" (Bool): Is there at least one Chinese character or number on the image
-"Chinese page number" (Bool): Does the image contain at least one chinese character or number, that is vertical oriented and is on the right side of the image outside of the tibet?
-"Arabic numeral present" (Bool): Does the image contain an Arabic numeral?
-"Arabic numeral int" (Integer): If there is an Arabic numeral, which one?
-"Illustration present" (Bool): Does the image contain an illustration? Round red stamps are not illustrations
-"Illustration position" (String): If the image contains not an illustration return 'none', else return the postion of the illustrated area as 'left', 'right' or 'center'
-"Illustration caption" (Bool): Does the image contain an illustration with a caption?
-"Tibetian page number" (Bool): Does the image contain a page number in tibetian, that are vertical oriented and left aligned. If so return 'true', 'false' otherwise
-"Frame present" (String): Analyze the image to detect vertical lines framing the text. The lines may be thin, uniform, and either red or black. Respond with one of the following: None if no lines are present, Red if red lines are detected, or Black if black lines are detected
-"""
+        st.session_state.ai_prompt = DEFAULT_PROMPT
     if 'temperature' not in st.session_state:
         st.session_state.temperature = 0.5
     if 'openai_api_key' not in st.session_state:
         st.session_state.openai_api_key = None
+    if 'backend' not in st.session_state:
+        st.session_state.backend = DEFAULT_SETTINGS["backend"]
+    if 'base_url' not in st.session_state:
+        st.session_state.base_url = None
     if 'model' not in st.session_state:
         st.session_state.model = "gpt-4o"  # Default model
+    if 'max_in_flight' not in st.session_state:
+        st.session_state.max_in_flight = 4
+    if 'pack_size' not in st.session_state:
+        st.session_state.pack_size = 1  # no packing
+    if 'requests_per_minute' not in st.session_state:
+        st.session_state.requests_per_minute = 0  # 0 = unlimited
+    if 'tokens_per_minute' not in st.session_state:
+        st.session_state.tokens_per_minute = 0  # 0 = unlimited
+    if 'use_cache' not in st.session_state:
+        st.session_state.use_cache = True
+    if 'reuse_fields' not in st.session_state:
+        st.session_state.reuse_fields = True
+    if 'store_results' not in st.session_state:
+        st.session_state.store_results = True
+    if 'detail' not in st.session_state:
+        st.session_state.detail = "high"
+    if 'structured_output' not in st.session_state:
+        st.session_state.structured_output = True
+    if 'max_retries' not in st.session_state:
+        st.session_state.max_retries = 2
+    if 'prefilter' not in st.session_state:
+        st.session_state.prefilter = True
+    if 'roi_crop' not in st.session_state:
+        st.session_state.roi_crop = False
+    if 'roi_margin' not in st.session_state:
+        st.session_state.roi_margin = DEFAULT_SETTINGS["roi_margin"]
+    if 'cascade_model' not in st.session_state:
+        st.session_state.cascade_model = None  # no cascade
+    if 'cascade_threshold' not in st.session_state:
+        st.session_state.cascade_threshold = DEFAULT_SETTINGS["cascade_threshold"]
+    if 'cascade_samples' not in st.session_state:
+        st.session_state.cascade_samples = DEFAULT_SETTINGS["cascade_samples"]
     
-    # Clean up any existing temporary files
-    cleanup_temp_files()
+    # Pages of abandoned jobs expire and are removed in the background
+    owner = user_id()
+    store = get_default_store()
+    store.start_collector()
     
     st.title("AI Manuscript Analysis")
     
     
     # Initialize session state variables
-    if 'processing_started' not in st.session_state:
-        st.session_state.processing_started = False
-    if 'processing_complete' not in st.session_state:
-        st.session_state.processing_complete = False
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = None  # the job whose results are shown
     
     # Add configuration button and expander
     with st.expander("⚙️ Settings"):
@@ -231,6 +218,12 @@ Answer the following questions and respond as a pure JSON object the following f
                 st.session_state.jpg_quality,
                 help="Higher value = better quality but larger file size"
             )
+            st.session_state.detail = st.selectbox(
+                "Image Detail",
+                options=["high", "low"],
+                index=["high", "low"].index(st.session_state.detail),
+                help="Pages are downscaled to the 512px tiles of the vision model before upload. 'low' sends a single 512px image"
+            )
         
         with col2:
             st.session_state.temperature = st.slider(
@@ -242,13 +235,202 @@ Answer the following questions and respond as a pure JSON object the following f
             )
         
         with col3:
-            st.session_state.model = st.selectbox(
-                "AI Model",
-                options=["gpt-4o", "chatgpt-4o-latest", "gpt-4o-mini"],
-                index=0,  # Default to gpt-4o
-                help="Select the AI model to use for analysis"
+            st.session_state.backend = st.selectbox(
+                "AI Backend",
+                options=list(BACKENDS),
+                index=list(BACKENDS).index(st.session_state.backend),
+                help="'openai' uses the OpenAI API, 'ollama' a local Ollama server with a vision model"
             )
+            base_url = st.text_input(
+                "Server URL (optional)",
+                st.session_state.base_url or "",
+                help="e.g. http://localhost:11434 for Ollama or a local OpenAI-compatible server. If left empty, the .env settings are used"
+            )
+            st.session_state.base_url = base_url.strip() or None
+
+            try:
+                models = list_models(st.session_state.backend, st.session_state.base_url)
+            except Exception as e:
+                st.warning(f"Could not list the models of the server: {e}")
+                models = []
+            if models:
+                st.session_state.model = st.selectbox(
+                    "AI Model",
+                    options=models,
+                    index=models.index(st.session_state.model) if st.session_state.model in models else 0,
+                    help="Select the AI model to use for analysis"
+                )
+            else:
+                st.session_state.model = st.text_input("AI Model", st.session_state.model)
+
+            if st.session_state.backend == "ollama":
+                start_warm_up(st.session_state.backend, st.session_state.model, st.session_state.base_url)
         
+        col1, col2, col3 = st.columns(3)
+
+        with col1:
+            st.session_state.max_in_flight = st.slider(
+                "Concurrent Requests",
+                1, 32,
+                st.session_state.max_in_flight,
+                help="Maximum number of pages analysed at the same time. Reduced automatically when the API rate-limits us. "
+                     "Ollama uses at most the server's parallel slots (OLLAMA_NUM_PARALLEL). All jobs on this server share "
+                     "the worker's budget (AISISAX_WORKER_MAX_IN_FLIGHT)"
+            )
+            st.session_state.pack_size = st.slider(
+                "Pages per Request",
+                1, 10,
+                st.session_state.pack_size,
+                help="Send several pages in one request to share the prompt tokens. Limited by the model's context and image limits, 1 = off"
+            )
+
+        with col2:
+            st.session_state.requests_per_minute = st.number_input(
+                "Requests per Minute",
+                min_value=0,
+                value=st.session_state.requests_per_minute,
+                help="Request budget of your jobs, 0 = unlimited. All jobs on this server share the worker's budget (AISISAX_WORKER_RPM)"
+            )
+
+        with col3:
+            st.session_state.tokens_per_minute = st.number_input(
+                "Tokens per Minute",
+                min_value=0,
+                value=st.session_state.tokens_per_minute,
+                step=1000,
+                help="Token budget of your jobs, 0 = unlimited. All jobs on this server share the worker's budget (AISISAX_WORKER_TPM)"
+            )
+
+        col1, col2 = st.columns([1, 2])
+
+        with col1:
+            st.session_state.use_cache = st.checkbox(
+                "Use Analysis Cache",
+                st.session_state.use_cache,
+                help="Reuse earlier answers for the same image, prompt, model and temperature instead of calling the API again"
+            )
+
+        with col2:
+            cache = get_default_cache()
+            cache_stats = cache.stats()
+            st.caption(
+                f"Cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                f"{cache_stats['entries']} entries ({cache_stats['size_mb']:.1f} MB)"
+            )
+            if st.button("Clear Cache", key="clear_cache_button"):
+                cache.clear()
+                st.rerun()
+
+        col1, col2 = st.columns([1, 2])
+
+        with col1:
+            st.session_state.reuse_fields = st.checkbox(
+                "Reuse Unchanged Fields",
+                st.session_state.reuse_fields,
+                help="After editing the prompt, ask only for the fields whose question changed or was added. "
+                     "The other answers are taken from earlier runs on the same page with the same model and settings"
+            )
+
+        with col2:
+            field_cache = get_default_field_cache()
+            field_stats = field_cache.stats()
+            st.caption(
+                f"Stored answers: {field_stats['answers']} fields of {field_stats['pages']} pages "
+                f"({field_stats['size_mb']:.1f} MB), {field_stats['hits']} reused, {field_stats['misses']} asked"
+            )
+            if st.button("Clear Stored Answers", key="clear_field_cache_button"):
+                field_cache.clear()
+                st.rerun()
+
+        col1, col2 = st.columns([1, 2])
+
+        with col1:
+            st.session_state.store_results = st.checkbox(
+                "Archive Results",
+                st.session_state.store_results,
+                help="Add the results of every run to the result archive, where they can be searched across runs"
+            )
+
+        with col2:
+            result_stats = get_default_result_store().stats()
+            st.caption(
+                f"Result archive: {result_stats['pages']} pages of {result_stats['ppns']} PPNs "
+                f"({result_stats['size_mb']:.1f} MB)"
+            )
+
+        col1, col2 = st.columns([1, 2])
+
+        with col1:
+            st.session_state.structured_output = st.checkbox(
+                "Structured Output",
+                st.session_state.structured_output,
+                help="Constrain answers to a JSON schema built from the \"Field\" (Type) lines of the prompt"
+            )
+            st.session_state.prefilter = st.checkbox(
+                "Local Pre-filter",
+                st.session_state.prefilter,
+                help="Skip colour calibration charts and answer frame lines and red stamps that are detected locally without the model"
+            )
+
+        with col2:
+            st.session_state.max_retries = st.number_input(
+                "Retries for Invalid Fields",
+                min_value=0,
+                max_value=5,
+                value=st.session_state.max_retries,
+                help="Asks again only for the fields that were missing or invalid in an answer"
+            )
+
+        col1, col2 = st.columns([1, 2])
+
+        with col1:
+            st.session_state.roi_crop = st.checkbox(
+                "Margin Crops",
+                st.session_state.roi_crop,
+                help="Send a reduced view of the page and a high-resolution image of its margins, "
+                     "so small page numbers are easier to read. Pages are sent one per request"
+            )
+
+        with col2:
+            st.session_state.roi_margin = st.slider(
+                "Margin Width",
+                0.02, 0.25,
+                st.session_state.roi_margin,
+                step=0.01,
+                help="Share of the page width cut on either side as margin"
+            )
+
+        col1, col2 = st.columns([1, 2])
+
+        with col1:
+            cascade_options = ["off"] + [name for name in models if name != st.session_state.model]
+            cascade_model = st.selectbox(
+                "Cascade Model",
+                options=cascade_options,
+                index=cascade_options.index(st.session_state.cascade_model) if st.session_state.cascade_model in cascade_options else 0,
+                help="Cheap model that answers every page first. Only the fields it is unsure about are asked "
+                     "again to the AI Model above. Pages are sent one per request"
+            )
+            st.session_state.cascade_model = None if cascade_model == "off" else cascade_model
+
+        with col2:
+            st.session_state.cascade_threshold = st.slider(
+                "Cascade Confidence",
+                0.5, 1.0,
+                st.session_state.cascade_threshold,
+                step=0.01,
+                help="Fields answered with a lower confidence are escalated. The confidence comes from the token "
+                     "probabilities (OpenAI) or from the agreement of several answers (Ollama)"
+            )
+            st.session_state.cascade_samples = st.number_input(
+                "Cascade Samples",
+                min_value=2,
+                max_value=10,
+                value=st.session_state.cascade_samples,
+                help="Answers of the cascade model compared per page when the backend has no token probabilities (Ollama). "
+                     "More answers give a better confidence but cost more requests"
+            )
+
         # API key input
         api_key = st.text_input(
             "OpenAI API Key (optional)", 
@@ -265,87 +447,94 @@ Answer the following questions and respond as a pure JSON object the following f
             help="Customize the prompt sent to the AI for image analysis"
         )
     
-    # File uploader (remove max_size parameter)
-    uploaded_files = st.file_uploader(
-        "Upload manuscript images", 
-        accept_multiple_files=True, 
-        type=['zip', 'jpg', 'jpeg', 'png']
-    )
-
-    if uploaded_files:
-        st.write(f"Number of files uploaded: {len(uploaded_files)}")
-
-        # Create placeholder for progress bar and logs
-        progress_bar = st.progress(0)
-        log_placeholder = st.empty()
-        
-       
-        if st.button("Process Images", key="process_button"):
-            st.session_state.processing_started = True  # Set flag to indicate processing has started
-            with st.spinner("Processing images..."):
-                # Process the uploaded files
-                df = process_images(uploaded_files, progress_bar, log_placeholder)
-            st.session_state.df = df  # Store DataFrame in session state
-            st.session_state.processing_complete = True  # Set flag to indicate processing is complete
-            st.success("Processing complete!")
-
-
-         # Optionally, show processing status
-        elif st.session_state.processing_started and not st.session_state.processing_complete:
-            st.info("Processing images... Please wait.")
-        
-        # Show results after processing
-        if st.session_state.get('processing_complete'):
+    analysis_tab, archive_tab = st.tabs(["Analysis", "Result Archive"])
+
+    with analysis_tab:
+        # File uploader (remove max_size parameter)
+        uploaded_files = st.file_uploader(
+            "Upload manuscript images", 
+            accept_multiple_files=True, 
+            type=['zip', 'jpg', 'jpeg', 'png']
+        )
+
+        if uploaded_files:
+            st.write(f"Number of files uploaded: {len(uploaded_files)}")
+
+            if st.button("Process Images", key="process_button"):
+                with st.spinner("Submitting images..."):
+                    job_id = submit_images(uploaded_files, owner)
+                if job_id is not None:
+                    st.session_state.job_id = job_id  # Show the new job's results
+                    st.session_state.exports = None
+                    st.success("Submitted, the pages are analysed in the background. You can close this page and come back later.")
+
+        # The jobs run in the background worker, this only shows their state
+        queue = get_default_job_queue()
+        render_jobs(queue, owner, api_key=st.session_state.openai_api_key)
+
+        # Show the results of the selected job, also those of a job still running
+        job = queue.get(st.session_state.job_id) if st.session_state.job_id is not None else None
+        if job is not None and job["owner"] == owner and job["results"]:
+            if job["work_dir"]:
+                store.session_dir(os.path.basename(job["work_dir"]))  # keep the pages shown from expiring
+
+            # Load and serialise the results only once per job state, not on every rerun
+            results_key = (job["id"], job["status"], job["results"])
+            if st.session_state.get('results_key') != results_key:
+                st.session_state.df = queue.results(job["id"]).to_dataframe()
+                st.session_state.exports = None
+                st.session_state.results_key = results_key
             df = st.session_state.df
-            
-            # Create download buttons
-            excel_buffer = io.BytesIO()
-            df.to_excel(excel_buffer, index=False)
-            excel_buffer.seek(0)
-            
-            st.download_button(
-                label="Download Excel Results",
-                data=excel_buffer,
-                file_name="tibet_analysis.xlsx",
-                mime="application/vnd.ms-excel"
-            )
-            
-            # Display each row with its image using Streamlit components
-            for _, row in df.iterrows():
-                col1, col2, col3 = st.columns([2, 1, 1])
-                
+
+            if job["status"] in ACTIVE_STATES:
+                col1, col2 = st.columns([3, 1])
                 with col1:
-                    # Display the image using st.image
-                    image_path = row['Image']
-                    if os.path.exists(image_path):
-                        st.image(image_path, width=750)
-                    else:
-                        st.error(f"Image not found: {image_path}")
-                
+                    st.info(f"{len(df)} of {job['pages']} pages done so far, the latest pages are shown above")
                 with col2:
-                    # Display column labels
-                    for col in df.columns:
-                        if col != 'Image':                       
-                            st.write(f"**{col}**")
-                
-                with col3:
-                    # Display values, excluding the 'Image' column
-                    for col in df.columns:
-                        if col != 'Image':
-                            if isinstance(row[col], bool):
-                                st.write("✅ Yes" if row[col] else "❌ No")
-                            else:
-                                st.write(f"{row[col]}")
-                
-                st.divider()  # Add a separator between rows
+                    if st.button("Refresh Results", key="refresh_results_button"):
+                        st.session_state.results_key = None
+                        st.rerun()
+
+            if st.session_state.get('exports') is None:
+                st.session_state.exports = build_exports(df)
+
+            # Create download buttons
+            download_columns = st.columns(len(st.session_state.exports))
+            for download_column, (export_format, (data, file_name, mime)) in zip(download_columns, st.session_state.exports.items()):
+                with download_column:
+                    st.download_button(
+                        label=f"Download {export_format} Results",
+                        data=data,
+                        file_name=file_name,
+                        mime=mime,
+                        key=f"download_{export_format.lower()}"
+                    )
+
+            report = job["report"]
+            if report is not None and report["upload_stats"]:
+                upload_stats = pd.DataFrame(report["upload_stats"])
+                with st.expander(
+                    f"📦 Upload savings: {upload_stats['KB saved'].sum() / 1024:.1f} MB, "
+                    f"~{upload_stats['Image tokens saved'].sum()} image tokens"
+                ):
+                    st.dataframe(upload_stats, hide_index=True)
+
+            if report is not None:
+                render_metrics(report["metrics"], report["prometheus"])
+
+            # Only the current view of the results is rendered, with cached thumbnails
+            render_gallery(df)
+
             # Reset button
             if st.button("Process New Files", key="reset_button"):
-                st.session_state.processing_started = False
-                st.session_state.processing_complete = False
+                st.session_state.job_id = None
                 st.session_state.df = None
-                cleanup_temp_files()
+                st.session_state.exports = None
                 st.rerun()
 
+    with archive_tab:
+        render_archive(get_default_result_store())
+
     st.markdown("""---""")
     st.markdown(f"<p style='text-align: right; color: grey; font-size: 11px;'>Version v{__version__}</p>", unsafe_allow_html=True)
             
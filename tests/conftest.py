@@ -0,0 +1,26 @@
+import pytest
+
+import aisisax.io.image_store
+import aisisax.io.result_store
+import aisisax.jobs
+import aisisax.llm.cache
+import aisisax.llm.field_cache
+from aisisax.io.image_store import ImageStore
+from aisisax.io.result_store import ResultStore
+from aisisax.jobs import JobQueue
+from aisisax.llm.cache import AnalysisCache
+from aisisax.llm.field_cache import FieldCache
+
+
+@pytest.fixture(autouse=True)
+def stores(tmp_path, monkeypatch):
+    # Keeps the tests out of the app's stores in .cache
+    root = tmp_path / "cache"
+    root.mkdir()
+    monkeypatch.setattr(aisisax.llm.cache, "_default_cache", AnalysisCache(str(root / "analysis_cache.sqlite")))
+    monkeypatch.setattr(aisisax.llm.field_cache, "_default_field_cache", FieldCache(str(root / "field_answers.sqlite")))
+    monkeypatch.setattr(aisisax.io.result_store, "_default_result_store", ResultStore(str(root / "results.sqlite")))
+    monkeypatch.setattr(aisisax.io.image_store, "image_store_dir", str(root / "images"))
+    monkeypatch.setattr(aisisax.io.image_store, "_default_store", ImageStore(str(root / "images")))
+    monkeypatch.setattr(aisisax.jobs, "_default_job_queue", JobQueue(str(root / "jobs.sqlite")))
+    return root
@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from aisisax.llm.backend import invoke_chat
+from aisisax.llm.concurrency import Backoff, _local
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class FlakyChat:
+    # Streams an answer, the first request breaks off after two chunks
+    def __init__(self, answer):
+        self.answer = answer
+        self.requests = 0
+
+    def stream(self, messages):
+        self.requests += 1
+        for index, text in enumerate(self.answer):
+            if self.requests == 1 and index == 2:
+                raise ServerError("HTTP 503")
+            yield SimpleNamespace(content=text, usage_metadata=None, response_metadata={})
+
+
+def test_retried_stream_starts_the_preview_over():
+    chat = FlakyChat(["{", '"a"', ": ", "1}"])
+    tokens = []
+    _local.backoff = Backoff(base_delay=0.01)
+    try:
+        answer = invoke_chat(chat, [], on_token=tokens.append)
+    finally:
+        _local.backoff = None
+
+    assert answer == '{"a": 1}'
+    assert chat.requests == 2
+    assert tokens == ["{", '"a"', None, "{", '"a"', ": ", "1}"]
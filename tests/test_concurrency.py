@@ -0,0 +1,217 @@
+import threading
+import time
+
+import httpx
+import pytest
+
+from aisisax.llm.concurrency import (AdaptiveConcurrency, Backoff, FairBudget, RateLimiter, _local, call_with_backoff,
+                                     request_with_backoff, run_concurrent)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_rate_limiter_waits_for_the_window():
+    limiter = RateLimiter(requests_per_minute=2, period=0.3)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.25
+
+
+def test_rate_limiter_caps_requests_larger_than_the_token_budget():
+    limiter = RateLimiter(tokens_per_minute=10, period=60)
+    limiter.acquire(1000)
+    assert limiter._tokens_in_window == 10
+
+
+def test_rate_limiter_pause():
+    limiter = RateLimiter()
+    limiter.pause(0.2)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_rate_limiter_parent():
+    parent = RateLimiter(tokens_per_minute=100, period=60)
+    limiter = RateLimiter(parent=parent)
+    limiter.acquire(60)
+    assert parent._tokens_in_window == 60
+
+    limiter.pause(0.2)
+    start = time.monotonic()
+    parent.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_adaptive_concurrency_halves_and_grows_back():
+    concurrency = AdaptiveConcurrency(8)
+    concurrency.on_throttle()
+    assert concurrency.limit == 4
+    concurrency.on_throttle()
+    concurrency.on_throttle()
+    concurrency.on_throttle()
+    assert concurrency.limit == 1
+
+    concurrency.on_success()
+    assert concurrency.limit == 2
+    concurrency.on_success()
+    assert concurrency.limit == 2
+    concurrency.on_success()
+    assert concurrency.limit == 3
+
+
+def test_adaptive_concurrency_limits_requests_in_flight():
+    concurrency = AdaptiveConcurrency(2)
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with concurrency:
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.02)
+            with lock:
+                in_flight.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+
+
+def test_fair_budget_gives_free_slots_to_the_owner_with_fewest_requests():
+    budget = FairBudget(2)
+    budget.acquire("big", holder="job1")
+    budget.acquire("big", holder="job1")
+    order = []
+
+    def waiter(owner):
+        budget.acquire(owner, holder=owner)
+        order.append(owner)
+
+    big = threading.Thread(target=waiter, args=("big",))
+    big.start()
+    time.sleep(0.05)
+    small = threading.Thread(target=waiter, args=("small",))
+    small.start()
+    time.sleep(0.05)
+    assert budget.stats()["waiting"] == {"big": 1, "small": 1}
+
+    budget.release("big", holder="job1")
+    small.join(1)
+    assert order == ["small"]
+    assert big.is_alive()
+
+    budget.release("big", holder="job1")
+    big.join(1)
+    assert order == ["small", "big"]
+
+
+def test_fair_budget_release_all():
+    budget = FairBudget(3)
+    budget.acquire("alice", holder="job1")
+    budget.acquire("alice", holder="job1")
+    budget.acquire("bob", holder="job2")
+    assert budget.release_all("job1") == 2
+    assert budget.stats()["in_flight"] == {"bob": 1}
+    assert budget.release_all("job1") == 0
+
+
+def test_call_with_backoff_retries_throttled_calls():
+    calls = []
+
+    def func(item):
+        calls.append(item)
+        if len(calls) < 3:
+            raise StatusError(429 if len(calls) == 1 else 503)
+        return item * 2
+
+    concurrency = AdaptiveConcurrency(4)
+    assert call_with_backoff(func, 21, concurrency, RateLimiter(), base_delay=0.01) == 42
+    assert len(calls) == 3
+    assert concurrency.limit == 2
+
+
+def test_call_with_backoff_raises_other_errors():
+    calls = []
+
+    def func(item):
+        calls.append(item)
+        raise StatusError(400)
+
+    with pytest.raises(StatusError):
+        call_with_backoff(func, 1, AdaptiveConcurrency(1), base_delay=0.01)
+    assert len(calls) == 1
+
+
+def test_run_concurrent_keeps_the_input_order():
+    def func(item):
+        time.sleep(0.01 * (5 - item))
+        if item == 3:
+            raise ValueError("bad page")
+        return item
+
+    results = run_concurrent(func, iter(range(5)), max_in_flight=3)
+    assert results[:3] == [0, 1, 2] and results[4] == 4
+    assert isinstance(results[3], ValueError)
+
+
+def test_request_with_backoff_retries_a_single_request():
+    calls = []
+
+    def request():
+        calls.append(1)
+        if len(calls) == 1:
+            raise StatusError(429)
+        if len(calls) == 2:
+            raise httpx.ConnectError("connection lost")
+        return "answer"
+
+    concurrency = AdaptiveConcurrency(4)
+    _local.backoff = Backoff(concurrency, RateLimiter(), base_delay=0.01)
+    try:
+        assert request_with_backoff(request) == "answer"
+    finally:
+        _local.backoff = None
+    assert len(calls) == 3
+    assert concurrency.limit == 2
+
+
+def test_request_with_backoff_raises_other_errors():
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise StatusError(400)
+
+    with pytest.raises(StatusError):
+        request_with_backoff(request)
+    assert len(calls) == 1
+
+
+def test_every_request_of_an_item_is_rate_limited():
+    responses = iter([None, StatusError(429), None, None])
+
+    def request():
+        response = next(responses)
+        if response is not None:
+            raise response
+        return "answer"
+
+    def func(item):
+        # The page, a retried follow-up request and a last follow-up request
+        return [request_with_backoff(request) for _ in range(3)]
+
+    limiter = RateLimiter(tokens_per_minute=1000)
+    call_with_backoff(func, 1, AdaptiveConcurrency(2), limiter, tokens=10, base_delay=0.01)
+    assert len(limiter._events) == 4
+    assert limiter._tokens_in_window == 40
@@ -0,0 +1,88 @@
+import sqlite3
+import time
+
+from aisisax.llm.field_cache import FieldCache, settings_key
+from aisisax.llm.schema import fields_from_prompt
+
+PROMPT = """"Frame present" (String): Which colour has the frame?
+"Arabic numeral int" (Integer): The Arabic page number, if present.
+"""
+
+GPT_4O = settings_key("gpt-4o", 0.0, "high", options={"jpg_quality": 70})
+
+
+def test_field_cache_keeps_answers_of_unchanged_questions(tmp_path):
+    cache = FieldCache(str(tmp_path / "fields.sqlite"))
+    fields = fields_from_prompt(PROMPT)
+    cache.put("page1", {"Frame present": "Red", "Arabic numeral int": None, "Other": 1}, fields, GPT_4O)
+
+    assert cache.get("page1", fields, GPT_4O) == {"Frame present": "Red", "Arabic numeral int": None}
+    assert cache.get("page1", fields, settings_key("gpt-4o-mini", 0.0, "high", options={"jpg_quality": 70})) == {}
+    assert cache.get("page2", fields, GPT_4O) == {}
+
+    edited = fields_from_prompt(PROMPT.replace("if present", "if printed"))
+    assert cache.get("page1", edited, GPT_4O) == {"Frame present": "Red"}
+
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 5
+    assert (cache.stats()["answers"], cache.stats()["pages"]) == (2, 1)
+
+
+def test_answers_are_kept_per_request_settings():
+    keys = {
+        settings_key("gpt-4o", 0.0, "high", options={"jpg_quality": 70}),
+        settings_key("gpt-4o", 0.7, "high", options={"jpg_quality": 70}),
+        settings_key("gpt-4o", 0.0, "low", options={"jpg_quality": 70}),
+        settings_key("gpt-4o", 0.0, "high", options={"jpg_quality": 90}),
+        settings_key("gpt-4o", 0.0, "high", options={"jpg_quality": 70, "roi_margin": 0.12}),
+        settings_key("gpt-4o", 0.0, "high", backend="ollama", options={"jpg_quality": 70}),
+    }
+    assert len(keys) == 6
+
+
+def test_field_cache_is_shared_through_the_file(tmp_path):
+    path = str(tmp_path / "fields.sqlite")
+    fields = fields_from_prompt(PROMPT)
+    FieldCache(path).put("page1", {"Frame present": "Black"}, fields, GPT_4O)
+
+    cache = FieldCache(path)
+    assert cache.get("page1", fields, GPT_4O) == {"Frame present": "Black"}
+    cache.clear()
+    assert cache.get("page1", fields, GPT_4O) == {}
+    assert cache.stats()["answers"] == 0
+
+
+def test_field_cache_evicts_least_recently_used_answers(tmp_path):
+    cache = FieldCache(str(tmp_path / "fields.sqlite"), max_mb=0.0005)
+    fields = fields_from_prompt(PROMPT)
+    for index in range(6):
+        cache.put(f"page{index}", {"Frame present": "Red"}, fields, GPT_4O)
+        time.sleep(0.01)
+    cache.get("page0", fields, GPT_4O)  # used again, evicted last
+
+    cache.evict()
+    assert cache.stats()["size_mb"] <= 0.0005
+    assert cache.get("page0", fields, GPT_4O) == {"Frame present": "Red"}
+    assert cache.get("page1", fields, GPT_4O) == {}
+
+
+def test_field_cache_drops_expired_answers(tmp_path):
+    cache = FieldCache(str(tmp_path / "fields.sqlite"), max_age_days=1)
+    fields = fields_from_prompt(PROMPT)
+    cache.put("page1", {"Frame present": "Red"}, fields, GPT_4O)
+    with sqlite3.connect(cache.path) as conn:
+        conn.execute("UPDATE field_answers SET created_at = ?", (time.time() - 2 * 24 * 3600,))
+
+    assert cache.get("page1", fields, GPT_4O) == {}
+    cache.evict()
+    assert cache.stats()["answers"] == 0
+
+
+def test_answers_of_earlier_versions_are_dropped(tmp_path):
+    path = str(tmp_path / "fields.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE field_answers (page TEXT, field TEXT, question TEXT, model TEXT, value TEXT, "
+                     "created_at REAL, PRIMARY KEY (page, model, field, question))")
+        conn.execute("INSERT INTO field_answers VALUES ('page1', 'Frame present', 'q', 'gpt-4o', '\"Red\"', 0)")
+
+    assert FieldCache(path).stats()["answers"] == 0
@@ -0,0 +1,70 @@
+import os
+import shutil
+import time
+
+from PIL import Image
+
+from aisisax.io.image_store import ImageStore
+from aisisax.ui.thumbnails import get_thumbnail
+
+
+def write_page(store, session_id, name, content):
+    path = os.path.join(store.session_dir(session_id), name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return store.add(path)
+
+
+def make_idle(store, session_id, age):
+    then = time.time() - age
+    os.utime(os.path.join(store.sessions_dir, session_id), (then, then))
+
+
+def test_collect_garbage_evicts_least_recently_used_until_within_quota(tmp_path):
+    store = ImageStore(str(tmp_path / "store"), max_mb=0.25, ttl_hours=24)
+    shared = os.urandom(50 * 1024)
+    for index, session_id in enumerate(["old", "middle", "new"]):
+        write_page(store, session_id, "shared.jpg", shared)
+        write_page(store, session_id, "own.jpg", os.urandom(100 * 1024))
+        make_idle(store, session_id, 3600 * (3 - index))
+
+    # 350 KB in use, evicting the oldest session frees its own page only
+    removed = store.collect_garbage(keep=["new"])
+
+    assert removed["sessions"] == 1
+    assert sorted(os.listdir(store.sessions_dir)) == ["middle", "new"]
+    assert abs(removed["size_mb"] - store.usage()["size_mb"]) < 1e-9
+    assert store.usage()["size_mb"] * 1024 == 250
+
+
+def test_collect_garbage_frees_shared_page_with_last_session(tmp_path):
+    store = ImageStore(str(tmp_path / "store"), max_mb=0.01, ttl_hours=24)
+    for session_id in ["a", "b"]:
+        write_page(store, session_id, "page.jpg", b"x" * 20 * 1024)
+        make_idle(store, session_id, 3600)
+
+    removed = store.collect_garbage()
+
+    assert removed == {"sessions": 2, "objects": 1, "thumbnails": 0, "size_mb": 0.0}
+    assert store.usage()["size_mb"] == 0
+
+
+def test_collect_garbage_removes_thumbnails_of_pages_no_longer_stored(tmp_path):
+    store = ImageStore(str(tmp_path / "store"), max_mb=100, ttl_hours=1)
+    Image.new("RGB", (600, 900), "white").save(tmp_path / "page.jpg")
+    page = os.path.join(store.session_dir("a"), "page.jpg")
+    shutil.copy(tmp_path / "page.jpg", page)
+    store.add(page)
+    Image.new("RGB", (600, 900), "black").save(tmp_path / "other.jpg")
+    stored = get_thumbnail(page, store=store)
+    unstored = get_thumbnail(str(tmp_path / "other.jpg"), store=store)
+    then = time.time() - 7200
+    for path in (stored, unstored):
+        os.utime(path, (then, then))
+
+    assert store.collect_garbage(keep=["a"])["thumbnails"] == 1
+    assert os.path.exists(stored) and not os.path.exists(unstored)
+
+    store.release("a")
+    assert store.collect_garbage()["thumbnails"] == 1
+    assert not os.listdir(store.thumbnails_dir)
@@ -0,0 +1,73 @@
+import io
+import os
+import zipfile
+
+from PIL import Image
+
+from aisisax.io.image_store import file_sha256
+from aisisax.io.ingest import extract_page, iter_pages, member_path, plan_zip_pages
+
+
+def write_zip(path, names):
+    buffer = io.BytesIO()
+    Image.new("RGB", (20, 10), (200, 180, 150)).save(buffer, "JPEG")
+    with zipfile.ZipFile(path, "w") as archive:
+        for name in names:
+            archive.writestr(name, buffer.getvalue())
+    return path
+
+
+def test_plan_zip_pages(tmp_path):
+    zip_path = write_zip(tmp_path / "ppn.zip", ["PPN1_0001.tif", "sub/PPN1_0002.jpg", "notes.txt", "sub/"])
+    out_dir = str(tmp_path / "out")
+
+    pages = plan_zip_pages(str(zip_path), out_dir)
+
+    assert [(member, out_path) for _, member, out_path in pages] == [
+        ("PPN1_0001.tif", os.path.join(out_dir, "PPN1_0001.jpg")),
+        ("sub/PPN1_0002.jpg", os.path.join(out_dir, "sub", "PPN1_0002.jpg")),
+    ]
+
+
+def test_plan_zip_pages_keeps_malicious_names_inside(tmp_path):
+    names = ["/tmp/absolute.jpg", "../../escaped.jpg", "a/../../b/escaped.tif", "C:\\windows\\drive.png"]
+    zip_path = write_zip(tmp_path / "evil.zip", names)
+    out_dir = tmp_path / "out"
+
+    pages = plan_zip_pages(str(zip_path), str(out_dir))
+
+    assert [out_path for _, _, out_path in pages] == [
+        str(out_dir / "tmp" / "absolute.jpg"),
+        str(out_dir / "escaped.jpg"),
+        str(out_dir / "a" / "b" / "escaped.jpg"),
+        str(out_dir / "windows" / "drive.png"),
+    ]
+    for page in pages:
+        extract_page(*page)
+    assert not (tmp_path / "escaped.jpg").exists()
+    assert all(os.path.isfile(out_path) for _, _, out_path in pages)
+
+
+def test_member_path_without_name(tmp_path):
+    assert member_path(str(tmp_path), "../..") is None
+    assert member_path(str(tmp_path), "/") is None
+
+
+def test_iter_pages_inspects_the_pages_in_the_workers(tmp_path):
+    zip_path = write_zip(tmp_path / "ppn.zip", ["PPN1_0001.jpg"])
+    page = str(tmp_path / "page.jpg")
+    Image.new("RGB", (30, 40), (200, 180, 150)).save(page, "JPEG")
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    pages = plan_zip_pages(str(zip_path), str(tmp_path / "out")) + [(None, page, page), (None, str(broken), str(broken))]
+    timings = {}
+
+    inspected = list(iter_pages(pages, max_workers=2, on_timing=timings.__setitem__,
+                                inspect={"prefilter": True, "sha256": True}))
+
+    assert [path for path, _ in inspected] == [pages[0][2], page, str(broken)]
+    (_, converted), (_, as_is), (_, unreadable) = inspected
+    assert converted["size"] == (20, 10) and converted["prefilter"]["calibration"] is False
+    assert as_is["size"] == (30, 40) and as_is["sha256"] == file_sha256(page)
+    assert unreadable["error"] is not None and unreadable["sha256"] is None
+    assert set(timings[page]) == {"prefilter", "hash"}
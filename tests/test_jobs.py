@@ -0,0 +1,147 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from aisisax.benchmark.archives import write_archive
+from aisisax.benchmark.mock_server import MockConfig, start_server
+from aisisax.io.ingest import plan_zip_pages
+from aisisax.jobs import (JobPreview, JobQueue, KeyStore, run_job, send_api_key, serve_worker_manager,
+                          stop_worker_manager)
+from aisisax.llm.concurrency import FairBudget, RateLimiter
+from aisisax.pipeline import DEFAULT_SETTINGS
+
+
+@pytest.fixture
+def server():
+    server = start_server(MockConfig(latency=0.05, jitter=0))
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def restore_logger():
+    logger = logging.getLogger("tibet_processor")
+    handlers = list(logger.handlers)
+    yield
+    logger.handlers = handlers
+
+
+def submit(queue, server, tmp_path, pages=12):
+    zip_path = str(tmp_path / "3300000001.zip")
+    write_archive(zip_path, pages, size=(400, 150))
+    settings = dict(DEFAULT_SETTINGS, base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key="secret",
+                    model="gpt-4o-mini", use_cache=False, reuse_fields=False, store_results=False,
+                    prefilter=False, max_in_flight=2)
+    return queue.submit("alice", plan_zip_pages(zip_path, str(tmp_path / "img")), settings, "3300000001",
+                        api_key_id="key1")
+
+
+def run(queue, job_id, cancel_after=None):
+    # Runs the next job like the worker does, in a thread instead of a process
+    assert queue.next_job() == job_id
+    cancel = threading.Event()
+    thread = threading.Thread(target=run_job, args=(job_id, queue.path, FairBudget(2), RateLimiter(), cancel, "secret"))
+    thread.start()
+    while thread.is_alive():
+        if cancel_after is not None and not cancel.is_set() and queue.get(job_id)["done"] >= cancel_after:
+            queue.cancel(job_id)
+            cancel.set()  # as the worker does for cancelling jobs
+        time.sleep(0.02)
+    thread.join()
+    return queue.get(job_id)
+
+
+def test_cancel_and_resume_job(server, tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = submit(queue, server, tmp_path)
+    assert queue.get(job_id)["pages"] == 13
+
+    job = run(queue, job_id, cancel_after=3)
+    assert job["status"] == "cancelled"
+    assert 3 <= job["done"] < job["pages"]
+    assert job["preview"] is None
+    assert job["api_key_id"] is None
+    done = job["done"]
+
+    queue.resume(job_id, api_key_id="key2")
+    job = queue.get(job_id)
+    assert job["status"] == "queued"
+    assert job["api_key_id"] == "key2"
+    assert len(queue.pending_pages(job_id)) == job["pages"] - done
+
+    job = run(queue, job_id)
+    assert job["status"] == "done"
+    assert job["done"] == job["pages"]
+    assert not job["failed"]
+    assert len(queue.results(job_id)) == job["results"]
+    assert len(queue.results(job_id, latest=2)) == 2
+    assert queue.log_lines(job_id)
+
+
+def test_cancel_queued_job(server, tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = submit(queue, server, tmp_path, pages=2)
+    queue.cancel(job_id)
+    assert queue.get(job_id)["status"] == "cancelled"
+    assert queue.next_job() is None
+
+    queue.resume(job_id)
+    assert queue.position(job_id) == 0
+    assert run(queue, job_id)["status"] == "done"
+
+
+def test_preview_starts_over_when_a_request_is_retried(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.submit("alice", [], {}, "3300000001")
+    preview = JobPreview(queue, job_id, min_interval=0)
+    preview.on_token(["/img/00000001.jpg"], '{"Frame')
+    preview.on_token(["/img/00000001.jpg"], None)
+    preview.on_token(["/img/00000001.jpg"], '{"Fr')
+    assert queue.get(job_id)["preview"] == '00000001.jpg\n{"Fr'
+
+
+def test_api_key_is_not_stored(server, tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = submit(queue, server, tmp_path, pages=1)
+    assert "api_key" not in queue.get(job_id)["settings"]
+    with sqlite3.connect(queue.path) as conn:
+        assert not any("secret" in str(value) for row in conn.execute("SELECT * FROM jobs") for value in row)
+
+
+def test_api_key_stored_by_an_earlier_version_is_removed(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.submit("alice", [], {}, "3300000001")
+    with sqlite3.connect(queue.path) as conn:
+        conn.execute("UPDATE jobs SET settings = ? WHERE id = ?", (json.dumps({"api_key": "secret"}), job_id))
+
+    job = JobQueue(queue.path).get(job_id)
+    assert job["settings"] == {}
+    assert job["api_key_id"] == "lost"
+
+
+def test_key_store_keeps_the_keys_of_active_jobs():
+    keys = KeyStore()
+    keys.put("key1", "secret1")
+    keys.put("key2", "secret2")
+    keys.prune(["key1"])
+    assert keys.get("key2") == "secret2"  # its job may not be submitted yet
+    keys.prune(["key1"], min_age=0)
+    assert keys.get("key1") == "secret1"
+    assert keys.get("key2") is None
+
+
+def test_send_api_key_to_the_worker(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    with pytest.raises(OSError):
+        send_api_key(queue, "secret", timeout=0)
+
+    manager = serve_worker_manager(queue)
+    try:
+        key_id = send_api_key(queue, "secret")
+        assert manager.KeyStore().get(key_id) == "secret"
+    finally:
+        stop_worker_manager(queue, manager)
@@ -0,0 +1,28 @@
+from PIL import Image, ImageDraw
+
+from aisisax.object_detection.lsa_interface import overlay_detections, rle_decode
+
+
+def test_overlay_detections():
+    image = Image.new("RGB", (600, 200), (225, 210, 180))
+    overlay = image.copy()
+    draw = ImageDraw.Draw(overlay)
+    draw.rectangle([40, 30, 120, 90], outline=(255, 0, 0), width=2)
+    draw.rectangle([400, 100, 449, 149], fill=(0, 200, 0))
+
+    detections = sorted(overlay_detections(image, overlay, ["stamp"]), key=lambda detection: detection["box"])
+
+    assert [detection["box"] for detection in detections] == [[40.0, 30.0, 121.0, 91.0], [400.0, 100.0, 450.0, 150.0]]
+    assert all(detection["prompt"] == "stamp" for detection in detections)
+    assert rle_decode(detections[1]["mask"]).sum() == 50 * 50
+
+
+def test_overlay_detections_several_prompts():
+    image = Image.new("RGB", (100, 100), (225, 210, 180))
+    overlay = image.copy()
+    ImageDraw.Draw(overlay).rectangle([10, 10, 60, 60], fill=(0, 0, 255))
+
+    detections = overlay_detections(image, overlay, ["stamp", "illustration"])
+
+    assert len(detections) == 1
+    assert detections[0]["prompt"] is None
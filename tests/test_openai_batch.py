@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from aisisax.benchmark.mock_server import MockConfig, start_server
+from aisisax.llm.openai_batch import build_request, get_client, run_batch
+
+PROMPT = """"Frame present" (String): Which colour has the frame?
+"Arabic numeral int" (Integer): The Arabic page number, if present.
+"""
+
+
+@pytest.fixture
+def server():
+    server = start_server(MockConfig(latency=0, jitter=0, error_rate=0.3, seed=1))
+    yield server
+    server.shutdown()
+
+
+def requests(count):
+    return [build_request(f"page-{index}", PROMPT, b"\xff\xd8 not really a JPG", "gpt-4o-mini", 0.0, detail="low")
+            for index in range(count)]
+
+
+def test_run_batch_resubmits_failed_requests(server, tmp_path):
+    client = get_client(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1")
+    usage = {}
+    answers, errors = run_batch(client, requests(20), str(tmp_path), poll_interval=0.01, max_attempts=5, usage=usage)
+
+    assert errors == {}
+    assert sorted(answers) == sorted(f"page-{index}" for index in range(20))
+    assert all(set(json.loads(answer)) == {"Frame present", "Arabic numeral int"} for answer in answers.values())
+    assert usage.keys() == answers.keys()
+    # Every attempt after the first only resubmits the requests that failed
+    batches = list(server.state.batches.values())
+    assert len(batches) > 1
+    assert batches[0]["request_counts"]["total"] == 20
+    assert batches[1]["request_counts"]["total"] == batches[0]["request_counts"]["failed"]
+    assert server.state.stats["requests"] == 20 + server.state.stats["errors"]
+
+
+def test_run_batch_reports_requests_failing_every_attempt(server, tmp_path):
+    client = get_client(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1")
+    answers, errors = run_batch(client, requests(20), str(tmp_path), poll_interval=0.01, max_attempts=1)
+
+    assert errors
+    assert len(answers) + len(errors) == 20
+    assert all(error["error"]["type"] == "server_error" for error in errors.values())
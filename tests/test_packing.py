@@ -0,0 +1,31 @@
+import json
+
+from aisisax.llm.packing import packing_prompt, parse_packed_answer
+from aisisax.llm.schema import json_schema
+
+
+def test_packing_prompt_asks_for_the_packed_schema():
+    prompt = packing_prompt("Question", 3)
+    assert '{"pages": [...]}' in prompt
+    assert "exactly 3 objects" in prompt
+    assert json_schema([], packed=True)["required"] == ["pages"]
+
+
+def test_parse_packed_answer_matches_pages_by_index():
+    raw_result = "```json\n" + json.dumps({"pages": [
+        {"Page index": 2, "Frame present": "Red"},
+        {"Frame present": "Black"},
+        {"Page index": 7, "Frame present": "None"},
+    ]}) + "\n```"
+    assert parse_packed_answer(raw_result, 3) == [None, {"Frame present": "Red"}, None]
+
+
+def test_parse_packed_answer_by_position():
+    raw_result = json.dumps({"pages": [{"a": 1}, {"a": 2}]})
+    assert parse_packed_answer(raw_result, 2) == [{"a": 1}, {"a": 2}]
+
+
+def test_parse_packed_answer_without_pages():
+    assert parse_packed_answer('[{"a": 1}]', 2) == [None, None]
+    assert parse_packed_answer('{"a": 1}', 1) == [None]
+    assert parse_packed_answer("no JSON at all", 1) == [None]
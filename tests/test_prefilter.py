@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from aisisax.io.prefilter import prefilter_page
+
+PAPER = (225, 210, 180)
+HEIGHT, WIDTH = 400, 1200
+
+
+def blank_page():
+    rng = np.random.default_rng(0)
+    page = np.empty((HEIGHT, WIDTH, 3), dtype=np.int16)
+    page[:] = PAPER
+    page += rng.integers(-6, 7, size=page.shape, dtype=np.int16)  # scanner noise
+    return page
+
+
+def text_page():
+    rng = np.random.default_rng(1)
+    page = blank_page()
+    for top in range(60, HEIGHT - 60, 35):
+        for left in range(220, WIDTH - 220, 24):
+            page[top:top + rng.integers(10, 22), left:left + rng.integers(6, 18)] = (25, 20, 20)
+    return page
+
+
+def framed_page(colour):
+    page = text_page()
+    for left in (150, WIDTH - 150):
+        page[40:HEIGHT - 40, left:left + 3] = colour
+    return page
+
+
+def stamped_page():
+    page = text_page()
+    y, x = np.ogrid[:HEIGHT, :WIDTH]
+    page[(y - 200) ** 2 + (x - 1000) ** 2 <= 40 ** 2] = (200, 35, 40)
+    return page
+
+
+def calibration_chart():
+    page = np.full((HEIGHT, WIDTH, 3), 120, dtype=np.int16)
+    colours = [(200, 30, 30), (200, 200, 30), (30, 200, 30), (30, 200, 200), (30, 30, 200), (200, 30, 200)]
+    for row in range(2):
+        for column, colour in enumerate(colours):
+            top, left = 60 + row * 160, 60 + column * 185
+            page[top:top + 120, left:left + 150] = colour
+    return page
+
+
+def prefilter(tmp_path, page):
+    path = str(tmp_path / "page.png")
+    Image.fromarray(np.clip(page, 0, 255).astype(np.uint8)).save(path)
+    return prefilter_page(path)
+
+
+def test_blank_page_is_flagged_but_not_answered(tmp_path):
+    assert prefilter(tmp_path, blank_page()) == {"blank": True, "calibration": False, "frame": None, "red_stamp": False}
+
+
+def test_calibration_chart(tmp_path):
+    assert prefilter(tmp_path, calibration_chart())["calibration"]
+
+
+@pytest.mark.parametrize("colour, frame", [((190, 30, 30), "Red"), ((20, 20, 20), "Black")])
+def test_frame_lines(tmp_path, colour, frame):
+    result = prefilter(tmp_path, framed_page(colour))
+    assert result == {"blank": False, "calibration": False, "frame": frame, "red_stamp": False}
+
+
+def test_text_page_without_frame_is_left_to_the_model(tmp_path):
+    assert prefilter(tmp_path, text_page()) == {"blank": False, "calibration": False, "frame": None, "red_stamp": False}
+
+
+def test_red_stamp(tmp_path):
+    result = prefilter(tmp_path, stamped_page())
+    assert result["red_stamp"]
+    assert result["frame"] is None
+
+
+def test_short_line_is_left_to_the_model(tmp_path):
+    page = text_page()
+    page[150:HEIGHT - 100, 150:153] = (190, 30, 30)
+    assert prefilter(tmp_path, page)["frame"] is None
@@ -0,0 +1,40 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from aisisax.io.preprocess import prepare_image
+
+
+def write_page(path, size, quality):
+    img = Image.new("RGB", size, (225, 210, 180))
+    draw = ImageDraw.Draw(img)
+    for top in range(20, size[1] - 20, 30):
+        draw.text((20, top), "Lorem ipsum dolor sit amet " * 20, fill=(20, 20, 20))
+    img.save(path, "JPEG", quality=quality)
+
+
+def test_page_converted_at_the_upload_quality_is_sent_as_it_is(tmp_path):
+    path = str(tmp_path / "page.jpg")
+    write_page(path, (1024, 340), quality=70)
+    image_data, stats = prepare_image(path, quality=70)
+    with open(path, "rb") as f:
+        assert image_data == f.read()
+    assert stats["size"] == stats["original_size"]
+
+
+def test_page_of_higher_quality_is_re_encoded(tmp_path):
+    path = str(tmp_path / "page.jpg")
+    write_page(path, (1024, 340), quality=95)
+    image_data, stats = prepare_image(path, quality=70)
+    assert stats["bytes"] < stats["original_bytes"]
+    with Image.open(io.BytesIO(image_data)) as img:
+        assert img.size == (1024, 340)
+
+
+def test_large_page_is_downscaled(tmp_path):
+    path = str(tmp_path / "page.jpg")
+    write_page(path, (3000, 1000), quality=70)
+    image_data, stats = prepare_image(path, quality=70)
+    with Image.open(io.BytesIO(image_data)) as img:
+        assert img.size == stats["size"]
+    assert stats["size"][1] <= 768
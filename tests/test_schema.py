@@ -0,0 +1,57 @@
+from aisisax.llm.schema import coerce_value, fields_from_prompt, validate_answer
+
+PROMPT = """Answer the following questions about the page.
+"Chinese character present" (Boolean): Is there at least one Chinese character?
+"Arabic numeral int" (Integer): The Arabic page number, if present.
+"Frame present" (String): Which colour has the frame?
+"Illustration caption" (String): The caption of the illustration.
+"""
+
+FIELDS = {field["name"]: field for field in fields_from_prompt(PROMPT)}
+
+
+def test_fields_from_prompt():
+    assert [field["type"] for field in FIELDS.values()] == ["boolean", "integer", "string", "string"]
+    assert FIELDS["Frame present"]["enum"] == ["None", "Red", "Black"]
+    assert "enum" not in FIELDS["Illustration caption"]
+
+
+def test_coerce_boolean():
+    field = FIELDS["Chinese character present"]
+    assert coerce_value(True, field) == (True, True)
+    assert coerce_value(" Yes ", field) == (True, True)
+    assert coerce_value("false", field) == (False, True)
+    assert coerce_value("maybe", field) == (None, False)
+    assert coerce_value(None, field) == (None, False)
+
+
+def test_coerce_integer():
+    field = FIELDS["Arabic numeral int"]
+    assert coerce_value(12, field) == (12, True)
+    assert coerce_value(12.0, field) == (12, True)
+    assert coerce_value("༡༢", field) == (12, True)
+    assert coerce_value("n/a", field) == (None, True)
+    assert coerce_value(None, field) == (None, True)
+    assert coerce_value(True, field) == (None, False)
+    assert coerce_value("twelve", field) == (None, False)
+
+
+def test_coerce_enum_and_string():
+    assert coerce_value("black", FIELDS["Frame present"]) == ("Black", True)
+    assert coerce_value(None, FIELDS["Frame present"]) == ("None", True)
+    assert coerce_value("Blue", FIELDS["Frame present"]) == (None, False)
+    assert coerce_value(3, FIELDS["Illustration caption"]) == ("3", True)
+    assert coerce_value(None, FIELDS["Illustration caption"]) == (None, False)
+
+
+def test_validate_answer():
+    answer = {"Chinese character present": "no", "Arabic numeral int": "x", "Frame present": "RED"}
+    values, invalid = validate_answer(answer, list(FIELDS.values()))
+    assert values == {"Chinese character present": False, "Frame present": "Red"}
+    assert invalid == ["Arabic numeral int", "Illustration caption"]
+
+
+def test_validate_unparsed_answer():
+    values, invalid = validate_answer(None, list(FIELDS.values()))
+    assert values == {}
+    assert invalid == list(FIELDS)